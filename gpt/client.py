@@ -1,162 +1,183 @@
 import asyncio
-import json
-import os
 import time
 import uuid
 
-import aiofiles
 import aiohttp
 
 from gpt.completions import OpenAICompletions
 from gpt.embeddings import OpenAIEmbeddings
+from gpt.journal import ResponseJournal
+from gpt.retry import RetryPolicy
+from gpt.session import SessionPool
+from gpt.scheduler import Scheduler
 
 
 class OpenAI:
-    def __init__(self, model_name: str, backlogs_dir: str or None = None) -> None:
+    def __init__(
+            self,
+            model_name: str,
+            backlogs_dir: str or None = None,
+            concurrency: int = 32,
+            journal_segment_bytes: int = 64 * 2 ** 20,
+            journal_max_bytes: int = 1024 * 2 ** 20,
+            base_url: str = None,
+            retry_policy: RetryPolicy = None,
+            session_pool: SessionPool = None
+    ) -> None:
         """
         Initializes the OpenAI client
 
         :param model_name: name of the model to use
-        :param backlogs_dir: directory to save the backlogs
+        :param backlogs_dir: directory to save the backlogs (as an append-only response journal)
+        :param concurrency: maximum number of requests in flight
+        :param journal_segment_bytes: size at which a journal segment is rotated
+        :param journal_max_bytes: maximum size of the journal of each backlogs directory (0 keeps everything)
+        :param base_url: base URL of an OpenAI-compatible API replacing https://api.openai.com/v1
+        :param retry_policy: policy deciding how failed requests are retried (shared by all requests)
+        :param session_pool: HTTP connection pool to share with other clients (a private one by default)
 
         :return: None
         """
         self.model_name = model_name
 
         if self.model_name in OpenAICompletions.model_support:
-            self.client = OpenAICompletions(self.model_name)
+            self.client = OpenAICompletions(self.model_name, base_url=base_url)
         elif self.model_name in OpenAIEmbeddings.model_support:
-            self.client = OpenAIEmbeddings(self.model_name)
+            self.client = OpenAIEmbeddings(self.model_name, base_url=base_url)
         else:
             raise ValueError(f"Model {self.model_name} not supported")
 
         self.save_backlogs = True if backlogs_dir else False
         self.backlogs_dir = backlogs_dir
+        self.journal_segment_bytes = journal_segment_bytes
+        self.journal_max_bytes = journal_max_bytes
+        self._journals = {}
 
-        self._session = None
+        self.scheduler = Scheduler(concurrency)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.last_batch_stats = {}
+
+        self.session_pool = session_pool or SessionPool(limit_per_host=max(concurrency, 1))
+        self._owns_session_pool = session_pool is None
         self._pool = []
 
     def __repr__(self):
         return f"OpenAI(model_name={self.model_name})"
 
-    async def make_session(self):
-        self._session = aiohttp.ClientSession()
-
-    async def close_session(self):
-        await self._session.close()
-        self._session = None
-
-    @staticmethod
-    async def _read_json(path: str, default: dict or list = None) -> dict or list:
+    @property
+    def journal(self) -> ResponseJournal or None:
         """
-        Read a JSON file asynchronously
-
-        :param path: Path to the JSON file
-        :param default: Default value to return if file is not found or corrupted
+        Response journal of the current backlogs directory
 
-        :return: JSON data
+        :return: ResponseJournal or None if backlogs are not saved
         """
-        try:
-            async with aiofiles.open(path, "r") as file:
-                return json.loads(await file.read())
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {} if default is None else default
-
-    @staticmethod
-    async def _write_json(path: str, data: dict, indent: int = 4) -> None:
+        if not self.backlogs_dir:
+            return None
+        if self.backlogs_dir not in self._journals:
+            self._journals[self.backlogs_dir] = ResponseJournal(
+                self.backlogs_dir, segment_bytes=self.journal_segment_bytes, max_bytes=self.journal_max_bytes)
+        return self._journals[self.backlogs_dir]
+
+    async def close(self) -> None:
         """
-        Write data to a JSON file asynchronously
-
-        :param path: Path to the JSON file
-        :param data: Data to write
-        :param indent: Indentation level
+        Writes out the queued backlogs, closes the journals and the private connection pool
 
         :return: None
         """
-        if not path.endswith(".json"):
-            path += ".json"
-
-        try:
-            async with aiofiles.open(path, "w") as file:
-                await file.write(json.dumps(data, indent=indent))
-        except Exception as e:
-            print(f"Error Writing JSON: {e}")
+        for journal in self._journals.values():
+            await journal.close()
+        if self._owns_session_pool:
+            await self.session_pool.close()
 
     async def _save_resp(self, result) -> None:
         """
-        Save the result to the cache directory
+        Queues the result for the response journal of the backlogs directory
 
         :param result: dictionary of the response information
 
         :return: None
         """
-        if not self.save_backlogs:
+        if not self.save_backlogs or self.journal is None:
             return
 
-        path = os.path.join(self.backlogs_dir, f"{result['identifier']}.json")
-        cache = await self._read_json(path, default=[]) + [result]
-        await self._write_json(path, cache, indent=4)
+        self.journal.append(result)
 
     async def get_response(
             self,
             context: list or str,
-            identifier: str = None,
+            identifier: str or list = None,
             max_attempts: int = 3,
             backoff_time: int = 1,
             session: aiohttp.ClientSession or None = None,
             body: dict = None,
+            lane: str = "interactive",
             **kwargs
-    ) -> dict:
+    ) -> dict or list:
         """
         Get the response from the OpenAI model
 
+        A list of texts posted to an embeddings model is packed into one multi-input request and
+        answered with one response per text, each saved and returned under its own identifier.
+
         :param context: context to post to the model
-        :param identifier: unique identifier for the request
+        :param identifier: unique identifier for the request (one per text for packed embeddings)
         :param max_attempts: maximum number of attempts
-        :param backoff_time: backoff time between attempts
-        :param session: aiohttp session for batch processing
+        :param backoff_time: base backoff time between attempts (see RetryPolicy)
+        :param session: aiohttp session to use instead of the client's connection pool
         :param body: body for the request to track the request
+        :param lane: priority lane of the request in the scheduler ("interactive" or "bulk")
         :param kwargs: additional parameters to pass to the model
 
-        :return: dictionary of the response information
+        :return: dictionary of the response information (a list of them for packed embeddings)
         """
-        init_ts = time.time()
-        identifier = identifier if identifier else str(uuid.uuid4())
-
-        if self._session:
-            response = await self.client.call_model(context, self._session, **kwargs)
-        elif session:
-            response = await self.client.call_model(context, session, **kwargs)
+        packed = self.client.model_type == "embeddings" and isinstance(context, list)
+        if packed:
+            identifier = identifier if identifier else [str(uuid.uuid4()) for _ in context]
         else:
-            async with aiohttp.ClientSession() as disp_session:
-                response = await self.client.call_model(context, disp_session, **kwargs)
-
-        last_ts = time.time()
-        response.update({
-            "init_ts": init_ts,
-            "identifier": identifier,
-            "last_ts": last_ts,
-            "duration": last_ts - init_ts,
-            "body": body
-        })
-        await self._save_resp(response)
-
-        if response["status"] >= 500:
-            if response["status"] != 503 and max_attempts < 0:
-                return response
-
-            await asyncio.sleep(backoff_time)
-            return await self.get_response(
-                context=context,
-                identifier=identifier,
-                max_attempts=max_attempts - 1,
-                backoff_time=backoff_time * 2,
-                session=session,
-                body=body,
-                **kwargs)
+            identifier = identifier if identifier else str(uuid.uuid4())
+
+        for attempt in range(max(1, max_attempts)):
+            retried = attempt < max_attempts - 1
+            init_ts = time.time()
+            try:
+                async with self.scheduler.slot(lane):
+                    response = await self.client.call_model(
+                        context, session or await self.session_pool.session(), **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                self.scheduler.pause(self.retry_policy.record("connection", retried))
+                if not retried:
+                    raise
+                await asyncio.sleep(self.retry_policy.delay(attempt, backoff_time))
+                continue
+
+            last_ts = time.time()
+            responses = self.client.split_response(response, context) if packed else [response]
+            for item, item_identifier in zip(responses, identifier if packed else [identifier]):
+                item.update({
+                    "init_ts": init_ts,
+                    "identifier": item_identifier,
+                    "last_ts": last_ts,
+                    "duration": last_ts - init_ts,
+                    "attempt": attempt + 1,
+                    "body": body
+                })
+                await self._save_resp(item)
+
+            retried = retried and self.retry_policy.should_retry(response["status"])
+            self.scheduler.pause(self.retry_policy.record(response["status"], retried))
+            if not retried:
+                break
+
+            if response["status"] == 429 and response.get("retry_after"):
+                # the rate limit applies to every request of the key, not only to this one
+                self.scheduler.pause(response["retry_after"])
+            await asyncio.sleep(self.retry_policy.delay(attempt, backoff_time, response.get("retry_after")))
+
+        if packed:
+            return responses
 
         if response["body"]:
-            response["body"][self.client.model_type.title()[:-1]] = response["output"]
+            response["body"][self.client.model_type.title()[:-1]] = response.get("output")
 
         return response
 
@@ -167,6 +188,7 @@ class OpenAI:
             max_attempts: int = 3,
             backoff_time: int = 1,
             body: dict = None,
+            lane: str = "bulk",
             **kwargs
     ) -> None:
         """
@@ -178,35 +200,90 @@ class OpenAI:
         :param max_attempts: maximum number of attempts
         :param backoff_time: backoff time between attempts
         :param body: body for the request to track the request
+        :param lane: priority lane of the request in the scheduler ("interactive" or "bulk")
         :param kwargs: additional parameters to pass to the model
 
         :return: None
         """
-        self._pool.append((context, identifier, max_attempts, backoff_time, body, kwargs))
+        self._pool.append((context, identifier, max_attempts, backoff_time, body, lane, kwargs))
+
+    async def stream_get_response(self):
+        """
+        Processes all the requests in the requests pool, yielding the responses as they complete
+
+        Requests run through the scheduler, so at most `concurrency` of them are in flight and the
+        callers can persist the responses incrementally. Embedding requests are packed into
+        multi-input requests (see OpenAIEmbeddings.pack). The statistics of the batch are kept in
+        `last_batch_stats`, per lane, once it is exhausted.
+
+        :return: async generator of dictionaries of the response information
+        """
+        async for _, response in self._stream_pool():
+            yield response
 
     async def batch_get_response(self):
         """
         Batch process all the requests in the requests pool
 
-        :return: list of dictionaries of the response information
+        :return: list of dictionaries of the response information, in the order the requests were added
         """
+        responses = [None] * len(self._pool)
+        async for position, response in self._stream_pool():
+            responses[position] = response
+        return responses
+
+    async def _stream_pool(self):
         if not self._pool:
-            return []
+            return
 
-        await self.make_session()
-        tasks_pool = [
-            self.get_response(
+        pool, self._pool = self._pool, []
+        self.last_batch_stats = {}
+        jobs = []
+        for positions in self._pack(pool):
+            context, identifier, max_attempts, backoff_time, body, lane, kwargs = pool[positions[0]]
+            if len(positions) > 1:
+                context = [pool[position][0] for position in positions]
+                identifier = [pool[position][1] or str(uuid.uuid4()) for position in positions]
+            jobs.append((positions, lane, dict(
                 context=context,
                 identifier=identifier,
                 max_attempts=max_attempts,
                 backoff_time=backoff_time,
                 body=body,
-                **kwargs)
-            for context, identifier, max_attempts, backoff_time, body, kwargs in self._pool
-        ]
-        responses = await asyncio.gather(*tasks_pool)
-
-        await self.close_session()
-        self._pool = []
-
-        return responses
+                lane=lane,
+                **kwargs)))
+
+        async def run(positions, params):
+            response = await self.get_response(**params)
+            return zip(positions, response if len(positions) > 1 else [response])
+
+        for lane in Scheduler.lanes:
+            batch = self.scheduler.batch([
+                lambda positions=positions, params=params: run(positions, params)
+                for positions, job_lane, params in jobs if job_lane == lane
+            ], lane=lane)
+            if not batch.jobs:
+                continue
+            async for responses in batch:
+                for position, response in responses:
+                    yield position, response
+            self.last_batch_stats[lane] = batch.stats
+
+    def _pack(self, pool: list) -> list:
+        if self.client.model_type != "embeddings":
+            return [[position] for position in range(len(pool))]
+
+        # consecutive texts sharing their request options are packed together
+        groups = []
+        for position, request in enumerate(pool):
+            context, _, max_attempts, backoff_time, body, lane, kwargs = request
+            key = (max_attempts, backoff_time, lane, kwargs)
+            if not groups or groups[-1][0] != key or body is not None or pool[groups[-1][1][-1]][4] is not None:
+                groups.append((key, []))
+            groups[-1][1].append(position)
+
+        packed = []
+        for _, positions in groups:
+            token_counts = [self.client.tokenizer.count_tokens(pool[position][0]) for position in positions]
+            packed.extend(positions[start:end] for start, end in self.client.pack(token_counts))
+        return packed
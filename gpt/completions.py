@@ -1,11 +1,12 @@
 import json
 from typing import Literal, Union
+from urllib.parse import urlparse
 
 import aiohttp
 from dotenv import find_dotenv, get_key
-from openai import AsyncOpenAI
 
 from gpt.limiter import Limiter
+from gpt.retry import RetryPolicy
 from gpt.tokenizer import Tokenizer
 from gpt.models import models
 
@@ -22,59 +23,79 @@ class OpenAICompletions:
     ]
     model_type = "completions"
 
-    def __init__(self, model_name: str = "gpt-3.5-turbo"):
+    def __init__(self, model_name: str = "gpt-3.5-turbo", base_url: str = None):
         """
         Initializes the OpenAI Chat native client
 
         :param model_name: name of the model to use
+        :param base_url: base URL of an OpenAI-compatible API replacing https://api.openai.com/v1
 
         :return: None
         """
         self.specs = models[model_name]
         self._name = self.specs["model_name"]
         self._endpoint = self.specs["endpoint"]
+        if base_url:
+            self._endpoint = base_url.rstrip("/") + urlparse(self._endpoint).path.removeprefix("/v1")
 
-        self._openai = AsyncOpenAI(api_key=self._api_key)
         self._limiter = Limiter(self.specs)
         self.tokenizer = Tokenizer(self.specs)
 
-    async def _stream(self, params: dict) -> dict:
+    @property
+    def endpoint(self) -> str:
+        return self._endpoint
+
+    async def _stream(self, session: aiohttp.ClientSession, params: dict) -> dict:
         """
-        Streams the response from the OpenAI model
+        Streams the response from the OpenAI model as server-sent events
 
+        :param session: aiohttp session
         :param params: parameters used to generate the response
 
         :return: dictionary of the response information
         """
         output, usage, status, error = "", {}, 500, "INCOMPLETE"
-        listener = await self._openai.chat.completions.create(
-            model=params["model"],
-            messages=params["messages"],
-            temperature=params["temperature"],
-            max_tokens=params["max_tokens"],
-            response_format={
-                "type": params["response_format"]["type"]
-            },
-            stream_options={
-                "include_usage": True
-            },
-            stream=True)
-
-        async for chunk in listener:
-            if not chunk.choices and chunk.usage:
-                usage = dict(chunk.usage)
-                error, status = "OK", 200
-                break
-            token = chunk.choices[0].delta.content
-            if token is not None:
-                output += token
-                print(token)
+        async with session.post(
+                headers={
+                    "Authorization": f"Bearer {self._api_key}"
+                },
+                url=self._endpoint,
+                json={**params, "stream_options": {"include_usage": True}}
+        ) as resp:
+            self._limiter.adapt(resp.headers)
+            if resp.status != 200:
+                return {
+                    "params": params,
+                    "status": resp.status,
+                    "error": resp.reason,
+                    "retry_after": RetryPolicy.retry_after(resp.headers),
+                    "data": {"error": await resp.text()}
+                }
+
+            async for line in resp.content:
+                line = line.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+
+                chunk = json.loads(data)
+                if not chunk.get("choices") and chunk.get("usage"):
+                    usage = chunk["usage"]
+                    error, status = "OK", 200
+                    continue
+                token = chunk["choices"][0]["delta"].get("content") if chunk.get("choices") else None
+                if token is not None:
+                    output += token
+                    print(token)
 
         return {
             "output": output,
             "usage": usage,
             "status": status,
             "error": error,
+            "retry_after": None,
             "data": {}
         }
 
@@ -93,14 +114,20 @@ class OpenAICompletions:
                 url=self._endpoint,
                 json=params
         ) as resp:
-            data = await resp.json()
+            try:
+                data = await resp.json()
+            except (aiohttp.ContentTypeError, ValueError):
+                data = {"error": await resp.text()}
             status = resp.status
             error = resp.reason
+            retry_after = RetryPolicy.retry_after(resp.headers)
+            self._limiter.adapt(resp.headers)
 
         return {
             "params": params,
             "status": status,
             "error": error,
+            "retry_after": retry_after,
             "data": data
         }
 
@@ -143,7 +170,7 @@ class OpenAICompletions:
 
         await self._limiter.limit(tokens=self.tokenizer.count_tokens(context), requests=1)
         if stream and channel:
-            response = await self._stream(params)
+            response = await self._stream(session, params)
         else:
             response = await self._post(session, params)
 
@@ -1,11 +1,13 @@
 import base64
 from typing import Literal
+from urllib.parse import urlparse
 
 import aiohttp
 from dotenv import find_dotenv, get_key
 import numpy as np
 
 from gpt.limiter import Limiter
+from gpt.retry import RetryPolicy
 from gpt.tokenizer import Tokenizer
 from gpt.models import models
 
@@ -21,21 +23,38 @@ class OpenAIEmbeddings:
     ]
     model_type = "embeddings"
 
-    def __init__(self, model_name: str = "text-embedding-3-large") -> None:
+    def __init__(
+            self,
+            model_name: str = "text-embedding-3-large",
+            max_inputs: int = 256,
+            max_tokens: int = 131072,
+            base_url: str = None
+    ) -> None:
         """
         Initializes the OpenAI Embedding native client
 
         :param model_name: name of the model to use
+        :param max_inputs: maximum number of inputs packed into one request (API limit: 2048)
+        :param max_tokens: maximum number of tokens packed into one request (API limit: 300000)
+        :param base_url: base URL of an OpenAI-compatible API replacing https://api.openai.com/v1
 
         :return: None
         """
         self.specs = models[model_name]
         self._name = self.specs["model_name"]
         self._endpoint = self.specs["endpoint"]
+        if base_url:
+            self._endpoint = base_url.rstrip("/") + urlparse(self._endpoint).path.removeprefix("/v1")
+        self.max_inputs = max_inputs
+        self.max_tokens = max_tokens
 
         self._limiter = Limiter(self.specs)
         self.tokenizer = Tokenizer(self.specs)
 
+    @property
+    def endpoint(self) -> str:
+        return self._endpoint
+
     async def _post(self, session: aiohttp.ClientSession, params: dict) -> dict:
         """
         Posts the params to the OpenAI model API
@@ -51,46 +70,106 @@ class OpenAIEmbeddings:
                 url=self._endpoint,
                 json=params
         ) as resp:
-            data = await resp.json()
+            try:
+                data = await resp.json()
+            except (aiohttp.ContentTypeError, ValueError):
+                data = {"error": await resp.text()}
             status = resp.status
             error = resp.reason
+            retry_after = RetryPolicy.retry_after(resp.headers)
+            self._limiter.adapt(resp.headers)
 
         return {
             "params": params,
             "status": status,
             "error": error,
+            "retry_after": retry_after,
             "data": data
         }
 
+    def pack(self, token_counts: list) -> list:
+        """
+        Groups consecutive inputs into multi-input requests bounded by `max_inputs` and `max_tokens`
+
+        :param token_counts: number of tokens of each input
+
+        :return: list of (start, end) index ranges, one per request
+        """
+        batches, start, tokens = [], 0, 0
+        for end, count in enumerate(token_counts):
+            if end > start and (end - start >= self.max_inputs or tokens + count > self.max_tokens):
+                batches.append((start, end))
+                start, tokens = end, 0
+            tokens += count
+        if start < len(token_counts):
+            batches.append((start, len(token_counts)))
+        return batches
+
+    def split_response(self, response: dict, contexts: list) -> list:
+        """
+        Splits a multi-input response into one response per input
+
+        :param response: response of call_model for a list of contexts
+        :param contexts: the posted contexts
+
+        :return: list of response dictionaries, one per context
+        """
+        responses = []
+        for i, context in enumerate(contexts):
+            item = {
+                **response,
+                "params": {**response["params"], "input": [context]},
+                "output": None,
+            }
+            if response["status"] == 200:
+                item.update({
+                    "output": response["output"][i],
+                    "usage": self.tokenizer.parse_usage({"prompt_tokens": self.tokenizer.count_tokens(context)}),
+                    "data": {**response["data"], "data": [response["data"]["data"][i]]}
+                })
+            responses.append(item)
+        return responses
+
     async def call_model(
             self,
-            context: str,
+            context: str or list,
             session: aiohttp.ClientSession,
-            encoding_format: Literal["float", "base64"] = "float"
+            encoding_format: Literal["float", "base64"] = "base64",
+            dimensions: int = None
     ) -> dict:
         """
         Posts the context to the OpenAI Embedding model
 
-        :param context: context to post
+        :param context: context to post, or a list of contexts packed into one request
         :param session: aiohttp session
-        :param encoding_format: "float" or "base64"
+        :param encoding_format: "base64" (float32 bytes, about a third of the JSON floats) or "float"
+        :param dimensions: number of leading dimensions to return (None returns the model's full output)
 
-        :return: dictionary of the response information
+        :return: dictionary of the response information (outputs are float32 arrays)
         """
         params = {
             "model": self._name,
             "encoding_format": encoding_format,
-            "input": [context],
+            "input": context if isinstance(context, list) else [context],
         }
+        if dimensions:
+            if not 0 < dimensions <= self.specs["output_dimensions"]:
+                raise ValueError(f"Invalid dimensions: {dimensions} - Max: {self.specs['output_dimensions']}")
+            params["dimensions"] = dimensions
 
-        await self._limiter.limit(tokens=self.tokenizer.count_tokens(context), requests=1)
+        await self._limiter.limit(tokens=sum(self.tokenizer.count_tokens(c) for c in params["input"]), requests=1)
         response = await self._post(session, params)
 
         if response["status"] == 200:
-            output = response["data"]["data"][0].pop("embedding", None)
-            usage = response["data"].pop("usage", {})
+            items = sorted(response["data"]["data"], key=lambda item: item["index"])
+            response["data"]["data"] = items
+            outputs = [item.pop("embedding", None) for item in items]
             if encoding_format == "base64":
-                output = np.frombuffer(base64.b64decode(output), dtype="float32").tolist()
+                outputs = [np.frombuffer(base64.b64decode(output), dtype="<f4") for output in outputs]
+            else:
+                outputs = [np.asarray(output, dtype=np.float32) for output in outputs]
+            output = outputs if isinstance(context, list) else outputs[0]
+            usage = response["data"].pop("usage", {})
             usage = self.tokenizer.parse_usage(usage)
             response.update({
                 "params": params,
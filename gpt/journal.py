@@ -0,0 +1,182 @@
+import asyncio
+import glob
+import json
+import os
+
+from helpers.files import FileTools
+
+
+class ResponseJournal:
+    def __init__(self, path: str, segment_bytes: int = 64 * 2 ** 20, max_bytes: int = 1024 * 2 ** 20) -> None:
+        """
+        Initializes the append-only response journal
+
+        Responses are appended as JSON lines to numbered segment files (journal-<n>.jsonl) by a single
+        background writer task, so persisting a response costs one sequential write instead of a
+        read-modify-write of a per-identifier file. A segment is closed once it reaches
+        `segment_bytes`; the oldest segments are dropped once the journal outgrows `max_bytes`.
+        Every record is also appended to journal.idx as "<identifier> <segment> <offset> <length>",
+        which is all that is read on startup to look responses up by identifier.
+
+        :param path: directory of the journal
+        :param segment_bytes: size at which a segment is rotated
+        :param max_bytes: maximum size of the journal (0 keeps every segment)
+
+        :return: None
+        """
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self._index_path = os.path.join(path, "journal.idx")
+
+        self._index = {}
+        self._segments = []
+        self._loaded = False
+        self._queue = None
+        self._writer = None
+        self._file = None
+        self._index_file = None
+
+    def __repr__(self):
+        return f"ResponseJournal(path={self.path}, segments={len(self._segments)}, identifiers={len(self._index)})"
+
+    def __contains__(self, identifier: str) -> bool:
+        self._load()
+        return identifier in self._index
+
+    def append(self, response: dict) -> None:
+        """
+        Queues a response for the background writer
+
+        :param response: dictionary of the response information (must hold its identifier)
+
+        :return: None
+        """
+        self._load()
+        if self._writer is None or self._writer.done():
+            self._queue = asyncio.Queue()
+            self._writer = asyncio.create_task(self._write())
+        self._queue.put_nowait(response)
+
+    def get(self, identifier: str) -> list:
+        """
+        Reads every journaled response of an identifier
+
+        :param identifier: unique identifier of the request
+
+        :return: list of response dictionaries, oldest first
+        """
+        self._load()
+        responses = []
+        for segment, offset, length in self._index.get(identifier, []):
+            try:
+                with open(self._segment_path(segment), "rb") as file:
+                    file.seek(offset)
+                    responses.append(json.loads(file.read(length)))
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+        return responses
+
+    async def flush(self) -> None:
+        """
+        Waits until every queued response is written to disk
+
+        :return: None
+        """
+        if self._queue is not None:
+            await self._queue.join()
+        for file in (self._file, self._index_file):
+            if file is not None:
+                file.flush()
+
+    async def close(self) -> None:
+        """
+        Flushes the queued responses and stops the writer
+
+        :return: None
+        """
+        await self.flush()
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        for file in (self._file, self._index_file):
+            if file is not None:
+                file.close()
+        self._file = self._index_file = None
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+
+        os.makedirs(self.path, exist_ok=True)
+        self._segments = sorted(
+            int(os.path.basename(path)[8:-6])
+            for path in glob.glob(os.path.join(self.path, "journal-*.jsonl")))
+        try:
+            with open(self._index_path, "r") as file:
+                for line in file:
+                    parts = line.split()
+                    if len(parts) == 4:
+                        self._index.setdefault(parts[0], []).append((int(parts[1]), int(parts[2]), int(parts[3])))
+        except FileNotFoundError:
+            pass
+
+    async def _write(self) -> None:
+        while True:
+            responses = [await self._queue.get()]
+            while not self._queue.empty():
+                responses.append(self._queue.get_nowait())
+            try:
+                for response in responses:
+                    self._write_record(response)
+                self._file.flush()
+                self._index_file.flush()
+            except Exception as e:
+                print(f"Error Writing Response Journal: {e}")
+            finally:
+                for _ in responses:
+                    self._queue.task_done()
+
+    def _write_record(self, response: dict) -> None:
+        if self._file is None or self._file.tell() >= self.segment_bytes:
+            self._rotate()
+
+        record = (json.dumps(response, default=FileTools.json_default) + "\n").encode("utf-8")
+        offset = self._file.tell()
+        self._file.write(record)
+        entry = (self._segments[-1], offset, len(record))
+        self._index.setdefault(str(response["identifier"]), []).append(entry)
+        self._index_file.write(f"{response['identifier']} {entry[0]} {entry[1]} {entry[2]}\n")
+
+    def _rotate(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        if self._index_file is None:
+            self._index_file = open(self._index_path, "a")
+
+        # the last segment is reused while it has room, so restarts do not leave small segments behind
+        if not self._segments or self._file is not None or os.path.getsize(self._segment_path(self._segments[-1])) >= self.segment_bytes:
+            self._segments.append(self._segments[-1] + 1 if self._segments else 1)
+        self._file = open(self._segment_path(self._segments[-1]), "ab")
+
+        if self.max_bytes:
+            while len(self._segments) > 1 and sum(
+                    os.path.getsize(self._segment_path(segment)) for segment in self._segments) > self.max_bytes:
+                self._drop(self._segments.pop(0))
+
+    def _drop(self, segment: int) -> None:
+        os.remove(self._segment_path(segment))
+        for identifier in list(self._index):
+            self._index[identifier] = [entry for entry in self._index[identifier] if entry[0] != segment]
+            if not self._index[identifier]:
+                del self._index[identifier]
+        self._index_file.close()
+        with open(self._index_path, "w") as file:
+            for identifier, entries in self._index.items():
+                for entry in entries:
+                    file.write(f"{identifier} {entry[0]} {entry[1]} {entry[2]}\n")
+        self._index_file = open(self._index_path, "a")
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.path, f"journal-{segment:06d}.jsonl")
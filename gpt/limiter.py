@@ -1,24 +1,43 @@
 import asyncio
+from collections import deque
+import re
 import time
 
 
 class TokenBucket:
-    def __init__(self, size: int = 0) -> None:
+    def __init__(self, size: float = 0) -> None:
         """
         Initializes the Token Bucket Rate Limiter
 
+        The bucket refills continuously at `size` tokens per minute. Waiters are served in arrival
+        order and the bucket wakes up exactly when the first of them can be served, instead of
+        polling, so a large request is never starved by a stream of small ones.
+
         :param size: size of the bucket
 
         :return: None
         """
 
-        self._maximum_size = size
-        self._current_size = size
+        self._maximum_size = float(size)
+        self._current_size = float(size)
         self._consume_per_second = size / 60
-        self._last_fill_time = time.time()
-        self._lock = asyncio.Lock()
+        self._last_fill_time = time.monotonic()
+        self._waiters = deque()
+        self._timer = None
+
+    def __repr__(self):
+        return f"TokenBucket(size={round(self._maximum_size)}, available={round(self.available)}, waiting={len(self._waiters)})"
+
+    @property
+    def size(self) -> float:
+        return self._maximum_size
+
+    @property
+    def available(self) -> float:
+        self._refill()
+        return self._current_size
 
-    async def consume(self, amount: int = 0) -> None:
+    async def consume(self, amount: float = 0) -> None:
         """
         Consumes the amount of tokens
 
@@ -30,17 +49,80 @@ class TokenBucket:
         if amount == 0:
             return
 
-        async with self._lock:
-            if amount > self._maximum_size:
-                raise ValueError("Amount exceeds bucket size.")
+        if amount > self._maximum_size:
+            raise ValueError("Amount exceeds bucket size.")
+
+        self._refill()
+        if not self._waiters and amount <= self._current_size:
+            self._current_size -= amount
+            return
 
-            self._refill()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append((waiter, amount))
+        self._wake()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._current_size = min(self._maximum_size, self._current_size + amount)
+            elif (waiter, amount) in self._waiters:
+                self._waiters.remove((waiter, amount))
+            self._wake()
+            raise
+
+    def resize(self, size: float, remaining: float = None, reset: float = None) -> None:
+        """
+        Adapts the bucket to the limits reported by the API
+
+        :param size: new size of the bucket (tokens per minute)
+        :param remaining: tokens the API reports as still available (the bucket never holds more)
+        :param reset: seconds until the API refills an exhausted budget (refills are held back until then)
 
-            while amount > self._current_size:
-                await asyncio.sleep(0.1)
-                self._refill()
+        :return: None
+        """
+        self._refill()
+        if size > 0:
+            if size > self._maximum_size:
+                self._current_size += size - self._maximum_size
+            self._maximum_size = float(size)
+            self._consume_per_second = size / 60
+        if remaining is not None:
+            self._current_size = min(self._current_size, max(remaining, 0.0))
+            if remaining < 1 and reset:
+                self._last_fill_time = max(self._last_fill_time, time.monotonic() + reset)
+        self._current_size = min(self._current_size, self._maximum_size)
+        self._wake()
+
+    def _wake(self) -> None:
+        """
+        Serves the waiters that fit in the bucket and schedules the next wake-up
 
+        :return: None
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        self._refill()
+        while self._waiters:
+            waiter, amount = self._waiters[0]
+            if waiter.done():
+                self._waiters.popleft()
+                continue
+            if amount > self._maximum_size:
+                self._waiters.popleft()
+                waiter.set_exception(ValueError("Amount exceeds bucket size."))
+                continue
+            if amount > self._current_size:
+                break
+            self._waiters.popleft()
             self._current_size -= amount
+            waiter.set_result(None)
+
+        if self._waiters and self._consume_per_second > 0:
+            delay = (self._waiters[0][1] - self._current_size) / self._consume_per_second
+            delay += max(self._last_fill_time - time.monotonic(), 0.0)
+            self._timer = asyncio.get_running_loop().call_later(max(delay, 0.0), self._wake)
 
     def _refill(self) -> None:
         """
@@ -49,25 +131,38 @@ class TokenBucket:
         :return: None
         """
 
-        now = time.time()
+        now = time.monotonic()
+        if now < self._last_fill_time:
+            return
         elapsed = now - self._last_fill_time
-        refilled_tokens = int(elapsed * self._consume_per_second)
+        refilled_tokens = elapsed * self._consume_per_second
         self._current_size = min(self._maximum_size, self._current_size + refilled_tokens)
         self._last_fill_time = now
 
 
 class Limiter:
-    def __init__(self, model_specs: dict = None) -> None:
+    _duration = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+    _units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+    def __init__(self, model_specs: dict = None, headroom: float = 0.9) -> None:
         """
         Initializes the OpenAI API Rate Limiter
 
+        The buckets start from the static rate limits of the model and are adapted to the limits of
+        the organization from the x-ratelimit-* headers of every response (see `adapt`).
+
         :param model_specs: dictionary of model specifications
+        :param headroom: fraction of the rate limits to use
 
         :return: None
         """
 
-        self._tkn_limiter = TokenBucket(size=model_specs["rate_limits"]["tkn_per_min"] * 0.9)
-        self._req_limiter = TokenBucket(size=model_specs["rate_limits"]["req_per_min"] * 0.9)
+        self.headroom = headroom
+        self._tkn_limiter = TokenBucket(size=model_specs["rate_limits"]["tkn_per_min"] * headroom)
+        self._req_limiter = TokenBucket(size=model_specs["rate_limits"]["req_per_min"] * headroom)
+
+    def __repr__(self):
+        return f"Limiter(tokens={self._tkn_limiter}, requests={self._req_limiter})"
 
     async def limit(self, tokens: int = 0, requests: int = 0) -> None:
         """
@@ -80,6 +175,52 @@ class Limiter:
         """
 
         await asyncio.gather(
-            self._tkn_limiter.consume(tokens),
+            self._tkn_limiter.consume(min(tokens, self._tkn_limiter.size)),
             self._req_limiter.consume(requests)
         )
+
+    def adapt(self, headers: dict) -> None:
+        """
+        Adapts the buckets to the x-ratelimit-* headers of a response
+
+        The limit headers resize the buckets to the real limits of the organization and the
+        remaining headers cap what the buckets hold, so the limiter follows the API's own
+        accounting (including requests made by other processes sharing the key).
+
+        :param headers: response headers
+
+        :return: None
+        """
+        for kind, bucket in (("tokens", self._tkn_limiter), ("requests", self._req_limiter)):
+            limit = self._number(headers.get(f"x-ratelimit-limit-{kind}"))
+            remaining = self._number(headers.get(f"x-ratelimit-remaining-{kind}"))
+            if limit is None and remaining is None:
+                continue
+
+            bucket.resize(
+                size=limit * self.headroom if limit else bucket.size,
+                remaining=remaining,
+                reset=self.duration(headers.get(f"x-ratelimit-reset-{kind}")))
+
+    @classmethod
+    def duration(cls, value: str or None) -> float or None:
+        """
+        Parses a rate limit reset duration (e.g. "6m0s", "1.5s", "12ms")
+
+        :param value: duration string
+
+        :return: duration in seconds or None if it cannot be parsed
+        """
+        if not value:
+            return None
+        parts = cls._duration.findall(value)
+        if not parts:
+            return None
+        return sum(float(amount) * cls._units[unit] for amount, unit in parts)
+
+    @staticmethod
+    def _number(value: str or None) -> float or None:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
@@ -24,7 +24,7 @@ models = {
             "input": 0.01 / 1000,
             "output": 0.03 / 1000
         },
-        "limits": {
+        "rate_limits": {
             "tkn_per_min": 600000,
             "req_per_min": 5000
         },
@@ -0,0 +1,109 @@
+from collections import Counter
+from email.utils import parsedate_to_datetime
+import random
+import time
+
+
+class RetryPolicy:
+    retry_statuses = (408, 409, 429, 500, 502, 503, 504)
+
+    def __init__(self, max_backoff: float = 60, breaker_threshold: int = 5, breaker_cooldown: float = 30) -> None:
+        """
+        Initializes the retry policy of the OpenAI client
+
+        Retries wait for the Retry-After of the response when the API sends one and otherwise back
+        off exponentially with full jitter, so thousands of requests failing together do not retry
+        in lockstep. The policy also acts as a circuit breaker shared by every request of the client:
+        after `breaker_threshold` consecutive failed attempts (5xx or connection errors) it asks the
+        scheduler to hold every new request for `breaker_cooldown` seconds.
+
+        :param max_backoff: upper bound of a single backoff (seconds)
+        :param breaker_threshold: consecutive failed attempts that open the circuit (0 disables it)
+        :param breaker_cooldown: duration the circuit stays open (seconds)
+
+        :return: None
+        """
+        self.max_backoff = max_backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+
+        self.failures = 0
+        self.metrics = {"attempts": 0, "retries": Counter(), "exhausted": Counter(), "circuit_opened": 0}
+
+    def __repr__(self):
+        return f"RetryPolicy(retries={dict(self.metrics['retries'])}, failures={self.failures})"
+
+    def should_retry(self, status: int or str) -> bool:
+        """
+        Whether an attempt ending with the status is worth retrying
+
+        :param status: HTTP status of the attempt, or "connection" for a connection error
+
+        :return: True if the request should be retried
+        """
+        return status == "connection" or status in self.retry_statuses
+
+    def delay(self, attempt: int, backoff_time: float, retry_after: float = None) -> float:
+        """
+        Computes how long to wait before the next attempt
+
+        :param attempt: number of the failed attempt (0 for the first)
+        :param backoff_time: base backoff time (seconds)
+        :param retry_after: delay requested by the API (seconds)
+
+        :return: delay in seconds
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, backoff_time * 2 ** attempt))
+
+    def record(self, status: int or str, retried: bool) -> float:
+        """
+        Records the outcome of an attempt
+
+        :param status: HTTP status of the attempt, or "connection" for a connection error
+        :param retried: whether the request is retried after it
+
+        :return: seconds the scheduler should be paused for (0 unless the circuit opens)
+        """
+        self.metrics["attempts"] += 1
+        if self.should_retry(status):
+            self.metrics["retries" if retried else "exhausted"][status] += 1
+
+        if status == "connection" or (isinstance(status, int) and status >= 500):
+            self.failures += 1
+        elif status != 429:
+            self.failures = 0
+
+        if self.breaker_threshold and self.failures >= self.breaker_threshold:
+            self.failures = 0
+            self.metrics["circuit_opened"] += 1
+            return self.breaker_cooldown
+        return 0
+
+    @staticmethod
+    def retry_after(headers: dict) -> float or None:
+        """
+        Parses the Retry-After (or retry-after-ms) header of a response
+
+        :param headers: response headers
+
+        :return: delay in seconds or None if the response does not request one
+        """
+        value = headers.get("retry-after-ms")
+        if value is not None:
+            try:
+                return float(value) / 1000
+            except ValueError:
+                pass
+
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                return None
@@ -0,0 +1,178 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+import time
+
+import numpy as np
+
+
+class Scheduler:
+    lanes = ["interactive", "bulk"]
+
+    def __init__(self, concurrency: int = 32) -> None:
+        """
+        Initializes the bounded-concurrency request scheduler
+
+        At most `concurrency` requests hold a slot at a time. A freed slot is handed to the waiting
+        requests lane by lane, so interactive requests (e.g. query embeddings) go ahead of the bulk
+        requests of an ingestion that is already queued.
+
+        :param concurrency: maximum number of requests in flight
+
+        :return: None
+        """
+        self.concurrency = concurrency
+        self._active = 0
+        self._waiters = {lane: deque() for lane in self.lanes}
+        self._resume_at = 0.0
+
+    def __repr__(self):
+        return f"Scheduler(concurrency={self.concurrency}, active={self._active}, waiting={self.waiting})"
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def pause(self, seconds: float) -> None:
+        """
+        Holds every new request for a while (requests already in flight are not affected)
+
+        :param seconds: duration of the pause
+
+        :return: None
+        """
+        self._resume_at = max(self._resume_at, time.monotonic() + seconds)
+
+    @asynccontextmanager
+    async def slot(self, lane: str = "interactive"):
+        """
+        Holds one of the concurrency slots for the duration of a request
+
+        :param lane: priority lane of the request ("interactive" or "bulk")
+
+        :return: async context manager
+        """
+        if lane not in self._waiters:
+            raise ValueError(f"Invalid lane: {lane} - Options: {self.lanes}")
+
+        while self._resume_at > time.monotonic():
+            await asyncio.sleep(self._resume_at - time.monotonic())
+        await self._acquire(lane)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def batch(self, jobs: list, lane: str = "bulk") -> "Batch":
+        """
+        Schedules a batch of jobs whose results are yielded as they complete
+
+        :param jobs: callables returning the coroutine of each job
+        :param lane: priority lane of the jobs
+
+        :return: Batch async iterator
+        """
+        return Batch(self, jobs, lane)
+
+    async def _acquire(self, lane: str) -> None:
+        if self._active < self.concurrency and not self.waiting:
+            self._active += 1
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters[lane].append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            elif waiter in self._waiters[lane]:
+                self._waiters[lane].remove(waiter)
+            raise
+
+    def _release(self) -> None:
+        # the slot is handed over to the next waiter instead of being freed
+        for lane in self.lanes:
+            while self._waiters[lane]:
+                waiter = self._waiters[lane].popleft()
+                if not waiter.done():
+                    waiter.set_result(None)
+                    return
+        self._active -= 1
+
+
+class Batch:
+    def __init__(self, scheduler: Scheduler, jobs: list, lane: str = "bulk") -> None:
+        """
+        Initializes a batch of jobs run through a scheduler
+
+        Only a window of `concurrency` jobs is started at a time and refilled as they complete, so
+        a large batch never creates all of its coroutines up front.
+
+        :param scheduler: scheduler bounding the concurrency of the jobs
+        :param jobs: callables returning the coroutine of each job
+        :param lane: priority lane of the jobs
+
+        :return: None
+        """
+        self.scheduler = scheduler
+        self.jobs = list(jobs)
+        self.lane = lane
+        self.latencies = []
+        self.started_at = None
+        self.finished_at = None
+
+    def __repr__(self):
+        return f"Batch(jobs={len(self.jobs)}, completed={len(self.latencies)})"
+
+    async def __aiter__(self):
+        """
+        Runs the jobs and yields their results in completion order
+
+        :return: async generator of job results
+        """
+        self.started_at = time.time()
+        jobs, running = iter(self.jobs), set()
+        try:
+            while True:
+                while len(running) < max(1, self.scheduler.concurrency):
+                    job = next(jobs, None)
+                    if job is None:
+                        break
+                    running.add(asyncio.create_task(self._run(job)))
+                if not running:
+                    break
+
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in running:
+                task.cancel()
+            self.finished_at = time.time()
+
+    @property
+    def stats(self) -> dict:
+        """
+        Throughput and latency statistics of the batch
+
+        :return: dictionary of the statistics
+        """
+        latencies = np.asarray(self.latencies, dtype=np.float64)
+        elapsed = ((self.finished_at or time.time()) - self.started_at) if self.started_at else 0.0
+        return {
+            "jobs": len(self.jobs),
+            "completed": len(latencies),
+            "elapsed": elapsed,
+            "throughput": len(latencies) / elapsed if elapsed else 0.0,
+            "latency_mean": float(latencies.mean()) if len(latencies) else 0.0,
+            "latency_p50": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+            "latency_p95": float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+            "latency_max": float(latencies.max()) if len(latencies) else 0.0,
+        }
+
+    async def _run(self, job):
+        started_at = time.time()
+        result = await job()
+        self.latencies.append(time.time() - started_at)
+        return result
@@ -0,0 +1,149 @@
+import asyncio
+from collections import deque
+import time
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import aiohttp
+import numpy as np
+
+
+class SessionPool:
+    def __init__(
+            self,
+            limit: int = 100,
+            limit_per_host: int = 64,
+            keepalive_timeout: float = 75,
+            connect_timeout: float = 10,
+            total_timeout: float = 600
+    ) -> None:
+        """
+        Initializes the HTTP connection pool shared by the OpenAI clients
+
+        A single aiohttp session is kept for the life of the process, so requests reuse kept-alive
+        connections instead of paying DNS, TCP and TLS setup on every call. aiohttp speaks HTTP/1.1
+        only; concurrency comes from up to `limit_per_host` parallel connections to the API host.
+        Every request is traced to separate connection setup (DNS, connect, TLS) from the time the
+        server takes to answer.
+
+        :param limit: maximum number of open connections
+        :param limit_per_host: maximum number of open connections to a single host
+        :param keepalive_timeout: idle time after which a kept-alive connection is closed (seconds)
+        :param connect_timeout: timeout of establishing a connection (seconds)
+        :param total_timeout: timeout of a whole request (seconds)
+
+        :return: None
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.connect_timeout = connect_timeout
+        self.total_timeout = total_timeout
+
+        self._session = None
+        self._lock = None
+        # the latencies of the most recent requests
+        self.metrics = {"requests": 0, "new_connections": 0, "connect": deque(maxlen=10000), "server": deque(maxlen=10000)}
+
+    def __repr__(self):
+        return f"SessionPool(limit_per_host={self.limit_per_host}, open={self._session is not None and not self._session.closed})"
+
+    async def session(self) -> aiohttp.ClientSession:
+        """
+        Returns the shared session, creating it on first use
+
+        :return: aiohttp session
+        """
+        if self._session is not None and not self._session.closed:
+            return self._session
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._session is None or self._session.closed:
+                trace = aiohttp.TraceConfig()
+                trace.on_request_start.append(self._on_request_start)
+                trace.on_connection_create_start.append(self._on_connection_create_start)
+                trace.on_connection_create_end.append(self._on_connection_create_end)
+                trace.on_request_end.append(self._on_request_end)
+                self._session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(
+                        limit=self.limit,
+                        limit_per_host=self.limit_per_host,
+                        keepalive_timeout=self.keepalive_timeout,
+                        ttl_dns_cache=300),
+                    timeout=aiohttp.ClientTimeout(total=self.total_timeout, sock_connect=self.connect_timeout),
+                    trace_configs=[trace])
+        return self._session
+
+    async def warmup(self, urls: list, connections: int = 1) -> None:
+        """
+        Opens connections to the API hosts ahead of the first request
+
+        The responses do not matter (an unauthenticated request is enough), only the established
+        connections that are kept alive for the following requests.
+
+        :param urls: endpoints of the hosts to connect to
+        :param connections: number of connections to open per host
+
+        :return: None
+        """
+        session = await self.session()
+        hosts = {f"{urlparse(url).scheme}://{urlparse(url).netloc}" for url in urls}
+
+        async def touch(host):
+            try:
+                async with session.get(host, timeout=aiohttp.ClientTimeout(total=self.connect_timeout)) as resp:
+                    await resp.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"- Failed to Warm Up Connection: {host} - {e} -")
+
+        await asyncio.gather(*[touch(host) for host in hosts for _ in range(connections)])
+
+    async def close(self) -> None:
+        """
+        Closes the session and its pooled connections
+
+        :return: None
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    @property
+    def stats(self) -> dict:
+        """
+        Connection setup and server latency statistics of the traced requests
+
+        :return: dictionary of the statistics (seconds)
+        """
+        connect = np.asarray(self.metrics["connect"], dtype=np.float64)
+        server = np.asarray(self.metrics["server"], dtype=np.float64)
+        return {
+            "requests": self.metrics["requests"],
+            "new_connections": self.metrics["new_connections"],
+            "reused_connections": max(self.metrics["requests"] - self.metrics["new_connections"], 0),
+            "connect_mean": float(connect.mean()) if len(connect) else 0.0,
+            "connect_max": float(connect.max()) if len(connect) else 0.0,
+            "server_mean": float(server.mean()) if len(server) else 0.0,
+            "server_p95": float(np.percentile(server, 95)) if len(server) else 0.0,
+        }
+
+    @staticmethod
+    async def _on_request_start(session, context: SimpleNamespace, params) -> None:
+        context.started_at = time.perf_counter()
+        context.connect = 0.0
+
+    @staticmethod
+    async def _on_connection_create_start(session, context: SimpleNamespace, params) -> None:
+        context.connecting_at = time.perf_counter()
+
+    async def _on_connection_create_end(self, session, context: SimpleNamespace, params) -> None:
+        context.connect = time.perf_counter() - context.connecting_at
+        self.metrics["new_connections"] += 1
+        self.metrics["connect"].append(context.connect)
+
+    async def _on_request_end(self, session, context: SimpleNamespace, params) -> None:
+        # the time from the request start to the response headers, minus the connection setup
+        self.metrics["requests"] += 1
+        self.metrics["server"].append(time.perf_counter() - context.started_at - context.connect)
@@ -0,0 +1,204 @@
+from datetime import datetime
+import hashlib
+
+from gpt.tokenizer import Tokenizer
+
+# processor of a process pool worker, created once per worker by ConversationProcessor.init_worker
+_worker_processor = None
+
+
+class ConversationProcessor:
+    def __init__(self, ignore_threshold: int, chunk_break_line: int, chunk_trim_overlap: int) -> None:
+        """
+        Initializes the processor turning an exported conversation into index entries and chunks
+
+        The processor only depends on its settings and a lazily created tokenizer. A process pool
+        creates one processor per worker with `init_worker` and runs `process_in_worker`, so only
+        the conversations are sent with each task and every worker builds its tokenizer once.
+
+        :param ignore_threshold: minimum message length (characters) to index
+        :param chunk_break_line: approximate chunk length (tokens)
+        :param chunk_trim_overlap: approximate overlap between chunks (tokens)
+
+        :return: None
+        """
+        self.ignore_threshold = ignore_threshold
+        self.chunk_break_line = chunk_break_line
+        self.chunk_trim_overlap = chunk_trim_overlap
+        self._tokenizer = None
+
+    def __repr__(self):
+        return f"ConversationProcessor(chunk_break_line={self.chunk_break_line})"
+
+    @classmethod
+    def init_worker(cls, *settings) -> None:
+        """
+        Creates the processor of a process pool worker (used as the pool initializer)
+
+        :param settings: ignore_threshold, chunk_break_line and chunk_trim_overlap
+
+        :return: None
+        """
+        global _worker_processor
+        _worker_processor = cls(*settings)
+
+    @staticmethod
+    def process_in_worker(conversation: dict) -> tuple:
+        return _worker_processor(conversation)
+
+    def __call__(self, conversation: dict) -> tuple:
+        """
+        Processes a conversation
+
+        :param conversation: conversation dictionary of the export
+
+        :return: conversation id, its indexed_data entry (None when nothing is indexable) and its
+            chunks as (chunk hash, chunk text, message index) tuples in message order
+        """
+        conversation_id = conversation.get("conversation_id")
+        if not conversation_id:
+            return None, None, []
+
+        conversation_title = ' '.join(conversation.get("title", "").split())
+        if not conversation_title:
+            conversation_title = f"Untitled Chat"
+
+        messages, chunks = [], []
+        for message in conversation["mapping"].values():
+            message = message.get("message")
+            if not message:
+                continue
+
+            role = message["author"]["role"]
+            if role == "system":
+                continue
+
+            if message["status"] != "finished_successfully":
+                continue
+
+            message_content = self.get_content(message)
+            if not message_content:
+                continue
+
+            for msg in self.get_chunks(message_content):
+                chunks.append((hashlib.sha256(msg.encode('utf-8')).hexdigest(), msg, len(messages)))
+
+            model = message["metadata"].get("model_slug", "gpt") if role == "assistant" else "user"
+            messaged_at = datetime.fromtimestamp(message["create_time"]).strftime("%Y-%m-%d %H:%M:%S")
+            messages.append({
+                "context": {
+                    "role": role,
+                    "content": message_content,
+                },
+                "metadata": {
+                    "model": model,
+                    "created_at": messaged_at,
+                    "message_index": len(messages),
+                    "conversation_id": conversation_id,
+                    "conversation_title": conversation_title,
+                }
+            })
+
+        if not messages:
+            return conversation_id, None, []
+
+        total_raw_messages = len(conversation["mapping"].values())
+        created_at = datetime.fromtimestamp(conversation.get("create_time", 0)).strftime("%Y-%m-%d %H:%M:%S")
+        conversation_url = "https://chatgpt.com/c/" + conversation_id
+        return conversation_id, {
+            "messages": messages,
+            "created_at": created_at,
+            "conversation_id": conversation_id,
+            "conversation_title": conversation_title,
+            "total_processed_messages": len(messages),
+            "total_raw_messages": total_raw_messages,
+            "conversation_url": conversation_url
+        }, chunks
+
+    @property
+    def tokenizer(self) -> Tokenizer:
+        if self._tokenizer is None:
+            self._tokenizer = Tokenizer()
+        return self._tokenizer
+
+    def get_content(self, message: dict) -> str:
+        """
+        Extracts the indexable text of a message
+
+        :param message: message dictionary of the export
+
+        :return: text of the message or an empty string if it should not be indexed
+        """
+        content = message["content"]
+        content_type = content["content_type"]
+
+        if content_type in ['text', 'multimodal_text']:
+            text = ' '.join([m.strip() for m in content["parts"] if isinstance(m, str) and m.strip()])
+        elif content_type == "code":
+            if content['language'] == 'unknown':
+                content['language'] = 'python' if message['recipient'] == 'python' else 'code'
+            text = f"Code Snippet: {content['language']}\n\n{content['text']}"
+        elif content_type == 'execution_output':
+            text = f"Execution Output: {content['text']}"
+        elif content_type in ['tether_browsing_display', 'tether_quote']:
+            if message['metadata'].get('command') == 'context_stuff':
+                text = f"Context Stuff\n\nTitle: {content['domain']}\n\n{content['text']}"
+            elif message["metadata"].get('_cite_metadata'):
+                query = ' '.join([s for s in message['metadata']['args'] if isinstance(s, str)])
+                if message['author']['name'] == 'browser':
+                    text = f"Web Browsing Results"
+                    text += f"\n\nSearch Query: {query}" if query else ""
+                    for r in message['metadata']['_cite_metadata']['metadata_list']:
+                        text += f"\n\nType: {r['type']}\nURL: {r['url']}\nTitle: {r['title']}\nResult: {r['text']}"
+                elif message['author']['name'] == 'myfiles_browser':
+                    text = f"Files Browsing Results"
+                    text += f"\n\nSearch Query: {query}" if query else ""
+                    for r in message['metadata']['_cite_metadata']['metadata_list']:
+                        text += f"\n\nType: {r['type']}\nName: {r['name']}\nResult: {r['text']}"
+                else:
+                    return ''
+            else:
+                return ''
+        elif content_type in ['system_error']:
+            return ''
+        else:
+            print(f"Unknown message content type: {content_type}")
+            return ''
+
+        if not text or len(text) < self.ignore_threshold:
+            return ''
+
+        return text
+
+    def get_chunks(self, message_content: str) -> list:
+        """
+        Splits a message into overlapping chunks of about `chunk_break_line` tokens
+
+        :param message_content: text of the message
+
+        :return: list of chunk texts
+        """
+        breaklimit, overlap = self.chunk_break_line, self.chunk_trim_overlap
+        try:
+            tokenized = self.tokenizer.tokenize(message_content)
+            n_tokens = len(tokenized)
+            n_segments = max(1, round(n_tokens / breaklimit))
+
+            if abs(n_tokens - breaklimit) <= abs(n_tokens / n_segments - breaklimit):
+                return [message_content]
+
+            optimal = n_tokens // n_segments
+            segments = []
+            for i in range(0, n_tokens, optimal):
+                start = i - overlap if i > overlap else 0
+                end = i + optimal + overlap if (i + optimal + overlap <= n_tokens) else n_tokens
+                segments.append(tokenized[start:end])
+
+            if len(segments) > 1 and len(segments[-1]) < optimal:
+                segments[-2].extend(segments[-1])
+                segments.pop()
+
+            return [self.tokenizer.stringify(segment) for segment in segments]
+        except Exception as e:
+            print(f"Error processing text: {e}")
+            return [message_content]
@@ -0,0 +1,153 @@
+import glob
+import hashlib
+import io
+import json
+import os
+import zipfile
+
+
+class ExportReader:
+    member = "conversations.json"
+
+    def __init__(self, path: str, chunk_size: int = 2 ** 20) -> None:
+        """
+        Initializes the streaming reader of a ChatGPT export
+
+        The export is a JSON array of conversations, read either from conversations.json or straight
+        from the export .zip. Conversations are decoded one at a time from a rolling text buffer, so
+        peak memory is bounded by the largest single conversation instead of the whole export.
+
+        :param path: path to conversations.json or to the export .zip
+        :param chunk_size: number of characters read from the file at a time
+
+        :return: None
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+
+    def __repr__(self):
+        return f"ExportReader(path={self.source})"
+
+    def __iter__(self):
+        """
+        Iterates over the conversations of the export
+
+        :return: generator of conversation dictionaries
+        """
+        with self._open() as file:
+            buffer, position = "", 0
+            while True:
+                position = self._skip(buffer, position)
+                while position == len(buffer):
+                    chunk = file.read(self.chunk_size)
+                    if not chunk:
+                        return
+                    buffer, position = chunk, self._skip(chunk, 0)
+                if buffer[position] == "]":
+                    return
+
+                read_size = self.chunk_size
+                while True:
+                    try:
+                        conversation, position = self._decoder.raw_decode(buffer, position)
+                        break
+                    except json.JSONDecodeError:
+                        # an incomplete conversation: read as much again so re-decoding stays linear
+                        chunk = file.read(max(read_size, len(buffer) - position))
+                        if not chunk:
+                            raise
+                        buffer, position, read_size = buffer[position:] + chunk, 0, read_size * 2
+
+                yield conversation
+
+    @property
+    def source(self) -> str or None:
+        """
+        Resolves the export to read: the configured file, or else the newest export .zip next to it
+
+        :return: path of the export or None if there is none
+        """
+        if os.path.exists(self.path):
+            return self.path
+
+        archives = sorted(glob.glob(os.path.join(os.path.dirname(self.path), "*.zip")), key=os.path.getmtime)
+        for archive in reversed(archives):
+            if self._zip_member(archive):
+                return archive
+        return None
+
+    def exists(self) -> bool:
+        return self.source is not None
+
+    def fingerprint(self, previous: dict = None) -> dict:
+        """
+        Fingerprints the export file by size, modification time and SHA-256 of its content
+
+        The content is only hashed when the size or modification time differ from the previous
+        fingerprint, so an untouched export is recognized without reading it.
+
+        :param previous: fingerprint recorded for the last ingested export
+
+        :return: fingerprint dictionary
+        """
+        source = self.source
+        stat = os.stat(source)
+        fingerprint = {"source": os.path.basename(source), "size": stat.st_size, "mtime": stat.st_mtime}
+        previous = previous or {}
+        if all(previous.get(key) == value for key, value in fingerprint.items()) and previous.get("sha256"):
+            return {**fingerprint, "sha256": previous["sha256"]}
+
+        digest = hashlib.sha256()
+        with open(source, "rb") as file:
+            for block in iter(lambda: file.read(self.chunk_size), b""):
+                digest.update(block)
+        return {**fingerprint, "sha256": digest.hexdigest()}
+
+    @staticmethod
+    def conversation_hash(conversation: dict) -> str:
+        """
+        Hashes the content of a conversation (its title and message tree)
+
+        :param conversation: conversation dictionary
+
+        :return: SHA-256 of the conversation content
+        """
+        content = json.dumps([conversation.get("title"), conversation.get("mapping")], sort_keys=True)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def _open(self) -> io.TextIOBase:
+        source = self.source
+        if source is None:
+            raise FileNotFoundError(f"- Exported JSON File Not Found - Path: {self.path}")
+
+        if not zipfile.is_zipfile(source):
+            return open(source, "r", encoding="utf-8")
+
+        archive = zipfile.ZipFile(source)
+        member = self._zip_member(source)
+        if member is None:
+            archive.close()
+            raise FileNotFoundError(f"- {self.member} Not Found in Export Archive - Path: {source}")
+
+        # the member stream keeps the archive open until it is closed
+        stream = io.TextIOWrapper(archive.open(member), encoding="utf-8")
+        archive.close()
+        return stream
+
+    def _zip_member(self, path: str) -> str or None:
+        try:
+            with zipfile.ZipFile(path) as archive:
+                for name in archive.namelist():
+                    if os.path.basename(name) == self.member:
+                        return name
+        except zipfile.BadZipFile:
+            pass
+        return None
+
+    @staticmethod
+    def _skip(buffer: str, position: int) -> int:
+        # the opening bracket, separators and whitespace between conversations
+        while position < len(buffer) and (buffer[position].isspace() or buffer[position] in "[,"):
+            position += 1
+        return position
@@ -1,8 +1,10 @@
 import asyncio
+import base64
 import json
 import os
 
 import aiofiles
+import numpy as np
 import pandas as pd
 
 
@@ -204,6 +206,35 @@ class FileTools:
 
         return default
 
+    @staticmethod
+    def json_default(value):
+        """
+        Serializes the values the json module cannot: numpy vectors become the base64 string of
+        their little-endian float32 bytes (as sent by the embeddings API), numpy scalars plain numbers
+
+        :param value: value to serialize
+
+        :return: JSON serializable value
+        """
+        if isinstance(value, np.ndarray):
+            return base64.b64encode(np.ascontiguousarray(value, dtype="<f4").tobytes()).decode("ascii")
+        if isinstance(value, np.generic):
+            return value.item()
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    @staticmethod
+    def vector(value: str or list or np.ndarray) -> np.ndarray:
+        """
+        Decodes a vector serialized by `json_default` (legacy float lists are accepted as well)
+
+        :param value: base64 string, list of floats or array
+
+        :return: float32 array (a read-only view over the decoded bytes for base64 strings)
+        """
+        if isinstance(value, str):
+            return np.frombuffer(base64.b64decode(value), dtype="<f4")
+        return np.asarray(value, dtype=np.float32)
+
     @staticmethod
     def write_json(path: str, data: list or dict, indent: int = 4) -> None:
         """
@@ -220,8 +251,10 @@ class FileTools:
             path += ".json"
 
         try:
-            with open(path, "w") as file:
-                json.dump(data, file, indent=indent)
+            # written to a temporary file first, so an interrupted write never leaves a truncated file behind
+            with open(f"{path}.tmp", "w") as file:
+                json.dump(data, file, indent=indent, default=FileTools.json_default)
+            os.replace(f"{path}.tmp", path)
         except Exception as e:
             print(f"Error Writing JSON: {e}")
 
@@ -262,7 +295,7 @@ class FileTools:
         async with self.semaphore:
             try:
                 async with aiofiles.open(path, "w") as file:
-                    await file.write(json.dumps(data, indent=indent))
+                    await file.write(json.dumps(data, indent=indent, default=self.json_default))
             except Exception as e:
                 print(f"Error Writing JSON: {e}")
 
@@ -39,6 +39,13 @@ class Ledger:
                 "msg_cache": os.path.join(dirs["processed"], self._get_env_variable("FILE_MSG_CACHE")),
                 "vector_cache": os.path.join(dirs["processed"], self._get_env_variable("FILE_VECTOR_CACHE")),
                 "vector_data": os.path.join(dirs["processed"], self._get_env_variable("FILE_VECTOR_DATA")),
+                "vector_store": os.path.join(dirs["processed"], self._get_env_variable("FILE_VECTOR_STORE", default="vector_store")),
+                "ann_index": os.path.join(dirs["processed"], self._get_env_variable("FILE_ANN_INDEX", default="ann_index.npz")),
+                "quantized": os.path.join(dirs["processed"], self._get_env_variable("FILE_QUANTIZED", default="quantized.npz")),
+                "lexical_index": os.path.join(dirs["processed"], self._get_env_variable("FILE_LEXICAL_INDEX", default="lexical_index.npz")),
+                "export_state": os.path.join(dirs["processed"], self._get_env_variable("FILE_EXPORT_STATE", default="export_state.json")),
+                "embedding_job": os.path.join(dirs["processed"], self._get_env_variable("FILE_EMBEDDING_JOB", default="embedding_job.json")),
+                "metadata": os.path.join(dirs["processed"], self._get_env_variable("FILE_METADATA", default="metadata.sqlite3")),
                 "msg_to_ignore": os.path.join(self.root, "data", self._get_env_variable("FILE_MSG_TO_IGNORE"))
             }
             for key, path in dirs.items():
@@ -57,10 +64,41 @@ class Ledger:
             load_dotenv(find_dotenv("config_app.env", usecwd=True))
             self._configs = {
                 "chat_model": self._get_env_variable("CHAT_MODEL"),
+                "api_base_url": self._get_env_variable("API_BASE_URL", default=""),
                 "embedding_model": self._get_env_variable("EMBEDDING_MODEL"),
+                "embedding_dimensions": self._get_env_variable("EMBEDDING_DIMENSIONS", default=0, var_type=int),
+                "embedding_batch_inputs": self._get_env_variable("EMBEDDING_BATCH_INPUTS", default=256, var_type=int),
+                "embedding_batch_tokens": self._get_env_variable("EMBEDDING_BATCH_TOKENS", default=131072, var_type=int),
+                "embedding_concurrency": self._get_env_variable("EMBEDDING_CONCURRENCY", default=32, var_type=int),
+                "embedding_queue_size": self._get_env_variable("EMBEDDING_QUEUE_SIZE", default=1024, var_type=int),
+                "embedding_batch_wait": self._get_env_variable("EMBEDDING_BATCH_WAIT", default=0.1, var_type=float),
+                "embedding_checkpoint_interval": self._get_env_variable("EMBEDDING_CHECKPOINT_INTERVAL", default=60, var_type=int),
+                "http_connections_per_host": self._get_env_variable("HTTP_CONNECTIONS_PER_HOST", default=64, var_type=int),
+                "http_keepalive_timeout": self._get_env_variable("HTTP_KEEPALIVE_TIMEOUT", default=75, var_type=float),
+                "http_warmup_connections": self._get_env_variable("HTTP_WARMUP_CONNECTIONS", default=4, var_type=int),
+                "retry_max_backoff": self._get_env_variable("RETRY_MAX_BACKOFF", default=60, var_type=float),
+                "circuit_breaker_threshold": self._get_env_variable("CIRCUIT_BREAKER_THRESHOLD", default=5, var_type=int),
+                "circuit_breaker_cooldown": self._get_env_variable("CIRCUIT_BREAKER_COOLDOWN", default=30, var_type=float),
+                "journal_segment_mb": self._get_env_variable("JOURNAL_SEGMENT_MB", default=64, var_type=int),
+                "journal_max_mb": self._get_env_variable("JOURNAL_MAX_MB", default=1024, var_type=int),
                 "ignore_threshold": self._get_env_variable("IGNORE_THRESHOLD", var_type=int),
                 "chunk_break_line": self._get_env_variable("CHUNK_BREAK_LINE", var_type=int),
                 "chunk_trim_overlap": self._get_env_variable("CHUNK_TRIM_OVERLAP", var_type=int),
-                "search_limit": self._get_env_variable("SEARCH_LIMIT", var_type=int)
+                "ingest_workers": self._get_env_variable("INGEST_WORKERS", default=0, var_type=int),
+                "search_limit": self._get_env_variable("SEARCH_LIMIT", var_type=int),
+                "search_mode": self._get_env_variable("SEARCH_MODE", default="vector"),
+                "search_cache_max_entries": self._get_env_variable("SEARCH_CACHE_MAX_ENTRIES", default=10000, var_type=int),
+                "search_cache_max_mb": self._get_env_variable("SEARCH_CACHE_MAX_MB", default=256, var_type=int),
+                "search_reducer": self._get_env_variable("SEARCH_REDUCER", default="max"),
+                "search_reducer_top_n": self._get_env_variable("SEARCH_REDUCER_TOP_N", default=3, var_type=int),
+                "vector_store_dtype": self._get_env_variable("VECTOR_STORE_DTYPE", default="float32"),
+                "vector_store_max_segments": self._get_env_variable("VECTOR_STORE_MAX_SEGMENTS", default=8, var_type=int),
+                "vector_store_max_tombstones": self._get_env_variable("VECTOR_STORE_MAX_TOMBSTONES", default=0.1, var_type=float),
+                "ann_index": self._get_env_variable("ANN_INDEX", default="none"),
+                "ann_nlist": self._get_env_variable("ANN_NLIST", default=0, var_type=int),
+                "ann_nprobe": self._get_env_variable("ANN_NPROBE", default=8, var_type=int),
+                "quantization": self._get_env_variable("QUANTIZATION", default="none"),
+                "quantization_candidates": self._get_env_variable("QUANTIZATION_CANDIDATES", default=0, var_type=int),
+                "quantization_dimensions": self._get_env_variable("QUANTIZATION_DIMENSIONS", default=256, var_type=int)
             }
         return self._configs.copy()
@@ -0,0 +1,328 @@
+import json
+import os
+import sqlite3
+
+
+class MetadataStore:
+    schema = """
+        CREATE TABLE IF NOT EXISTS conversations (
+            conversation_id TEXT PRIMARY KEY,
+            conversation_title TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            conversation_url TEXT NOT NULL,
+            total_processed_messages INTEGER NOT NULL,
+            total_raw_messages INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            conversation_id TEXT NOT NULL,
+            message_index INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            model TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            message TEXT NOT NULL,
+            PRIMARY KEY (conversation_id, message_index)
+        );
+        CREATE TABLE IF NOT EXISTS chunks (
+            hash TEXT PRIMARY KEY,
+            content TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS addresses (
+            hash TEXT NOT NULL,
+            conversation_id TEXT NOT NULL,
+            message_index INTEGER NOT NULL,
+            PRIMARY KEY (hash, conversation_id, message_index)
+        );
+        CREATE INDEX IF NOT EXISTS addresses_conversation ON addresses (conversation_id, message_index);
+        CREATE TABLE IF NOT EXISTS ignored (
+            conversation_id TEXT PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS state (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Initializes the SQLite metadata store of the processed conversations
+
+        Conversations, their messages, the message chunks with the [conversation_id, message_index]
+        addresses they appear at and the ignored conversations are kept in one SQLite database in WAL
+        mode. Updates are upserts of the changed rows, committed in transactions by the caller, and
+        lookups go through the primary keys, so an update touching a few conversations writes only
+        their rows and readers never load the whole archive. Every commit of changed rows bumps the
+        store revision, which versions whatever was derived from the metadata (e.g. cached results).
+        Embeddings are looked up in the vector store by chunk hash.
+
+        :param path: path of the database file
+
+        :return: None
+        """
+        self.path = path
+        self._connection = None
+
+    def __repr__(self):
+        return f"MetadataStore(path={self.path}, conversations={len(self)})"
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return self.connection.execute(
+            "SELECT 1 FROM conversations WHERE conversation_id = ?", (conversation_id,)).fetchone() is not None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.execute("PRAGMA synchronous = NORMAL")
+            self._connection.executescript(self.schema)
+        return self._connection
+
+    @property
+    def revision(self) -> int:
+        row = self.connection.execute("SELECT value FROM state WHERE key = 'revision'").fetchone()
+        return row[0] if row is not None else 0
+
+    def commit(self) -> None:
+        """
+        Commits the pending upserts, bumping the revision if any row changed
+
+        :return: None
+        """
+        if self._connection is not None and self._connection.in_transaction:
+            self._connection.execute(
+                "INSERT INTO state VALUES ('revision', 1) ON CONFLICT (key) DO UPDATE SET value = value + 1")
+            self._connection.commit()
+
+    def close(self) -> None:
+        """
+        Commits the pending upserts and closes the database
+
+        :return: None
+        """
+        if self._connection is not None:
+            self.commit()
+            self._connection.close()
+            self._connection = None
+
+    def conversation(self, conversation_id: str, messages: bool = True) -> dict or None:
+        """
+        Reads a processed conversation
+
+        :param conversation_id: id of the conversation
+        :param messages: whether to read its messages too
+
+        :return: conversation entry (as produced by ConversationProcessor) or None if it is not stored
+        """
+        row = self.connection.execute(
+            "SELECT conversation_id, conversation_title, created_at, conversation_url, total_processed_messages, "
+            "total_raw_messages FROM conversations WHERE conversation_id = ?", (conversation_id,)).fetchone()
+        if row is None:
+            return None
+
+        entry = dict(zip(
+            ["conversation_id", "conversation_title", "created_at", "conversation_url",
+             "total_processed_messages", "total_raw_messages"], row))
+        if messages:
+            entry["messages"] = [json.loads(message) for message, in self.connection.execute(
+                "SELECT message FROM messages WHERE conversation_id = ? ORDER BY message_index", (conversation_id,))]
+        return entry
+
+    def put_conversation(self, entry: dict) -> None:
+        """
+        Upserts a processed conversation, replacing its messages
+
+        :param entry: conversation entry (as produced by ConversationProcessor)
+
+        :return: None
+        """
+        self.connection.execute(
+            "INSERT INTO conversations VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (conversation_id) DO UPDATE SET "
+            "conversation_title = excluded.conversation_title, created_at = excluded.created_at, "
+            "conversation_url = excluded.conversation_url, total_processed_messages = excluded.total_processed_messages, "
+            "total_raw_messages = excluded.total_raw_messages", (
+                entry["conversation_id"], entry["conversation_title"], entry["created_at"], entry["conversation_url"],
+                entry["total_processed_messages"], entry["total_raw_messages"]))
+        self.connection.execute("DELETE FROM messages WHERE conversation_id = ?", (entry["conversation_id"],))
+        self._insert_messages(entry["conversation_id"], 0, entry["messages"])
+
+    def delete_conversation(self, conversation_id: str) -> None:
+        """
+        Deletes a stored conversation and its messages (e.g. once it has nothing left to index)
+
+        :param conversation_id: id of the conversation
+
+        :return: None
+        """
+        self.connection.execute("DELETE FROM conversations WHERE conversation_id = ?", (conversation_id,))
+        self.connection.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+
+    def append_messages(self, conversation_id: str, messages: list) -> None:
+        """
+        Appends messages to the end of a stored conversation
+
+        :param conversation_id: id of the conversation
+        :param messages: message dictionaries (their message_index is assigned here)
+
+        :return: None
+        """
+        start = self.connection.execute(
+            "SELECT COALESCE(MAX(message_index) + 1, 0) FROM messages WHERE conversation_id = ?", (conversation_id,)).fetchone()[0]
+        self._insert_messages(conversation_id, start, messages)
+        self.connection.execute(
+            "UPDATE conversations SET total_processed_messages = total_processed_messages + ? WHERE conversation_id = ?",
+            (len(messages), conversation_id))
+
+    def _insert_messages(self, conversation_id: str, start: int, messages: list) -> None:
+        rows = []
+        for message_index, message in enumerate(messages, start=start):
+            if "context" not in message:
+                # messages appended by chats before the metadata store were saved without their metadata
+                message = {"context": message}
+            metadata = message.setdefault("metadata", {})
+            metadata["message_index"] = message_index
+            rows.append((
+                conversation_id, message_index, message["context"]["role"], metadata.get("model", ""),
+                metadata.get("created_at", "1970-01-01 00:00:00"), json.dumps(message)))
+        self.connection.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    def raw_message_counts(self) -> dict:
+        """
+        Reads the number of raw export messages of every stored conversation
+
+        :return: dictionary of conversation id to raw message count
+        """
+        return dict(self.connection.execute("SELECT conversation_id, total_raw_messages FROM conversations"))
+
+    def message_metadata(self) -> dict:
+        """
+        Reads the filterable metadata of every stored message
+
+        :return: dictionary of (conversation_id, message_index) to (created_at, model, role)
+        """
+        return {
+            (conversation_id, message_index): (created_at, model, role)
+            for conversation_id, message_index, created_at, model, role in self.connection.execute(
+                "SELECT conversation_id, message_index, created_at, model, role FROM messages")
+        }
+
+    def ignored(self) -> set:
+        return {conversation_id for conversation_id, in self.connection.execute("SELECT conversation_id FROM ignored")}
+
+    def ignore(self, conversation_id: str) -> None:
+        self.connection.execute("INSERT OR IGNORE INTO ignored VALUES (?)", (conversation_id,))
+
+    def add_chunk(self, msg_hash: str, content: str) -> bool:
+        """
+        Inserts a message chunk unless it is already stored
+
+        :param msg_hash: hash of the chunk
+        :param content: text of the chunk
+
+        :return: True if the chunk is new
+        """
+        return self.connection.execute(
+            "INSERT OR IGNORE INTO chunks (hash, content) VALUES (?, ?)", (msg_hash, content)).rowcount > 0
+
+    def add_address(self, msg_hash: str, conversation_id: str, message_index: int) -> bool:
+        """
+        Records that a chunk appears at a message
+
+        :param msg_hash: hash of the chunk
+        :param conversation_id: id of the conversation
+        :param message_index: index of the message in the conversation
+
+        :return: True if the address is new
+        """
+        return self.connection.execute(
+            "INSERT OR IGNORE INTO addresses VALUES (?, ?, ?)", (msg_hash, conversation_id, message_index)).rowcount > 0
+
+    def chunk_count(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def chunks(self):
+        """
+        Iterates over the stored chunks
+
+        :return: generator of (hash, content) tuples
+        """
+        yield from self.connection.execute("SELECT hash, content FROM chunks")
+
+    def chunk_contents(self, msg_hashes: list) -> list:
+        """
+        Reads the text of chunks
+
+        :param msg_hashes: hashes of the chunks
+
+        :return: list of the chunk texts in the order of the hashes (None for unknown hashes)
+        """
+        contents = {}
+        for start in range(0, len(msg_hashes), 500):
+            batch = msg_hashes[start:start + 500]
+            contents.update(self.connection.execute(
+                f"SELECT hash, content FROM chunks WHERE hash IN ({','.join('?' * len(batch))})", batch))
+        return [contents.get(msg_hash) for msg_hash in msg_hashes]
+
+    def addresses(self) -> dict:
+        """
+        Reads the addresses of every chunk
+
+        :return: dictionary of hash to its [conversation_id, message_index] addresses in insertion order
+        """
+        addresses = {}
+        for msg_hash, conversation_id, message_index in self.connection.execute(
+                "SELECT hash, conversation_id, message_index FROM addresses ORDER BY rowid"):
+            addresses.setdefault(msg_hash, []).append([conversation_id, message_index])
+        return addresses
+
+    def clear_addresses(self, conversation_id: str) -> None:
+        """
+        Removes the addresses of a conversation before it is processed again
+
+        :param conversation_id: id of the conversation
+
+        :return: None
+        """
+        self.connection.execute("DELETE FROM addresses WHERE conversation_id = ?", (conversation_id,))
+
+    def orphans(self) -> list:
+        """
+        Finds the chunks no message refers to anymore (e.g. after an edited message was processed again)
+
+        :return: hashes of the orphaned chunks
+        """
+        return [msg_hash for msg_hash, in self.connection.execute(
+            "SELECT hash FROM chunks WHERE NOT EXISTS (SELECT 1 FROM addresses WHERE addresses.hash = chunks.hash)")]
+
+    def delete_chunks(self, msg_hashes: list) -> None:
+        """
+        Deletes chunks
+
+        :param msg_hashes: hashes of the chunks
+
+        :return: None
+        """
+        self.connection.executemany("DELETE FROM chunks WHERE hash = ?", [(msg_hash,) for msg_hash in msg_hashes])
+
+    def migrate(self, indexed_data: dict, msg_cache: dict, msg_to_ignore: list) -> None:
+        """
+        One-shot migration of the legacy index.json, msg_cache.json and msg_to_ignore.json contents
+
+        :param indexed_data: processed conversations by id
+        :param msg_cache: message chunks by hash
+        :param msg_to_ignore: ids of the ignored conversations
+
+        :return: None
+        """
+        for entry in indexed_data.values():
+            self.put_conversation(entry)
+        for msg_hash, msg in msg_cache.items():
+            self.add_chunk(msg_hash, msg["content"])
+            for conversation_id, message_index in msg["addresses"]:
+                self.add_address(msg_hash, conversation_id, message_index)
+        for conversation_id in msg_to_ignore:
+            self.ignore(conversation_id)
+        self.commit()
@@ -1,32 +1,109 @@
 import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import hashlib
+import itertools
 import os
+import time
 
-import pandas as pd
-from scipy.spatial.distance import cosine as cosine_similarity
+import aiohttp
 from tabulate import tabulate
 
 from gpt.client import OpenAI
+from gpt.retry import RetryPolicy
+from gpt.session import SessionPool
 
+from helpers.conversations import ConversationProcessor
+from helpers.exports import ExportReader
 from helpers.files import FileTools
 from helpers.ledger import Ledger
+from helpers.metadata import MetadataStore
+
+from search.ann import IVFIndex
+from search.cache import SearchCache
+from search.filters import MetadataFilter
+from search.lexical import BM25Index
+from search.quantization import quantizers
+from search.ranking import TopKAggregator
+from search.store import EmbeddingStore
+from search.vectors import VectorEngine
 
 
 class ChatGPTSearchEngine:
+    legacy_caches = ["index", "msg_cache", "vector_cache", "msg_to_ignore"]
+
     def __init__(self):
         self._paths = Ledger().paths
         self._configs = Ledger().configs
 
-        self._completions = OpenAI(self._configs["chat_model"], self._paths["dirs"]["vector_cache"])
-        self._embeddings = OpenAI(self._configs["embedding_model"], self._paths["dirs"]["vector_cache"])
+        # one connection pool serves both clients for the life of the process
+        self.session_pool = SessionPool(
+            limit_per_host=self._configs["http_connections_per_host"],
+            keepalive_timeout=self._configs["http_keepalive_timeout"])
+        client_options = {
+            "journal_segment_bytes": self._configs["journal_segment_mb"] * 2 ** 20,
+            "journal_max_bytes": self._configs["journal_max_mb"] * 2 ** 20,
+            "base_url": self._configs["api_base_url"],
+            "session_pool": self.session_pool,
+        }
+        retry_options = {
+            "max_backoff": self._configs["retry_max_backoff"],
+            "breaker_threshold": self._configs["circuit_breaker_threshold"],
+            "breaker_cooldown": self._configs["circuit_breaker_cooldown"],
+        }
+        self._completions = OpenAI(
+            self._configs["chat_model"],
+            self._paths["dirs"]["vector_cache"],
+            retry_policy=RetryPolicy(**retry_options),
+            **client_options)
+        self._embeddings = OpenAI(
+            self._configs["embedding_model"],
+            self._paths["dirs"]["vector_cache"],
+            concurrency=self._configs["embedding_concurrency"],
+            retry_policy=RetryPolicy(**retry_options),
+            **client_options)
+        self._embeddings.client.max_inputs = self._configs["embedding_batch_inputs"]
+        self._embeddings.client.max_tokens = self._configs["embedding_batch_tokens"]
         self.file_tools = FileTools()
 
-        self.msg_to_ignore = []
-        self.indexed_data = {}
-        self.vector_cache = {}
-        self.search_cache = {}
-        self.vector_data = None
+        self.metadata = MetadataStore(self._paths["files"]["metadata"])
+        self.export_state = {"fingerprint": {}, "conversations": {}}
+        self.embedding_job = {"pending": []}
+        self.search_cache = SearchCache(
+            self._paths["dirs"]["search_cache"],
+            max_entries=self._configs["search_cache_max_entries"],
+            max_bytes=self._configs["search_cache_max_mb"] * 2 ** 20)
+        self.index_version = ""
+        # query embeddings are only reused for the same model and dimensions
+        self.embedding_version = (self._embeddings.model_name, self._configs["embedding_dimensions"])
+        self.vector_store = EmbeddingStore(
+            self._paths["files"]["vector_store"],
+            dtype=self._configs["vector_store_dtype"],
+            dimensions=self._configs["embedding_dimensions"],
+            max_segments=self._configs["vector_store_max_segments"],
+            max_tombstones=self._configs["vector_store_max_tombstones"])
+        self._embedding_params = {"dimensions": self._configs["embedding_dimensions"]} if self._configs["embedding_dimensions"] else {}
+        self.vector_engine = VectorEngine(aggregator=TopKAggregator(
+            reducer=self._configs["search_reducer"],
+            top_n=self._configs["search_reducer_top_n"]), metadata=MetadataFilter())
+        self.lexical_index = None
+        if self._configs["search_mode"] != "vector":
+            self.lexical_index = BM25Index(self._paths["files"]["lexical_index"])
+        self.ann_index = None
+        if self._configs["ann_index"] == "ivf":
+            self.ann_index = IVFIndex(
+                self._paths["files"]["ann_index"],
+                nlist=self._configs["ann_nlist"],
+                nprobe=self._configs["ann_nprobe"])
+        self.quantizer = None
+        if self._configs["quantization"] != "none":
+            options = {}
+            if self._configs["quantization_candidates"]:
+                options["candidates"] = self._configs["quantization_candidates"]
+            if self._configs["quantization"] == "matryoshka":
+                options["coarse_dimensions"] = self._configs["quantization_dimensions"]
+            self.quantizer = quantizers[self._configs["quantization"]](self._paths["files"]["quantized"], **options)
 
     @staticmethod
     def justified_print(text, length_thr=120):
@@ -51,254 +128,525 @@ class ChatGPTSearchEngine:
     def generate_hash(text):
         return hashlib.sha256(text.encode('utf-8')).hexdigest()
 
-    async def prepare_conversations(self, updates, exported):
-        def get_content():
-            content = message["content"]
-            content_type = content["content_type"]
-
-            if content_type in ['text', 'multimodal_text']:
-                text = ' '.join([m.strip() for m in content["parts"] if isinstance(m, str) and m.strip()])
-            elif content_type == "code":
-                if content['language'] == 'unknown':
-                    content['language'] = 'python' if message['recipient'] == 'python' else 'code'
-                text = f"Code Snippet: {content['language']}\n\n{content['text']}"
-            elif content_type == 'execution_output':
-                text = f"Execution Output: {content['text']}"
-            elif content_type in ['tether_browsing_display', 'tether_quote']:
-                if message['metadata'].get('command') == 'context_stuff':
-                    text = f"Context Stuff\n\nTitle: {content['domain']}\n\n{content['text']}"
-                elif message["metadata"].get('_cite_metadata'):
-                    query = ' '.join([s for s in message['metadata']['args'] if isinstance(s, str)])
-                    if message['author']['name'] == 'browser':
-                        text = f"Web Browsing Results"
-                        text += f"\n\nSearch Query: {query}" if query else ""
-                        for r in message['metadata']['_cite_metadata']['metadata_list']:
-                            text += f"\n\nType: {r['type']}\nURL: {r['url']}\nTitle: {r['title']}\nResult: {r['text']}"
-                    elif message['author']['name'] == 'myfiles_browser':
-                        text = f"Files Browsing Results"
-                        text += f"\n\nSearch Query: {query}" if query else ""
-                        for r in message['metadata']['_cite_metadata']['metadata_list']:
-                            text += f"\n\nType: {r['type']}\nName: {r['name']}\nResult: {r['text']}"
-                    else:
-                        return ''
-                else:
-                    return ''
-            elif content_type in ['system_error']:
-                return ''
-            else:
-                print(f"Unknown message content type: {content_type}")
-                return ''
-
-            if not text or len(text) < self._configs["ignore_threshold"]:
-                return ''
-
-            return text
-
-        def get_chunks():
-            breaklimit, overlap = self._configs["chunk_break_line"], self._configs["chunk_trim_overlap"]
-            try:
-                tokenized = self._embeddings.client.tokenizer.tokenize(message_content)
-                n_tokens = len(tokenized)
-                n_segments = max(1, round(n_tokens / breaklimit))
-
-                if abs(n_tokens - breaklimit) <= abs(n_tokens / n_segments - breaklimit):
-                    return [message_content]
+    def find_updates(self, exported):
+        states = self.export_state["conversations"]
+        msg_to_ignore = self.metadata.ignored()
+        raw_message_counts = self.metadata.raw_message_counts()
+        for conversation in exported:
+            conversation_id = conversation.get("conversation_id")
+            if not conversation_id or conversation_id in msg_to_ignore:
+                continue
 
-                optimal = n_tokens // n_segments
-                segments = []
-                for i in range(0, n_tokens, optimal):
-                    start = i - overlap if i > overlap else 0
-                    end = i + optimal + overlap if (i + optimal + overlap <= n_tokens) else n_tokens
-                    segments.append(tokenized[start:end])
+            # an unchanged update time skips hashing; a new one is confirmed against the content hash
+            state = states.get(conversation_id, {})
+            update_time = conversation.get("update_time")
+            if state and state["update_time"] == update_time and conversation_id in raw_message_counts:
+                continue
 
-                if len(segments) > 1 and len(segments[-1]) < optimal:
-                    segments[-2].extend(segments[-1])
-                    segments.pop()
+            content_hash = ExportReader.conversation_hash(conversation)
+            if conversation_id not in raw_message_counts:
+                changed = True
+            elif state:
+                changed = state["hash"] != content_hash
+            else:
+                total_raw_messages = len(conversation["mapping"].values())
+                changed = raw_message_counts[conversation_id] != total_raw_messages
 
-                return [self._embeddings.client.tokenizer.stringify(segment) for segment in segments]
-            except Exception as e:
-                print(f"Error processing text: {e}")
-                return [message_content]
+            states[conversation_id] = {"update_time": update_time, "hash": content_hash}
+            if changed:
+                yield conversation
 
-        msg_cache = await self.file_tools.read_json_async(self._paths["files"]["msg_cache"], default={})
-        for conversation in exported[::-1]:
-            conversation_id = conversation.get("conversation_id")
+    async def prepare_conversations(self, updates, on_chunk=None):
+        total_updates = 0
+        async for conversation_id, entry, chunks in self.process_conversations(updates):
             if not conversation_id:
                 continue
-
-            if conversation_id not in updates:
+            total_updates += 1
+
+            # the chunks of edited or removed messages lose their addresses and are deleted once orphaned
+            self.metadata.clear_addresses(conversation_id)
+            if entry is None:
+                # a conversation left without indexable messages must not keep its stale messages either
+                self.metadata.delete_conversation(conversation_id)
+                self.metadata.ignore(conversation_id)
                 continue
 
-            conversation_title = ' '.join(conversation.get("title", "").split())
-            if not conversation_title:
-                conversation_title = f"Untitled Chat"
-
-            messages = []
-            for message in conversation["mapping"].values():
-                message = message.get("message")
-                if not message:
-                    continue
-
-                role = message["author"]["role"]
-                if role == "system":
-                    continue
-
-                if message["status"] != "finished_successfully":
-                    continue
-
-                message_content = get_content()
-                if not message_content:
-                    continue
-
-                message_segments = get_chunks()
-
-                for msg in message_segments:
-                    msg_hash = self.generate_hash(msg)
-                    if not msg_cache.get(msg_hash):
-                        msg_cache[msg_hash] = {
-                            "content": msg, "addresses": [[conversation_id, len(messages)]]
-                        }
-                    elif [conversation_id, len(messages)] not in msg_cache[msg_hash]["addresses"]:
-                        msg_cache[msg_hash]["addresses"].append([conversation_id, len(messages)])
-
-                model = message["metadata"].get("model_slug", "gpt") if role == "assistant" else "user"
-                messaged_at = datetime.fromtimestamp(message["create_time"]).strftime("%Y-%m-%d %H:%M:%S")
-                messages.append({
-                    "context": {
-                        "role": role,
-                        "content": message_content,
-                    },
-                    "metadata": {
-                        "model": model,
-                        "created_at": messaged_at,
-                        "message_index": len(messages),
-                        "conversation_id": conversation_id,
-                        "conversation_title": conversation_title,
-                    }
-                })
-
-            if not messages:
-                self.msg_to_ignore.append(conversation_id)
-                continue
+            for msg_hash, msg, message_index in chunks:
+                self.metadata.add_address(msg_hash, conversation_id, message_index)
+                if self.metadata.add_chunk(msg_hash, msg):
+                    if self.lexical_index is not None:
+                        self.lexical_index.add(msg_hash, msg)
+                    if on_chunk is not None:
+                        await on_chunk(msg_hash, msg)
+
+            self.metadata.put_conversation(entry)
+
+        return total_updates
+
+    async def process_conversations(self, updates):
+        settings = (
+            self._configs["ignore_threshold"],
+            self._configs["chunk_break_line"],
+            self._configs["chunk_trim_overlap"])
+        workers = self._configs["ingest_workers"] or os.cpu_count() or 1
+        if workers == 1:
+            processor = ConversationProcessor(*settings)
+            for conversation in updates:
+                yield processor(conversation)
+                await asyncio.sleep(0)  # lets in-flight embedding requests progress
+            return
+
+        # conversations are processed in a bounded window and yielded in export order,
+        # so the merge into the metadata store is identical to the serial path for any worker count
+        loop = asyncio.get_running_loop()
+        window = deque()
+        with ProcessPoolExecutor(max_workers=workers, initializer=ConversationProcessor.init_worker, initargs=settings) as pool:
+            for conversation in updates:
+                window.append(loop.run_in_executor(pool, ConversationProcessor.process_in_worker, conversation))
+                if len(window) >= workers * 4:
+                    yield await window.popleft()
+            while window:
+                yield await window.popleft()
+
+    async def ingest(self, updates):
+        queue = asyncio.Queue(maxsize=self._configs["embedding_queue_size"])
+        progress = {"chats": 0, "queued": 0, "embedded": 0, "failed": 0, "tokens": 0, "printed": 0}
+        job = {"pending": set(), "vectors": {}, "started_at": time.time(), "checkpointed_at": time.time()}
+        journal = self._embeddings.journal
+
+        async def enqueue(msg_hash, content):
+            if self.vector_store.row(msg_hash) is not None or msg_hash in job["pending"] or msg_hash in job["vectors"]:
+                return
+            # responses received after the last checkpoint of an interrupted run are still in the journal
+            journaled = [r for r in journal.get(msg_hash) if r.get("output")] if journal is not None and msg_hash in journal else []
+            if journaled:
+                job["vectors"][msg_hash] = self.file_tools.vector(journaled[-1]["output"])
+                return
+            tokens = self._embeddings.client.tokenizer.count_tokens(content)
+            progress["queued"] += 1
+            progress["tokens"] += tokens
+            job["pending"].add(msg_hash)
+            await queue.put((msg_hash, tokens))
+
+        def parse(conversations):
+            for conversation in conversations:
+                progress["chats"] += 1
+                yield conversation
+
+        async def produce():
+            if self.embedding_job["pending"]:
+                print(f"- Resuming Embedding Job - Pending Msg Chunks: {len(self.embedding_job['pending'])} -")
+            pending = set(self.embedding_job["pending"])
+            leftovers = [chunk for chunk in self.metadata.chunks() if self.vector_store.row(chunk[0]) is None]
+            leftovers.sort(key=lambda chunk: chunk[0] not in pending)
+            for msg_hash, content in leftovers:
+                await enqueue(msg_hash, content)
+            total_updates = await self.prepare_conversations(parse(updates), on_chunk=enqueue)
+            await queue.put(None)
+            return total_updates
+
+        # chunks flow from the parser to the embedding batcher as soon as they are produced;
+        # the bounded queue holds the parser back while the API is the bottleneck
+        tasks = [asyncio.create_task(produce()), asyncio.create_task(self.generate_embeddings(queue, progress, job))]
+        try:
+            total_updates, _ = await asyncio.gather(*tasks)
+        except BaseException:
+            # an interrupted run keeps everything embedded so far
+            self.checkpoint(job)
+            raise
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self._embeddings.journal.flush()
+
+        self.embedding_job = {"started_at": job["started_at"], "pending": sorted(job["pending"])}
+        self.print_progress(progress, final=True)
+        print(f"- New Chats: {total_updates} - Total Chats: {len(self.metadata)} - Total Msg Chunks: {self.metadata.chunk_count()} -")
+        if progress["failed"]:
+            print(f"- Failed to Embed {progress['failed']} Msg Chunks - They Will Be Retried on the Next Run -")
+        metrics = self._embeddings.retry_policy.metrics
+        if metrics["retries"] or metrics["exhausted"]:
+            retries, exhausted = (
+                ", ".join(f"{status}: {count}" for status, count in sorted(counts.items(), key=str)) or "None"
+                for counts in (metrics["retries"], metrics["exhausted"]))
+            print(f"- Retried Requests - {retries} - Gave Up - {exhausted} -", end=" ")
+            print(f"Circuit Opened: {metrics['circuit_opened']} Times -")
+        stats = self.session_pool.stats
+        print(f"- HTTP Requests: {stats['requests']} - New Connections: {stats['new_connections']} -", end=" ")
+        print(f"Connection Setup: {round(stats['connect_mean'] * 1000)} ms -", end=" ")
+        print(f"Server: {round(stats['server_mean'] * 1000)} ms (p95: {round(stats['server_p95'] * 1000)} ms) -")
+
+        return job
+
+    def commit_vectors(self, vectors):
+        """
+        Appends the new embeddings to the embedding store
+
+        The store is the only copy of an embedding: it is keyed by chunk hash and holds each vector
+        once. The embeddings are appended as a new segment, so a commit writes the new embeddings only.
+
+        :param vectors: dictionary of the embeddings not stored yet (emptied once they are stored)
+
+        :return: None
+        """
+        self.vector_store.update(list(vectors.items()), model=self._embeddings.model_name)
+        vectors.clear()
+
+    async def maintain_vectors(self):
+        """
+        Deletes orphaned chunks and merges or compacts the segments of the vector store
+
+        Orphaned chunks are removed from the metadata store and the lexical index, while their
+        embeddings are only tombstoned. The store is compacted once the tombstones exceed
+        VECTOR_STORE_MAX_TOMBSTONES of its rows, which renumbers the rows: the ANN index and the
+        quantized codes are dropped beforehand and rebuilt over the new rows. Otherwise the small
+        trailing segments are merged once there are more than VECTOR_STORE_MAX_SEGMENTS, which
+        keeps every row id. Both run in a worker thread.
+
+        :return: None
+        """
+        orphans = self.metadata.orphans()
+        if orphans:
+            self.vector_store.delete(orphans)
+            if self.lexical_index is not None:
+                self.lexical_index.remove(orphans)
+            self.metadata.delete_chunks(orphans)
+            self.metadata.commit()
+
+        if self.vector_store.needs_compaction:
+            for index in (self.ann_index, self.quantizer):
+                if index is not None and os.path.exists(index.path):
+                    os.remove(index.path)
+            tombstones = len(self.vector_store.tombstones)
+            await asyncio.to_thread(self.vector_store.compact)
+            print(f"- Compacted Vector Store - Removed Embeddings: {tombstones} - Rows: {len(self.vector_store)} -")
+        elif self.vector_store.needs_merge:
+            segments = len(self.vector_store.segments)
+            await asyncio.to_thread(self.vector_store.merge)
+            print(f"- Merged Vector Store Segments: {segments} -> {len(self.vector_store.segments)} -")
+
+    def checkpoint(self, job):
+        """
+        Commits the embeddings completed so far to durable storage
+
+        The vector and metadata stores are committed first and the job manifest last, so the
+        manifest never lists less than what is still missing from them. The manifest records the
+        chunks still waiting for an embedding, which the next launch requests first.
+
+        :param job: state of the running embedding job
+
+        :return: None
+        """
+        self.commit_vectors(job["vectors"])
+        self.metadata.commit()
+
+        self.embedding_job = {
+            "started_at": job["started_at"],
+            "checkpointed_at": time.time(),
+            "pending": sorted(job["pending"]),
+        }
+        self.file_tools.write_json(self._paths["files"]["embedding_job"], self.embedding_job, indent=None)
+        job["checkpointed_at"] = time.time()
+
+    async def generate_embeddings(self, queue, progress, job):
+        """
+        Packs the queued chunks into multi-input embedding requests and sends them
+
+        A single batcher drains the queue, so every request is packed up to the client's input and
+        token budgets. A partial request is only sent once no chunk arrived for EMBEDDING_BATCH_WAIT
+        seconds (or the queue is closed by a None item). At most EMBEDDING_CONCURRENCY requests are
+        in flight: while they are all busy the batcher holds the next request, and the bounded queue
+        holds the parser back. A failed sender stops the batcher with its exception.
+
+        :param queue: queue of (hash, token count) tuples of the chunks to embed, closed by None
+        :param progress: progress counters of the ingestion
+        :param job: state of the running embedding job
+
+        :return: None
+        """
+        client = self._embeddings.client
+        slots = asyncio.Semaphore(self._configs["embedding_concurrency"])
+        senders = set()
+        pending, closed = None, False
+        try:
+            while not closed:
+                item = pending if pending is not None else await queue.get()
+                if item is None:
+                    break
+                batch, tokens, pending = [item], item[1], None
+                while len(batch) < client.max_inputs:
+                    try:
+                        item = queue.get_nowait() if not queue.empty() else await asyncio.wait_for(
+                            queue.get(), timeout=self._configs["embedding_batch_wait"])
+                    except asyncio.TimeoutError:
+                        break
+                    if item is None:
+                        closed = True
+                        break
+                    if tokens + item[1] > client.max_tokens:
+                        pending = item
+                        break
+                    batch.append(item)
+                    tokens += item[1]
+
+                await slots.acquire()
+                for sender in [sender for sender in senders if sender.done()]:
+                    senders.discard(sender)
+                    sender.result()
+                sender = asyncio.create_task(self.send_embeddings(batch, progress, job))
+                sender.add_done_callback(lambda _: slots.release())
+                senders.add(sender)
+
+            await asyncio.gather(*senders)
+        except BaseException:
+            for sender in senders:
+                sender.cancel()
+            raise
+
+    async def send_embeddings(self, batch, progress, job):
+        msg_hashes = [msg_hash for msg_hash, _ in batch]
+        try:
+            results = await self._embeddings.get_response(
+                context=self.metadata.chunk_contents(msg_hashes),
+                identifier=msg_hashes,
+                lane="bulk",
+                **self._embedding_params)
+            for msg_hash, result in zip(msg_hashes, results):
+                if result.get("output") is not None:
+                    job["vectors"][msg_hash] = result["output"]
+                    job["pending"].discard(msg_hash)
+                    progress["embedded"] += 1
+                else:
+                    print(f"\n- Failed to Embed: {msg_hash} - Status: {result['status']} -")
+                    progress["failed"] += 1
+        except Exception as e:
+            print(f"\n- Failed to Embed {len(msg_hashes)} Msg Chunks - {e} -")
+            progress["failed"] += len(msg_hashes)
+        self.print_progress(progress)
+
+        interval = self._configs["embedding_checkpoint_interval"]
+        if interval and time.time() - job["checkpointed_at"] >= interval:
+            self.checkpoint(job)
+
+    def print_progress(self, progress, final=False):
+        done = progress["embedded"] + progress["failed"]
+        if not final and time.time() - progress["printed"] < 0.5:
+            return
+        progress["printed"] = time.time()
+
+        cost = round(progress["tokens"] * self._embeddings.client.specs["usage_costs"]["input"], 4)
+        print(f"\r- Parsed Chats: {progress['chats']} -", end=" ")
+        print(f"API Calls: {done}/{progress['queued']} - Tokens: {progress['tokens']} - Cost: ${cost} -", end=" ")
+        print(f"Model: {self._embeddings.model_name} -", end="\n" if final else "", flush=True)
+
+    async def search(self, query, identifier, limit, filters=None):
+        key = self.search_cache.result_key(query, limit, filters, version=self.index_version, mode=self._configs["search_mode"])
+        cached = self.search_cache.get_results(key)
+        if cached:
+            return cached
+
+        entry = {"search_query": query, "identifier": identifier, "limit": limit, "filters": filters or {}}
+        response = None
+        if self._configs["search_mode"] != "lexical":
+            response = self.search_cache.get_embedding(identifier, *self.embedding_version)
+            if response is None:
+                try:
+                    response = await self._embeddings.get_response(context=query, identifier=identifier, **self._embedding_params)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    # the API host is unreachable once the retries are exhausted
+                    response = {"output": None, "status": type(e).__name__, "error": str(e)}
+                if response.get("output") is not None:
+                    self.search_cache.put_embedding(identifier, response, *self.embedding_version)
+                elif self.lexical_index is None:
+                    raise ConnectionError(f"- Failed to Embed Query - Status: {response['status']} - {response['error']} -")
+                else:
+                    print(f"- Failed to Embed Query - Status: {response['status']} - Falling Back to Lexical Search -")
+                    return {**entry, "results": self.vector_engine.search_lexical(query, limit, filters)}
 
-            total_raw_messages = len(conversation["mapping"].values())
-            created_at = datetime.fromtimestamp(conversation.get("create_time", 0)).strftime("%Y-%m-%d %H:%M:%S")
-            conversation_url = "https://chatgpt.com/c/" + conversation_id
-            self.indexed_data[conversation_id] = {
-                "messages": messages,
-                "created_at": created_at,
-                "conversation_id": conversation_id,
-                "conversation_title": conversation_title,
-                "total_processed_messages": len(messages),
-                "total_raw_messages": total_raw_messages,
-                "conversation_url": conversation_url
-            }
-
-        print(f"Total Chats: {len(self.indexed_data)} - Total Msg Chunks: {len(msg_cache)} -")
-        return msg_cache
-
-    async def generate_embeddings(self, msg_cache):
-        tokens = []
-        vector_cache = await self.file_tools.read_json_async(self._paths["files"]["vector_cache"], default={})
-        for msg_hash, msg in msg_cache.items():
-            if msg.get("embedding"):
+        if response is None:
+            entry["results"] = self.vector_engine.search_lexical(query, limit, filters)
+        elif self._configs["search_mode"] == "hybrid":
+            entry["results"] = self.vector_engine.search_hybrid(response["output"], query, limit, filters)
+        else:
+            entry["results"] = self.vector_engine.search(response["output"], limit, filters)
+        self.search_cache.put_results(key, entry)
+
+        return entry
+
+    async def search_many(self, queries, limit, filters=None):
+        mode = self._configs["search_mode"]
+        identifiers = [self.generate_hash(query) for query in queries]
+        embeddings = {}
+        for query, identifier in zip(queries, identifiers):
+            if identifier in embeddings or mode == "lexical":
                 continue
+            response = self.search_cache.get_embedding(identifier, *self.embedding_version)
+            embeddings[identifier] = response["output"] if response else None
+            if not response:
+                self._embeddings.add_get_response(
+                    context=query, identifier=identifier, lane="interactive", **self._embedding_params)
+
+        if embeddings:
+            try:
+                async for response in self._embeddings.stream_get_response():
+                    if response.get("output") is not None:
+                        embeddings[response["identifier"]] = response["output"]
+                        self.search_cache.put_embedding(response["identifier"], response, *self.embedding_version)
+                    else:
+                        print(f"- Failed to Embed Query: {response['identifier']}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"- Failed to Embed Queries - {type(e).__name__}: {e} -")
+
+        ranked = {}
+        if mode == "vector":
+            embedded = [identifier for identifier in embeddings if embeddings[identifier] is not None]
+            ranked = dict(zip(embedded, self.vector_engine.search_many([embeddings[i] for i in embedded], limit, filters)))
+
+        results = []
+        for query, identifier in zip(queries, identifiers):
+            entry = {"search_query": query, "identifier": identifier, "limit": limit, "filters": filters or {}, "results": []}
+            embedding = embeddings.get(identifier)
+            if mode != "lexical" and embedding is None:
+                # as in search, queries that could not be embedded fall back to lexical search, uncached
+                if self.lexical_index is not None:
+                    entry["results"] = self.vector_engine.search_lexical(query, limit, filters)
             else:
-                if vector_cache.get(msg_hash) and vector_cache[msg_hash].get("output"):
-                    msg["embedding"] = vector_cache[msg_hash]["output"]
+                if mode == "lexical":
+                    entry["results"] = self.vector_engine.search_lexical(query, limit, filters)
+                elif mode == "hybrid":
+                    entry["results"] = self.vector_engine.search_hybrid(embedding, query, limit, filters)
                 else:
-                    self._embeddings.add_get_response(context=msg["content"], identifier=msg_hash)
-                    tokens.append(self._embeddings.client.tokenizer.count_tokens(msg["content"]))
+                    entry["results"] = ranked[identifier]
+                key = self.search_cache.result_key(query, limit, filters, version=self.index_version, mode=mode)
+                self.search_cache.put_results(key, entry)
+            results.append(entry)
 
-        if not tokens:
-            print(f"- No New API Calls Required - Data Already Cached -")
-        else:
-            print(f"- New API Calls: {len(tokens)} - Tokens: {sum(tokens)} -", end=" ")
-            print(f"Cost: ${round(sum(tokens) / 1000 * self._embeddings.client.model_specs['cost']['input'], 4)} -", end=" ")
-            print(f"Model: {self._embeddings.model_name} -", end=" ")
-            results = await self._embeddings.batch_get_response()
-            print("Fetched Successfully -")
-
-            if results:
-                for result in results:
-                    if result["output"]:
-                        msg_cache[result["identifier"]]["embedding"] = result["output"]
-                        os.remove(os.path.join(self._paths["dirs"]["vector_cache"], f"{result['identifier']}.json"))
-                        vector_cache[result["identifier"]] = result
-                    else:
-                        print(f"- Failed to Embed: {result['identifier']}")
-
-        return pd.DataFrame([
-            {"hash": msg_hash, **msg}
-            for msg_hash, msg in msg_cache.items()
-        ]), vector_cache
-
-    async def search(self, query, identifier, limit):
-        if identifier in self.search_cache:
-            return self.search_cache[identifier]
-
-        result = await self._embeddings.get_response(context=query, identifier=identifier)
-        data = [
-            (row["addresses"], row["hash"], 1 - cosine_similarity(result["output"], row["embedding"]))
-            for i, row in self.vector_data.iterrows()
-        ]
-
-        self.search_cache[identifier] = result
-        self.search_cache[identifier]["search_query"] = query
-        search_results = sorted(data, key=lambda x: x[2], reverse=True)
-        result_addresses = []
-        for i, (addresses, msg_hash, score) in enumerate(search_results):
-            for address in addresses:
-                if address[0] not in result_addresses:
-                    result_addresses.append(address[0])
-            if len(result_addresses) >= limit:
-                break
+        return results
 
-        self.search_cache[identifier]["results"] = result_addresses[:limit]
-        file_path = os.path.join(self._paths["dirs"]["search_cache"], f"{identifier}.json")
-        self.file_tools.write_json(file_path, self.search_cache[identifier])
+    async def migrate_caches(self):
+        """
+        One-shot migration of the legacy JSON caches
 
-        return self.search_cache[identifier]
+        The conversations (index.json), message chunks (msg_cache.json) and ignored conversations
+        (msg_to_ignore.json) are moved into the metadata store. Embeddings were also stored up to
+        three times (msg_cache, vector_cache and the vector store); the ones missing from the store
+        are moved into it. The legacy files are removed afterwards.
 
-    async def prep_logic(self):
-        self.msg_to_ignore = await self.file_tools.read_json_async(self._paths["files"]["msg_to_ignore"], default=self.msg_to_ignore)
-        self.indexed_data = await self.file_tools.read_json_async(self._paths["files"]["index"], default=self.indexed_data)
-        self.vector_data = self.file_tools.read_df(self._paths["files"]["vector_data"], dtype="pkl", default=self.vector_data)
-        self.search_cache = await self.file_tools.read_dir_contents_async(self._paths["dirs"]["search_cache"], dtype="json", default=self.search_cache)
+        :return: None
+        """
+        indexed_data = await self.file_tools.read_json_async(self._paths["files"]["index"], default={})
+        msg_cache = await self.file_tools.read_json_async(self._paths["files"]["msg_cache"], default={})
+        vector_cache = await self.file_tools.read_json_async(self._paths["files"]["vector_cache"], default={})
+        msg_to_ignore = await self.file_tools.read_json_async(self._paths["files"]["msg_to_ignore"], default=[])
+        vectors = {}
+        for msg_hash, msg in msg_cache.items():
+            embedding = msg.pop("embedding", None)
+            if embedding is None and vector_cache.get(msg_hash):
+                embedding = vector_cache[msg_hash].get("output")
+            if embedding is not None and self.vector_store.row(msg_hash) is None:
+                vectors[msg_hash] = embedding
+
+        self.metadata.migrate(indexed_data, msg_cache, msg_to_ignore)
+        self.commit_vectors(vectors)
+        self.metadata.commit()
+        for key in self.legacy_caches:
+            if os.path.exists(self._paths["files"][key]):
+                os.remove(self._paths["files"][key])
+        print(f"- Migrated {len(indexed_data)} Chats and {len(msg_cache)} Msg Chunks to {self.metadata.path} -")
 
-        exported = await self.file_tools.read_json_async(self._paths["files"]["exported"], default={})
-        if not self.indexed_data and not exported:
+    async def prep_logic(self):
+        if not self.vector_store.open() and self.vector_store.migrate_pickle(
+                self._paths["files"]["vector_data"], model=self._embeddings.model_name):
+            os.remove(self._paths["files"]["vector_data"])
+            print(f"- Migrated {self._paths['files']['vector_data']} to {self.vector_store.sidecar_path} -")
+        if self.vector_store.truncate():
+            print(f"- Shortened Stored Embeddings to {self.vector_store.dimensions} Dimensions -")
+        if any(os.path.exists(self._paths["files"][key]) for key in self.legacy_caches):
+            await self.migrate_caches()
+        self.search_cache.load()
+        if self.lexical_index is not None:
+            self.lexical_index.load()
+
+        self.export_state = await self.file_tools.read_json_async(self._paths["files"]["export_state"], default=self.export_state)
+        if os.path.exists(self._paths["files"]["embedding_job"]):
+            self.embedding_job = await self.file_tools.read_json_async(self._paths["files"]["embedding_job"], default=self.embedding_job)
+        exported = ExportReader(self._paths["files"]["exported"])
+        if not len(self.metadata) and not exported.exists():
             raise FileNotFoundError(f"- Exported JSON File Not Found - Path: {self._paths['files']['exported']}")
 
-        updates = []
-        for conversation in exported:
-            conversation_id = conversation.get("conversation_id")
-            if not conversation_id or conversation_id in self.msg_to_ignore:
-                continue
-
-            if not self.indexed_data.get(conversation_id):
-                updates.append(conversation_id)
-            else:
-                total_raw_messages = len(conversation["mapping"].values())
-                if self.indexed_data[conversation_id]["total_raw_messages"] != total_raw_messages:
-                    updates.append(conversation_id)
-
-        if updates:
-            print(f"- Processing Exported Chats - New Chats: {len(updates)} -", end=" ")
-            msg_cache = await self.prepare_conversations(updates, exported)
-            self.vector_data, vector_cache = await self.generate_embeddings(msg_cache=msg_cache)
+        fingerprint = exported.fingerprint(self.export_state["fingerprint"]) if exported.exists() else {}
+        if len(self.metadata) and fingerprint.get("sha256") in (None, self.export_state["fingerprint"].get("sha256")):
+            updates = iter([])
+        else:
+            # conversations are streamed from the export and only the changed ones are kept in memory
+            updates = self.find_updates(exported)
+        first_update = next(updates, None)
+        if first_update is not None or self.embedding_job["pending"]:
+            print(f"- Processing Exported Chats -")
+            job = await self.ingest(
+                itertools.chain([first_update], updates) if first_update is not None else updates)
 
             print(f"- Finalizing and Storing Processed Data -", end=" ")
-            self.file_tools.write_json(self._paths["files"]["index"], self.indexed_data)
-            self.file_tools.write_json(self._paths["files"]["msg_cache"], msg_cache)
-            self.file_tools.write_json(self._paths["files"]["vector_cache"], vector_cache)
-            self.file_tools.write_df(self._paths["files"]["vector_data"], self.vector_data, dtype="pkl")
-            self.file_tools.write_json(self._paths["files"]["msg_to_ignore"], self.msg_to_ignore)
+            self.commit_vectors(job["vectors"])
+            self.metadata.commit()
+            if self.embedding_job["pending"]:
+                self.file_tools.write_json(self._paths["files"]["embedding_job"], self.embedding_job, indent=None)
+            elif os.path.exists(self._paths["files"]["embedding_job"]):
+                os.remove(self._paths["files"]["embedding_job"])
             print(f"Done -")
 
+        if fingerprint and fingerprint != self.export_state["fingerprint"]:
+            self.export_state["fingerprint"] = fingerprint
+            self.file_tools.write_json(self._paths["files"]["export_state"], self.export_state, indent=None)
+
+        await self.maintain_vectors()
+
+        if self.ann_index is not None:
+            self.ann_index.load()
+            if self.ann_index.sync(self.vector_store.matrix):
+                self.ann_index.save()
+
+        if self.quantizer is not None:
+            self.quantizer.load()
+            if self.quantizer.sync(self.vector_store.matrix):
+                self.quantizer.save()
+            print(f"- Quantization: {self.quantizer.mode} -", end=" ")
+            print(f"Codes: {round(self.quantizer.nbytes / 2 ** 20, 2)} MB -", end=" ")
+            print(f"Embeddings: {round(self.vector_store.matrix.nbytes / 2 ** 20, 2)} MB -", end=" ")
+            print(f"Recall@{self.quantizer.stats['k']}: {round(self.quantizer.stats['recall'], 3)} -")
+
+        if self.lexical_index is not None:
+            if len(self.lexical_index) != self.metadata.chunk_count():
+                stored = set()
+                for msg_hash, content in self.metadata.chunks():
+                    stored.add(msg_hash)
+                    self.lexical_index.add(msg_hash, content)
+                self.lexical_index.remove([msg_hash for msg_hash in self.lexical_index.documents if msg_hash not in stored])
+            if self.lexical_index.changed:
+                self.lexical_index.save()
+
+        self.vector_engine.build_from_store(self.vector_store, self.metadata.addresses())
+        self.vector_engine.lexical = self.lexical_index
+        self.vector_engine.metadata.build(
+            self.vector_engine.addresses, self.vector_engine.aggregator, self.metadata.message_metadata())
+        self.index_version = ":".join(str(part) for part in [
+            self.vector_store.header.get("revision"),
+            self.metadata.revision,
+            self._configs["search_mode"],
+            self._configs["search_reducer"],
+            self._configs["search_reducer_top_n"],
+            self._configs["ann_index"],
+            self._configs["ann_nprobe"],
+            self._configs["quantization"],
+            self._configs["quantization_candidates"],
+            self._configs["quantization_dimensions"],
+        ])
+        self.vector_engine.ann = self.ann_index
+        self.vector_engine.quantizer = self.quantizer
+
     async def chat_logic(self, results, result_index, identifier):
-        conversation_title = results["results"][result_index - 1]
-        context = self.indexed_data[conversation_title].copy()
+        conversation_id = results["results"][result_index - 1]
+        context = self.metadata.conversation(conversation_id)
         context_str = ""
         context_list = []
         for message in context["messages"]:
@@ -308,7 +656,7 @@ class ChatGPTSearchEngine:
             context_list.append(message['context'])
 
         token_count = self._completions.client.tokenizer.count_tokens(context_list)
-        cost = round(token_count / 1000 * self._completions.client.specs['cost']['input'], 4)
+        cost = round(token_count * self._completions.client.specs['usage_costs']['input'], 4)
         print(f"\n\n- {context['conversation_title']} -")
         print(f"- Length: {len(context['messages'])} Messages - Length: {token_count} Tokens -")
         print(f"- API Input Cost: ~${cost}+ Per Prompt Using {self._completions.model_name} Model -")
@@ -325,14 +673,23 @@ class ChatGPTSearchEngine:
 
             context_list.append({"role": "assistant", "content": response["output"]})
             self.justified_print(f"\n-----\n\n- Assistant: {response['output']}")
-            self.indexed_data[conversation_title]["messages"].extend([context_list[-2], context_list[-1]])
 
-        # Add the new messages into the index and generate embeddings
-        self.file_tools.write_json(self._paths["files"]["index"], self.indexed_data)
+            # only the new messages are appended to the stored conversation
+            messaged_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.metadata.append_messages(conversation_id, [{
+                "context": message,
+                "metadata": {
+                    "model": self._completions.model_name if message["role"] == "assistant" else "user",
+                    "created_at": messaged_at,
+                    "conversation_id": conversation_id,
+                    "conversation_title": context["conversation_title"],
+                }
+            } for message in context_list[-2:]])
+            self.metadata.commit()
 
     async def search_logic(self):
         self._completions.backlogs_dir = self._paths["dirs"]["search_cache"]
-        self._embeddings.backlogs_dir = self._paths["dirs"]["search_cache"]
+        self._embeddings.save_backlogs = False  # query embeddings are persisted by the search cache
 
         while True:
             query = input("- Search Query (0 to Exit): ")
@@ -342,14 +699,24 @@ class ChatGPTSearchEngine:
                 page_size = int(input("- Page Size (Default: 10): ") or self._configs["search_limit"])
             except ValueError:
                 page_size = self._configs["search_limit"]
+            try:
+                filters = MetadataFilter.parse(input("- Filters (Optional, e.g. after:2024-01-01 model:gpt-4o role:user): "))
+            except ValueError as e:
+                print(f"- {e} - Searching Without Filters -")
+                filters = {}
 
             identifier = self.generate_hash(query)
-            results = await self.search(query, identifier, limit=page_size)
+            try:
+                results = await self.search(query, identifier, limit=page_size, filters=filters)
+            except ConnectionError as e:
+                # without a lexical index there is nothing to fall back to
+                print(e)
+                continue
 
             print(f"- Search Results for '{query}':")
             table = []
             for i, address in enumerate(results["results"], start=1):
-                info = self.indexed_data[address]
+                info = self.metadata.conversation(address, messages=False)
                 table.append([i, info["conversation_title"], info["created_at"], info["conversation_url"]])
                 if i >= page_size:
                     break
@@ -362,8 +729,21 @@ class ChatGPTSearchEngine:
                 await self.chat_logic(results, result_index, identifier)
 
     async def main(self):
-        await self.prep_logic()
-        await self.search_logic()
+        # the connections are opened while the caches load, so the first request finds them ready
+        warmup = asyncio.create_task(self.session_pool.warmup(
+            [self._embeddings.client.endpoint, self._completions.client.endpoint],
+            connections=min(self._configs["http_warmup_connections"], self._configs["http_connections_per_host"])))
+        try:
+            await self.prep_logic()
+            await warmup
+            await self.search_logic()
+        finally:
+            warmup.cancel()
+            await self._completions.close()
+            await self._embeddings.close()
+            await self.session_pool.close()
+            self.search_cache.close()
+            self.metadata.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,193 @@
+import os
+
+import numpy as np
+
+
+class IVFIndex:
+    version = 1
+    block_size = 65536
+
+    def __init__(
+            self,
+            path: str,
+            nlist: int = 0,
+            nprobe: int = 8,
+            iterations: int = 10,
+            sample_size: int = 65536,
+            rebuild_growth: float = 2.0,
+            seed: int = 0
+    ) -> None:
+        """
+        Initializes the inverted file (IVF) approximate nearest-neighbour index
+
+        Rows of the embedding matrix are clustered with spherical k-means and each row is assigned to
+        its closest centroid. A query only scores the rows of its `nprobe` closest clusters, so search
+        cost drops from O(N·d) to roughly O(nlist·d + N·nprobe/nlist·d). The index only stores the
+        centroids and one cluster id per row, the vectors themselves stay in the embedding store.
+
+        :param path: path of the persisted index (.npz)
+        :param nlist: number of clusters (0 picks 4·sqrt(N) when the index is trained)
+        :param nprobe: number of closest clusters scanned per query (higher is slower but more accurate)
+        :param iterations: k-means iterations
+        :param sample_size: maximum number of rows used to train the centroids
+        :param rebuild_growth: retrain the centroids once the matrix outgrows the trained size by this factor
+        :param seed: random seed of the k-means initialization
+
+        :return: None
+        """
+        self.path = path if path.endswith(".npz") else f"{path}.npz"
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.sample_size = sample_size
+        self.rebuild_growth = rebuild_growth
+        self.seed = seed
+
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.trained_count = 0
+        self._order = np.empty(0, dtype=np.int64)
+        self._offsets = np.zeros(1, dtype=np.int64)
+
+    def __repr__(self):
+        nlist = 0 if self.centroids is None else len(self.centroids)
+        return f"IVFIndex(rows={len(self.assignments)}, nlist={nlist}, nprobe={self.nprobe})"
+
+    def __len__(self):
+        return len(self.assignments)
+
+    def load(self) -> bool:
+        """
+        Loads the persisted index
+
+        :return: True if the index was found and loaded, False otherwise
+        """
+        if not os.path.exists(self.path):
+            return False
+
+        try:
+            with np.load(self.path) as data:
+                if int(data["version"]) != self.version:
+                    return False
+                self.centroids = data["centroids"]
+                self.assignments = data["assignments"]
+                self.trained_count = int(data["trained_count"])
+        except (OSError, KeyError, ValueError) as e:
+            print(f"- Failed to Load ANN Index: {e} -")
+            return False
+
+        self._build_lists()
+        return True
+
+    def save(self) -> None:
+        """
+        Persists the index next to the embedding store
+
+        :return: None
+        """
+        tmp_path = f"{self.path[:-4]}.tmp.npz"
+        np.savez(
+            tmp_path,
+            version=self.version,
+            centroids=self.centroids,
+            assignments=self.assignments,
+            trained_count=self.trained_count)
+        os.replace(tmp_path, self.path)
+
+    def sync(self, matrix: np.ndarray) -> bool:
+        """
+        Brings the index up to date with the embedding matrix
+
+        Rows appended to the matrix since the last sync are assigned to the existing centroids. The
+        centroids are retrained when the index is empty, no longer matches the matrix or the matrix
+        has outgrown the trained size by `rebuild_growth`.
+
+        :param matrix: pre-normalized embedding matrix
+
+        :return: True if the index changed, False otherwise
+        """
+        if not len(matrix):
+            return False
+
+        if (self.centroids is None
+                or self.centroids.shape[1] != matrix.shape[1]
+                or len(self.assignments) > len(matrix)
+                or len(matrix) > self.trained_count * self.rebuild_growth):
+            self.build(matrix)
+            return True
+
+        if len(self.assignments) < len(matrix):
+            self.add(matrix, start=len(self.assignments))
+            return True
+
+        return False
+
+    def build(self, matrix: np.ndarray) -> None:
+        """
+        Trains the centroids with spherical k-means and assigns every row
+
+        :param matrix: pre-normalized embedding matrix
+
+        :return: None
+        """
+        nlist = self.nlist or int(4 * np.sqrt(len(matrix)))
+        nlist = max(1, min(nlist, len(matrix)))
+        rng = np.random.default_rng(self.seed)
+
+        sample_rows = np.sort(rng.choice(len(matrix), min(len(matrix), self.sample_size), replace=False))
+        sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)]
+
+        for _ in range(self.iterations):
+            labels = self._assign(sample, centroids)
+            order = np.argsort(labels, kind="stable")
+            clusters, starts = np.unique(labels[order], return_index=True)
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            centroids = sample[rng.choice(len(sample), nlist)]
+            centroids[clusters] = sums
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            centroids = centroids / norms
+
+        self.centroids = centroids
+        self.trained_count = len(matrix)
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.add(matrix, start=0)
+
+    def add(self, matrix: np.ndarray, start: int) -> None:
+        """
+        Assigns the rows of the matrix from `start` onwards to their closest centroid
+
+        :param matrix: pre-normalized embedding matrix
+        :param start: first row to assign
+
+        :return: None
+        """
+        self.assignments = np.concatenate([self.assignments[:start], self._assign(matrix[start:], self.centroids)])
+        self._build_lists()
+
+    def candidates(self, query: np.ndarray, nprobe: int = None) -> np.ndarray:
+        """
+        Collects the rows of the clusters closest to the query
+
+        :param query: normalized query embedding
+        :param nprobe: number of clusters to scan (defaults to the index setting)
+
+        :return: sorted row ids of the candidate chunks
+        """
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        closest = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.concatenate([self._order[self._offsets[c]:self._offsets[c + 1]] for c in closest])
+        return np.sort(rows)
+
+    def _assign(self, vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), self.block_size):
+            block = np.asarray(vectors[start:start + self.block_size], dtype=np.float32)
+            labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        return labels
+
+    def _build_lists(self) -> None:
+        self._order = np.argsort(self.assignments, kind="stable")
+        counts = np.bincount(self.assignments, minlength=len(self.centroids))
+        self._offsets = np.concatenate([[0], np.cumsum(counts)])
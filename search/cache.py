@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+from helpers.files import FileTools
+
+
+class SearchCache:
+    version = 1
+
+    def __init__(
+            self,
+            path: str,
+            max_entries: int = 10000,
+            max_bytes: int = 256 * 2 ** 20,
+            memory_entries: int = 128,
+            index_hits: int = 64
+    ) -> None:
+        """
+        Initializes the bounded, lazily loaded search cache
+
+        Query embeddings (embeddings/<embedding key>.json) are stored apart from ranked results
+        (results/<result key>.json), so a paid embedding is reused across limits, filters and index
+        rebuilds while stale rankings are simply never looked up again. A compact index file records
+        the size and last use of every entry: startup only reads that index, entries are read on
+        demand and the least recently used ones are evicted once the cache outgrows its bounds.
+        Cache hits only update the last use in memory; the index is written every `index_hits` hits
+        and on `close`, so the recency survives a restart without a write per lookup.
+
+        :param path: directory of the search cache
+        :param max_entries: maximum number of entries kept on disk
+        :param max_bytes: maximum size of the entries kept on disk
+        :param memory_entries: maximum number of entries kept in memory
+        :param index_hits: number of cache hits after which the index is written
+
+        :return: None
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.index_hits = index_hits
+        self.file_tools = FileTools()
+
+        self._index_path = os.path.join(path, "index.json")
+        self._index = OrderedDict()
+        self._memory = OrderedDict()
+        self._size = 0
+        self._hits = 0
+
+        for kind in ("embeddings", "results"):
+            os.makedirs(os.path.join(path, kind), exist_ok=True)
+
+    def __repr__(self):
+        return f"SearchCache(entries={len(self)}, size={self._size})"
+
+    def __len__(self):
+        return len(self._index)
+
+    @staticmethod
+    def result_key(query: str, limit: int, filters: dict = None, version: str = "", mode: str = "vector") -> str:
+        """
+        Builds the key of a ranked result
+
+        :param query: search query
+        :param limit: number of requested results
+        :param filters: search filters
+        :param version: version of the index the results were ranked against
+        :param mode: search mode the results were ranked with (vector, lexical or hybrid)
+
+        :return: result key
+        """
+        key = json.dumps([query, limit, filters or {}, version, mode], sort_keys=True, default=str)
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def embedding_key(query_hash: str, model: str, dimensions: int = 0) -> str:
+        """
+        Builds the key of a query embedding
+
+        :param query_hash: hash of the search query
+        :param model: embedding model the query was embedded with
+        :param dimensions: requested embedding dimensions (0 for the model default)
+
+        :return: embedding key
+        """
+        key = json.dumps([query_hash, model, dimensions])
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def load(self) -> None:
+        """
+        Loads the compact cache index, dropping entries whose files are missing
+
+        :return: None
+        """
+        index = self.file_tools.read_json(self._index_path, default={"version": self.version, "entries": []})
+        if index.get("version") != self.version:
+            index["entries"] = []
+
+        self._index = OrderedDict(
+            ((kind, key), [size, used])
+            for kind, key, size, used in sorted(index["entries"], key=lambda entry: entry[3])
+            if os.path.exists(self._entry_path(kind, key)))
+        self._size = sum(size for size, _ in self._index.values())
+
+    def close(self) -> None:
+        """
+        Writes the last use of the entries hit since the index was last written
+
+        :return: None
+        """
+        if self._hits:
+            self._write_index()
+
+    def get_embedding(self, query_hash: str, model: str, dimensions: int = 0) -> dict or None:
+        """
+        Gets a cached query embedding response, adopting a legacy <query hash>.json entry on first use
+
+        Embeddings are keyed by the model and dimensions too, so changing either never reuses a
+        vector of the wrong shape.
+
+        :param query_hash: hash of the search query
+        :param model: embedding model the query is embedded with
+        :param dimensions: requested embedding dimensions (0 for the model default)
+
+        :return: embedding response (its output decoded to a float32 array) or None
+        """
+        key = self.embedding_key(query_hash, model, dimensions)
+        response = self._get("embeddings", key)
+        if response is None and not dimensions:
+            # legacy entries hold full-length embeddings of the model configured at the time
+            legacy = self._read(os.path.join(self.path, f"{query_hash}.json"))
+            if isinstance(legacy, dict) and legacy.get("output"):
+                response = {key: value for key, value in legacy.items() if key != "results"}
+                self._put("embeddings", key, response)
+        if response is not None and response.get("output") is not None:
+            response = {**response, "output": self.file_tools.vector(response["output"])}
+        return response
+
+    def put_embedding(self, query_hash: str, response: dict, model: str, dimensions: int = 0) -> None:
+        self._put("embeddings", self.embedding_key(query_hash, model, dimensions), response)
+
+    def get_results(self, key: str) -> dict or None:
+        return self._get("results", key)
+
+    def put_results(self, key: str, entry: dict) -> None:
+        self._put("results", key, entry)
+
+    def _entry_path(self, kind: str, key: str) -> str:
+        return os.path.join(self.path, kind, f"{key}.json")
+
+    def _get(self, kind: str, key: str) -> dict or None:
+        if (kind, key) not in self._index:
+            return None
+
+        entry = self._memory.get((kind, key))
+        if entry is None:
+            entry = self._read(self._entry_path(kind, key))
+            if not entry:
+                self._drop((kind, key))
+                self._write_index()
+                return None
+            self._remember((kind, key), entry)
+
+        self._index[(kind, key)][1] = time.time()
+        self._index.move_to_end((kind, key))
+        self._memory.move_to_end((kind, key))
+        self._hits += 1
+        if self._hits >= self.index_hits:
+            self._write_index()
+        return entry
+
+    def _put(self, kind: str, key: str, entry: dict) -> None:
+        data = json.dumps(entry, default=self.file_tools.json_default)
+        self.file_tools.write_file(self._entry_path(kind, key), data)
+
+        if (kind, key) in self._index:
+            self._size -= self._index[(kind, key)][0]
+        self._index[(kind, key)] = [len(data), time.time()]
+        self._index.move_to_end((kind, key))
+        self._size += len(data)
+        self._remember((kind, key), entry)
+
+        while len(self._index) > 1 and (len(self._index) > self.max_entries or self._size > self.max_bytes):
+            oldest = next(iter(self._index))
+            self._drop(oldest)
+            try:
+                os.remove(self._entry_path(*oldest))
+            except FileNotFoundError:
+                pass
+
+        self._write_index()
+
+    @staticmethod
+    def _read(path: str) -> dict or list or None:
+        try:
+            with open(path, "r") as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _remember(self, entry_key: tuple, entry: dict) -> None:
+        self._memory[entry_key] = entry
+        self._memory.move_to_end(entry_key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _drop(self, entry_key: tuple) -> None:
+        size, _ = self._index.pop(entry_key)
+        self._memory.pop(entry_key, None)
+        self._size -= size
+
+    def _write_index(self) -> None:
+        self._hits = 0
+        self.file_tools.write_json(self._index_path, {
+            "version": self.version,
+            "entries": [[kind, key, size, used] for (kind, key), (size, used) in self._index.items()]
+        }, indent=None)
@@ -0,0 +1,109 @@
+import numpy as np
+
+
+class MetadataFilter:
+    keys = ["after", "before", "models", "roles", "include", "exclude"]
+
+    def __init__(self) -> None:
+        """
+        Initializes the per-chunk metadata columns used to push search filters down before scoring
+
+        Every chunk address (one chunk may be shared by several messages) gets a row in flat
+        columnar arrays aligned with the aggregator's addresses: message timestamp, model code, role
+        code and conversation code. A filter becomes a boolean mask over these arrays, so only the
+        chunks of the matching messages are scored and ranked.
+
+        :return: None
+        """
+        self.address_rows = np.empty(0, dtype=np.int64)
+        self.address_conversations = np.empty(0, dtype=np.int64)
+        self.created_at = np.empty(0, dtype=np.int64)
+        self.models = np.empty(0, dtype=np.int32)
+        self.roles = np.empty(0, dtype=np.int32)
+        self._model_codes = {}
+        self._role_codes = {}
+        self._conversation_codes = {}
+
+    def __repr__(self):
+        return f"MetadataFilter(addresses={len(self.address_rows)}, models={list(self._model_codes)})"
+
+    @classmethod
+    def parse(cls, text: str) -> dict:
+        """
+        Parses filters typed as space separated key:value pairs, e.g.
+        "after:2024-01-01 before:2024-07-01 model:gpt-4o role:user in:<conversation_id> not:<conversation_id>"
+        Dates bound the message time (after inclusive, before exclusive); list values are comma separated.
+
+        :param text: filters text
+
+        :return: filters dictionary
+        """
+        aliases = {"model": "models", "role": "roles", "in": "include", "not": "exclude"}
+        filters = {}
+        for pair in text.split():
+            key, _, value = pair.partition(":")
+            key = aliases.get(key.lower(), key.lower())
+            if key not in cls.keys or not value:
+                raise ValueError(f"Invalid filter: {pair} - Options: after, before, model, role, in, not")
+            if key in ("after", "before"):
+                np.datetime64(value, "s")
+                filters[key] = value
+            else:
+                filters.setdefault(key, []).extend(value.split(","))
+        return filters
+
+    def build(self, addresses: list, aggregator, messages: dict) -> "MetadataFilter":
+        """
+        Builds the columnar metadata arrays of every chunk address
+
+        :param addresses: one list of [conversation_id, message_index] per chunk row
+        :param aggregator: TopKAggregator built over the same addresses
+        :param messages: (created_at, model, role) of every message by (conversation_id, message_index)
+
+        :return: the filter itself
+        """
+        counts = np.diff(aggregator.offsets)
+        self.address_rows = np.repeat(np.arange(len(counts)), counts)
+        self.address_conversations = aggregator.address_conversations
+        self._conversation_codes = {conversation: code for code, conversation in enumerate(aggregator.conversations)}
+        self._model_codes, self._role_codes = {}, {}
+
+        created_at, models, roles = [], [], []
+        for conversation_id, message_index in (address for row in addresses for address in row):
+            message_created_at, model, role = messages.get((conversation_id, message_index), ("1970-01-01 00:00:00", "", ""))
+            created_at.append(message_created_at)
+            models.append(self._model_codes.setdefault(model, len(self._model_codes)))
+            roles.append(self._role_codes.setdefault(role, len(self._role_codes)))
+
+        self.created_at = np.array(created_at, dtype="datetime64[s]").astype(np.int64)
+        self.models = np.array(models, dtype=np.int32)
+        self.roles = np.array(roles, dtype=np.int32)
+        return self
+
+    def mask(self, filters: dict) -> tuple:
+        """
+        Evaluates the filters over the columnar arrays
+
+        :param filters: dictionary of after / before dates, models, roles, include / exclude conversation ids
+
+        :return: sorted row ids of the chunks with at least one matching address, boolean mask of the matching addresses
+        """
+        mask = np.ones(len(self.address_rows), dtype=bool)
+        if filters.get("after"):
+            mask &= self.created_at >= np.datetime64(filters["after"], "s").astype(np.int64)
+        if filters.get("before"):
+            mask &= self.created_at < np.datetime64(filters["before"], "s").astype(np.int64)
+        if filters.get("models"):
+            mask &= np.isin(self.models, self._codes(self._model_codes, filters["models"]))
+        if filters.get("roles"):
+            mask &= np.isin(self.roles, self._codes(self._role_codes, filters["roles"]))
+        if filters.get("include"):
+            mask &= np.isin(self.address_conversations, self._codes(self._conversation_codes, filters["include"]))
+        if filters.get("exclude"):
+            mask &= ~np.isin(self.address_conversations, self._codes(self._conversation_codes, filters["exclude"]))
+
+        return np.unique(self.address_rows[mask]), mask
+
+    @staticmethod
+    def _codes(codes: dict, values: list) -> np.ndarray:
+        return np.array([codes[value] for value in values if value in codes], dtype=np.int64)
@@ -0,0 +1,211 @@
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+
+class BM25Index:
+    version = 1
+    _token_pattern = re.compile(r"[A-Za-z0-9_]+(?:[.\-/:][A-Za-z0-9_]+)*")
+    _part_pattern = re.compile(r"[.\-/:]")
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75) -> None:
+        """
+        Initializes the BM25 inverted index over the chunk texts
+
+        Postings are kept as term-sorted CSR arrays (term -> chunk ids and term frequencies) and
+        persisted as .npz. Newly added chunks are buffered and merged into the arrays on the next
+        search or save, so incremental updates never re-tokenize the archive. Removing chunks drops
+        their postings and renumbers the remaining chunk ids.
+
+        :param path: path of the persisted index (.npz)
+        :param k1: BM25 term frequency saturation
+        :param b: BM25 document length normalization
+
+        :return: None
+        """
+        self.path = path if path.endswith(".npz") else f"{path}.npz"
+        self.k1 = k1
+        self.b = b
+
+        self.documents = []
+        self._document_ids = {}
+        self._lengths = []
+        self.terms = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._docs = np.empty(0, dtype=np.int32)
+        self._tfs = np.empty(0, dtype=np.float32)
+        self._pending = []
+        self._lengths_array = np.empty(0, dtype=np.float32)
+        self.changed = False
+
+    def __repr__(self):
+        return f"BM25Index(documents={len(self)}, terms={len(self.terms)})"
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __contains__(self, msg_hash: str) -> bool:
+        return msg_hash in self._document_ids
+
+    @classmethod
+    def tokenize(cls, text: str) -> list:
+        """
+        Splits a text into lowercase terms, keeping identifiers such as error codes, versions and
+        package names whole as well as indexing their parts
+
+        :param text: text to tokenize
+
+        :return: list of terms
+        """
+        tokens = []
+        for token in cls._token_pattern.findall(text.lower()):
+            tokens.append(token)
+            if cls._part_pattern.search(token):
+                tokens.extend(part for part in cls._part_pattern.split(token) if part)
+        return tokens
+
+    def load(self) -> bool:
+        """
+        Loads the persisted index
+
+        :return: True if the index was found and loaded, False otherwise
+        """
+        if not os.path.exists(self.path):
+            return False
+
+        try:
+            with np.load(self.path) as data:
+                if int(data["version"]) != self.version:
+                    return False
+                self.documents = data["documents"].tolist()
+                self._lengths = data["lengths"].tolist()
+                self.terms = {term: i for i, term in enumerate(data["terms"].tolist())}
+                self._offsets = data["offsets"]
+                self._docs = data["docs"]
+                self._tfs = data["tfs"]
+        except (OSError, KeyError, ValueError) as e:
+            print(f"- Failed to Load Lexical Index: {e} -")
+            return False
+
+        self._document_ids = {msg_hash: i for i, msg_hash in enumerate(self.documents)}
+        self._lengths_array = np.asarray(self._lengths, dtype=np.float32)
+        self.changed = False
+        return True
+
+    def save(self) -> None:
+        """
+        Persists the index
+
+        :return: None
+        """
+        self._merge()
+        tmp_path = f"{self.path[:-4]}.tmp.npz"
+        np.savez(
+            tmp_path,
+            version=self.version,
+            documents=np.asarray(self.documents, dtype=str),
+            lengths=np.asarray(self._lengths, dtype=np.int32),
+            terms=np.asarray(list(self.terms), dtype=str),
+            offsets=self._offsets,
+            docs=self._docs,
+            tfs=self._tfs)
+        os.replace(tmp_path, self.path)
+        self.changed = False
+
+    def add(self, msg_hash: str, text: str) -> bool:
+        """
+        Adds a chunk to the index unless it is already indexed
+
+        :param msg_hash: hash of the chunk
+        :param text: content of the chunk
+
+        :return: True if the chunk was added, False if it was already indexed
+        """
+        if msg_hash in self._document_ids:
+            return False
+
+        document = len(self.documents)
+        tokens = self.tokenize(text)
+        self.documents.append(msg_hash)
+        self._document_ids[msg_hash] = document
+        self._lengths.append(len(tokens))
+        self._pending.extend((term, document, tf) for term, tf in Counter(tokens).items())
+        self.changed = True
+        return True
+
+    def remove(self, msg_hashes: list) -> int:
+        """
+        Removes chunks from the index
+
+        :param msg_hashes: hashes of the chunks (hashes not indexed are skipped)
+
+        :return: number of removed chunks
+        """
+        removed = [self._document_ids[msg_hash] for msg_hash in msg_hashes if msg_hash in self._document_ids]
+        if not removed:
+            return 0
+
+        self._merge()
+        kept = np.ones(len(self.documents), dtype=bool)
+        kept[removed] = False
+        document_ids = np.cumsum(kept) - 1
+
+        terms = np.repeat(np.arange(len(self._offsets) - 1), np.diff(self._offsets))
+        postings = kept[self._docs]
+        self._docs = document_ids[self._docs[postings]].astype(np.int32)
+        self._tfs = self._tfs[postings]
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(terms[postings], minlength=len(self.terms)))])
+
+        self.documents = [msg_hash for msg_hash, keep in zip(self.documents, kept) if keep]
+        self._lengths = [length for length, keep in zip(self._lengths, kept) if keep]
+        self._document_ids = {msg_hash: i for i, msg_hash in enumerate(self.documents)}
+        self._lengths_array = np.asarray(self._lengths, dtype=np.float32)
+        self.changed = True
+        return len(removed)
+
+    def scores(self, text: str) -> np.ndarray:
+        """
+        Scores every indexed chunk against the query with BM25
+
+        :param text: query text
+
+        :return: BM25 score of each chunk, indexed by chunk id (position in `documents`)
+        """
+        self._merge()
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        if not len(self.documents):
+            return scores
+
+        average = self._lengths_array.mean() or 1
+        for term in set(self.tokenize(text)):
+            term_id = self.terms.get(term)
+            if term_id is None:
+                continue
+
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            docs, tfs = self._docs[start:end], self._tfs[start:end]
+            idf = np.log(1 + (len(self.documents) - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self._lengths_array[docs] / average)
+            scores[docs] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+
+        return scores
+
+    def _merge(self) -> None:
+        if not self._pending:
+            return
+
+        for term, _, _ in self._pending:
+            self.terms.setdefault(term, len(self.terms))
+
+        terms = np.repeat(np.arange(len(self._offsets) - 1), np.diff(self._offsets))
+        terms = np.concatenate([terms, np.fromiter((self.terms[t] for t, _, _ in self._pending), dtype=np.int64)])
+        docs = np.concatenate([self._docs, np.fromiter((d for _, d, _ in self._pending), dtype=np.int32)])
+        tfs = np.concatenate([self._tfs, np.fromiter((f for _, _, f in self._pending), dtype=np.float32)])
+
+        order = np.argsort(terms, kind="stable")
+        self._docs, self._tfs = docs[order], tfs[order]
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(terms, minlength=len(self.terms)))])
+        self._lengths_array = np.asarray(self._lengths, dtype=np.float32)
+        self._pending = []
@@ -0,0 +1,428 @@
+import os
+
+import numpy as np
+
+
+class Quantizer:
+    mode = None
+    version = 1
+    block_size = 65536
+
+    def __init__(self, path: str, candidates: int = 1024, rebuild_growth: float = 2.0, seed: int = 0) -> None:
+        """
+        Initializes the compressed code store used for the fast first pass of a search
+
+        The codes are kept in memory while the float embeddings stay in the memory-mapped store, so
+        a query scans the compact codes and only pages in the float rows of the shortlisted
+        candidates for the exact re-ranking.
+
+        :param path: path of the persisted codes (.npz)
+        :param candidates: number of candidates shortlisted from the codes for exact re-ranking
+        :param rebuild_growth: retrain once the matrix outgrows the trained size by this factor
+        :param seed: random seed used for training and evaluation
+
+        :return: None
+        """
+        self.path = path if path.endswith(".npz") else f"{path}.npz"
+        self.candidates = candidates
+        self.rebuild_growth = rebuild_growth
+        self.seed = seed
+
+        self.codes = None
+        self.trained_count = 0
+        self.dimensions = 0
+        self.stats = {}
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(rows={len(self)}, nbytes={self.nbytes})"
+
+    def __len__(self):
+        return 0 if self.codes is None else len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        return 0 if self.codes is None else self.codes.nbytes + sum(p.nbytes for p in self._params().values())
+
+    def load(self) -> bool:
+        """
+        Loads the persisted codes and training parameters
+
+        :return: True if codes of the same mode were found and loaded, False otherwise
+        """
+        if not os.path.exists(self.path):
+            return False
+
+        try:
+            with np.load(self.path) as data:
+                if int(data["version"]) != self.version or str(data["mode"]) != self.mode:
+                    return False
+                self.codes = data["codes"]
+                self.trained_count = int(data["trained_count"])
+                self.dimensions = int(data["dimensions"])
+                self.stats = {"recall": float(data["recall"]), "k": int(data["k"])}
+                self._set_params({key[6:]: data[key] for key in data.files if key.startswith("param_")})
+        except (OSError, KeyError, ValueError) as e:
+            print(f"- Failed to Load Quantized Codes: {e} -")
+            return False
+
+        return True
+
+    def save(self) -> None:
+        """
+        Persists the codes and training parameters next to the embedding store
+
+        :return: None
+        """
+        tmp_path = f"{self.path[:-4]}.tmp.npz"
+        np.savez(
+            tmp_path,
+            version=self.version,
+            mode=self.mode,
+            codes=self.codes,
+            trained_count=self.trained_count,
+            dimensions=self.dimensions,
+            recall=self.stats.get("recall", float("nan")),
+            k=self.stats.get("k", 0),
+            **{f"param_{key}": value for key, value in self._params().items()})
+        os.replace(tmp_path, self.path)
+
+    def sync(self, matrix: np.ndarray) -> bool:
+        """
+        Brings the codes up to date with the embedding matrix
+
+        Appended rows are encoded with the current parameters; the quantizer is retrained when it
+        no longer matches the matrix or the matrix has outgrown the trained size by `rebuild_growth`.
+
+        :param matrix: pre-normalized embedding matrix
+
+        :return: True if the codes changed, False otherwise
+        """
+        if not len(matrix):
+            return False
+
+        if (self.codes is None
+                or self.dimensions != matrix.shape[1]
+                or len(self) > len(matrix)
+                or len(matrix) > self.trained_count * self.rebuild_growth):
+            self.train(matrix)
+            self.trained_count, self.dimensions = len(matrix), matrix.shape[1]
+            self.codes = self.encode(matrix)
+        elif len(self) < len(matrix):
+            self.codes = np.concatenate([self.codes, self.encode(matrix[len(self):])])
+        else:
+            return False
+
+        self.stats = {"recall": self.evaluate(matrix), "k": 10}
+        return True
+
+    def encode(self, matrix: np.ndarray) -> np.ndarray:
+        """
+        Encodes the rows of a matrix block by block
+
+        :param matrix: pre-normalized embedding matrix
+
+        :return: codes of the rows
+        """
+        return np.concatenate([
+            self._encode(np.asarray(matrix[start:start + self.block_size], dtype=np.float32))
+            for start in range(0, len(matrix), self.block_size)
+        ]) if len(matrix) else self._encode(np.empty((0, self.dimensions), dtype=np.float32))
+
+    def scores(self, query: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Approximates the similarity of the query to the encoded rows (higher is more similar)
+
+        :param query: normalized query embedding
+        :param rows: row ids to score (defaults to every row)
+
+        :return: approximate scores of the rows
+        """
+        codes = self.codes if rows is None else self.codes[rows]
+        prepared = self._prepare(query)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), self.block_size):
+            block = codes[start:start + self.block_size]
+            scores[start:start + len(block)] = self._scores(block, prepared)
+        return scores
+
+    def shortlist(self, query: np.ndarray, rows: np.ndarray = None, size: int = None) -> np.ndarray:
+        """
+        Shortlists the rows with the best approximate scores for exact re-ranking
+
+        :param query: normalized query embedding
+        :param rows: row ids to consider (defaults to every row)
+        :param size: number of rows to shortlist (defaults to the quantizer setting)
+
+        :return: sorted row ids of the shortlisted candidates
+        """
+        scores = self.scores(query, rows)
+        if not len(scores):
+            return np.empty(0, dtype=np.int64) if rows is None else rows
+        size = min(size or self.candidates, len(scores))
+        selected = np.argpartition(-scores, size - 1)[:size] if size < len(scores) else np.arange(len(scores))
+        return np.sort(selected if rows is None else rows[selected])
+
+    def evaluate(self, matrix: np.ndarray, queries: int = 100, k: int = 10) -> float:
+        """
+        Measures recall@k of the shortlist followed by exact re-ranking against an exact scan
+
+        Stored rows are used as queries, so the measurement needs no API calls. Each query row is
+        left out of both its exact neighbours and its re-ranked candidates; otherwise every query
+        would find itself and the recall would be inflated.
+
+        :param matrix: pre-normalized embedding matrix the codes were built from
+        :param queries: number of sampled queries
+        :param k: number of nearest neighbours compared
+
+        :return: mean recall@k
+        """
+        k = min(k, len(matrix) - 1)
+        if k < 1:
+            return 1.0
+        rng = np.random.default_rng(self.seed)
+        sample = np.sort(rng.choice(len(matrix), min(queries, len(matrix)), replace=False))
+        queries = np.asarray(matrix[sample], dtype=np.float32)
+
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(matrix), self.block_size):
+            block = np.asarray(matrix[start:start + self.block_size], dtype=np.float32)
+            scores = queries @ block.T
+            inside = np.flatnonzero((sample >= start) & (sample < start + len(block)))
+            scores[inside, sample[inside] - start] = -np.inf
+            best_scores = np.hstack([best_scores, scores])
+            best_rows = np.hstack([best_rows, np.broadcast_to(np.arange(start, start + len(block)), (len(queries), len(block)))])
+            top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(best_scores, top, axis=1)
+            best_rows = np.take_along_axis(best_rows, top, axis=1)
+
+        recalls = []
+        for row, query, exact in zip(sample, queries, best_rows):
+            candidates = self.shortlist(query)
+            candidates = candidates[candidates != row]
+            reranked = candidates[np.argsort(-(np.asarray(matrix[candidates], dtype=np.float32) @ query))[:k]]
+            recalls.append(len(np.intersect1d(exact, reranked)) / k)
+        return float(np.mean(recalls))
+
+    def train(self, matrix: np.ndarray) -> None:
+        pass
+
+    def _params(self) -> dict:
+        return {}
+
+    def _set_params(self, params: dict) -> None:
+        pass
+
+    def _encode(self, block: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def _prepare(self, query: np.ndarray):
+        return query
+
+    def _scores(self, codes: np.ndarray, prepared) -> np.ndarray:
+        raise NotImplementedError
+
+
+class ScalarQuantizer(Quantizer):
+    mode = "int8"
+
+    def __init__(self, *args, **kwargs) -> None:
+        """
+        Initializes the int8 scalar quantizer (4x smaller than float32)
+
+        Each dimension is scaled symmetrically by its largest absolute value to the [-127, 127] range.
+
+        :return: None
+        """
+        super().__init__(*args, **kwargs)
+        self.scale = None
+
+    def train(self, matrix: np.ndarray) -> None:
+        peak = np.zeros(matrix.shape[1], dtype=np.float32)
+        for start in range(0, len(matrix), self.block_size):
+            block = np.asarray(matrix[start:start + self.block_size], dtype=np.float32)
+            peak = np.maximum(peak, np.abs(block).max(axis=0))
+        peak[peak == 0] = 1
+        self.scale = peak / 127
+
+    def _params(self) -> dict:
+        return {"scale": self.scale}
+
+    def _set_params(self, params: dict) -> None:
+        self.scale = params["scale"]
+
+    def _encode(self, block: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(block / self.scale), -127, 127).astype(np.int8)
+
+    def _prepare(self, query: np.ndarray):
+        return (query * self.scale).astype(np.float32)
+
+    def _scores(self, codes: np.ndarray, prepared) -> np.ndarray:
+        return codes.astype(np.float32) @ prepared
+
+
+class BinaryQuantizer(Quantizer):
+    mode = "binary"
+    _popcount = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def __init__(self, *args, candidates: int = 4096, **kwargs) -> None:
+        """
+        Initializes the 1-bit binary quantizer (32x smaller than float32)
+
+        Each dimension keeps only its sign and rows are prefiltered by Hamming distance to the
+        query's sign bits. Binary codes are coarse, so the shortlist defaults to a wider window.
+
+        :return: None
+        """
+        super().__init__(*args, candidates=candidates, **kwargs)
+
+    def _encode(self, block: np.ndarray) -> np.ndarray:
+        return np.packbits(block > 0, axis=1)
+
+    def _prepare(self, query: np.ndarray):
+        return np.packbits(query > 0)
+
+    def _scores(self, codes: np.ndarray, prepared) -> np.ndarray:
+        distances = self._popcount[np.bitwise_xor(codes, prepared)].sum(axis=1, dtype=np.int32)
+        return -distances.astype(np.float32)
+
+
+class ProductQuantizer(Quantizer):
+    mode = "pq"
+
+    def __init__(self, *args, subspaces: int = 0, iterations: int = 10, sample_size: int = 32768, **kwargs) -> None:
+        """
+        Initializes the product quantizer
+
+        Vectors are split into `subspaces` sub-vectors, each replaced by the id of its closest of 256
+        sub-centroids, so a vector costs one byte per subspace. Queries are scored by asymmetric
+        distance computation: one lookup table of query/sub-centroid products per subspace.
+
+        :param subspaces: number of subspaces (0 picks dimensions / 16, i.e. 64x smaller than float32)
+        :param iterations: k-means iterations per subspace
+        :param sample_size: maximum number of rows used to train the sub-centroids
+
+        :return: None
+        """
+        super().__init__(*args, **kwargs)
+        self.subspaces = subspaces
+        self.iterations = iterations
+        self.sample_size = sample_size
+        self.codebooks = None
+
+    def train(self, matrix: np.ndarray) -> None:
+        dimensions = matrix.shape[1]
+        subspaces = self.subspaces or max(1, dimensions // 16)
+        while dimensions % subspaces:
+            subspaces -= 1
+
+        rng = np.random.default_rng(self.seed)
+        rows = np.sort(rng.choice(len(matrix), min(len(matrix), self.sample_size), replace=False))
+        sample = np.asarray(matrix[rows], dtype=np.float32).reshape(len(rows), subspaces, -1)
+        clusters = min(256, len(rows))
+
+        codebooks = np.empty((subspaces, clusters, dimensions // subspaces), dtype=np.float32)
+        for subspace in range(subspaces):
+            vectors = sample[:, subspace]
+            centroids = vectors[rng.choice(len(vectors), clusters, replace=False)]
+            for _ in range(self.iterations):
+                labels = self._closest(vectors, centroids)
+                order = np.argsort(labels, kind="stable")
+                assigned, starts = np.unique(labels[order], return_index=True)
+                counts = np.diff(np.append(starts, len(labels)))[:, None]
+                centroids = vectors[rng.choice(len(vectors), clusters)]
+                centroids[assigned] = np.add.reduceat(vectors[order], starts, axis=0) / counts
+            codebooks[subspace] = centroids
+        self.codebooks = codebooks
+
+    def _params(self) -> dict:
+        return {"codebooks": self.codebooks}
+
+    def _set_params(self, params: dict) -> None:
+        self.codebooks = params["codebooks"]
+
+    def _encode(self, block: np.ndarray) -> np.ndarray:
+        subspaces = len(self.codebooks)
+        block = block.reshape(len(block), subspaces, -1)
+        codes = np.empty((len(block), subspaces), dtype=np.uint8)
+        for subspace in range(subspaces):
+            codes[:, subspace] = self._closest(block[:, subspace], self.codebooks[subspace])
+        return codes
+
+    def _prepare(self, query: np.ndarray):
+        return np.einsum("sd,scd->sc", query.reshape(len(self.codebooks), -1), self.codebooks)
+
+    def _scores(self, codes: np.ndarray, prepared) -> np.ndarray:
+        return prepared[np.arange(len(self.codebooks)), codes].sum(axis=1)
+
+    @staticmethod
+    def _closest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (centroids ** 2).sum(axis=1) - 2 * vectors @ centroids.T
+        return np.argmin(distances, axis=1)
+
+
+class MatryoshkaQuantizer(Quantizer):
+    mode = "matryoshka"
+
+    def __init__(self, *args, coarse_dimensions: int = 256, **kwargs) -> None:
+        """
+        Initializes the truncated-dimension quantizer for text-embedding-3 (Matryoshka) embeddings
+
+        These models front-load information into the leading dimensions, so the first
+        `coarse_dimensions` of each row, re-normalized, are a usable embedding on their own. The
+        shortlist is ranked by cosine over that compact float16 matrix (24x smaller than 3072
+        float32 dimensions at 256) and re-scored at full dimension.
+
+        :param coarse_dimensions: number of leading dimensions kept in the codes
+
+        :return: None
+        """
+        super().__init__(*args, **kwargs)
+        self.coarse_dimensions = coarse_dimensions
+
+    def load(self) -> bool:
+        if not super().load():
+            return False
+        if self.codes.shape[1] != min(self.coarse_dimensions, self.dimensions):
+            self.codes = None
+            return False
+        return True
+
+    def _encode(self, block: np.ndarray) -> np.ndarray:
+        return self._truncate(block).astype(np.float16)
+
+    def _prepare(self, query: np.ndarray):
+        return self._truncate(query)
+
+    def _scores(self, codes: np.ndarray, prepared) -> np.ndarray:
+        return codes.astype(np.float32) @ prepared
+
+    def _truncate(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = vectors[..., :self.coarse_dimensions]
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+
+quantizers = {
+    quantizer.mode: quantizer
+    for quantizer in (ScalarQuantizer, BinaryQuantizer, ProductQuantizer, MatryoshkaQuantizer)
+}
+
+
+if __name__ == "__main__":
+    from tabulate import tabulate
+
+    from helpers.ledger import Ledger
+    from search.store import EmbeddingStore
+
+    store = EmbeddingStore(Ledger().paths["files"]["vector_store"])
+    if not store.open():
+        raise FileNotFoundError(f"- Vector Store Not Found - Path: {store.sidecar_path}")
+
+    table = [["float", f"{store.matrix.dtype.name}", round(store.matrix.nbytes / 2 ** 20, 2), 1.0]]
+    for mode, quantizer in quantizers.items():
+        quantizer = quantizer(os.devnull)
+        quantizer.sync(store.matrix)
+        table.append([mode, quantizer.codes.dtype.name, round(quantizer.nbytes / 2 ** 20, 2), quantizer.stats["recall"]])
+    print(tabulate(table, headers=["MODE", "CODES", "MEMORY (MB)", "RECALL@10"], tablefmt="grid"))
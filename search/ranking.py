@@ -0,0 +1,158 @@
+import numpy as np
+
+
+class TopKAggregator:
+    reducers = ["max", "mean", "sum"]
+
+    def __init__(self, reducer: str = "max", top_n: int = 3, window: int = 4) -> None:
+        """
+        Initializes the top-k selection and per-conversation aggregation stage
+
+        Chunk scores are never fully sorted: a window of the best chunks is pulled with
+        argpartition, their scores are grouped into per-conversation scores and the window only
+        grows (doubling) until the ranking is settled. With the "max" reducer that is once the window
+        holds `limit` distinct conversations. With "mean" the conversations seen in the window are
+        aggregated over all of their scored chunks, and the window grows until the `limit`-th of them
+        beats the best chunk of any conversation outside the window. "sum" aggregates every chunk.
+        Every reducer ranks exactly as a full sort would.
+
+        :param reducer: "max" (best chunk), "mean" (mean of the best `top_n` chunks) or "sum" (sum of chunks)
+        :param top_n: number of best chunks averaged by the "mean" reducer
+        :param window: initial window size as a multiple of the requested limit
+
+        :return: None
+        """
+        if reducer not in self.reducers:
+            raise ValueError(f"Invalid reducer: {reducer} - Options: {self.reducers}")
+
+        self.reducer = reducer
+        self.top_n = top_n
+        self.window = window
+
+        self.conversations = np.empty(0, dtype=object)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.address_conversations = np.empty(0, dtype=np.int64)
+        self.address_rows = np.empty(0, dtype=np.int64)
+        self.conversation_offsets = np.zeros(1, dtype=np.int64)
+        self.conversation_addresses = np.empty(0, dtype=np.int64)
+
+    def __repr__(self):
+        return f"TopKAggregator(reducer={self.reducer}, conversations={len(self.conversations)})"
+
+    def build(self, addresses: list) -> "TopKAggregator":
+        """
+        Flattens the chunk addresses into CSR arrays of integer conversation codes
+
+        The addresses are indexed both ways: by chunk row (to group chunk scores into conversations)
+        and by conversation (to gather every chunk of a conversation).
+
+        :param addresses: one list of [conversation_id, message_index] per chunk row
+
+        :return: the aggregator itself
+        """
+        counts = np.fromiter((len(row) for row in addresses), dtype=np.int64, count=len(addresses))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        codes = {}
+        self.address_conversations = np.fromiter(
+            (codes.setdefault(address[0], len(codes)) for row in addresses for address in row),
+            dtype=np.int64, count=int(self.offsets[-1]))
+        self.conversations = np.empty(len(codes), dtype=object)
+        self.conversations[:] = list(codes)
+
+        self.address_rows = np.repeat(np.arange(len(addresses), dtype=np.int64), counts)
+        self.conversation_offsets = np.concatenate([[0], np.cumsum(np.bincount(self.address_conversations, minlength=len(codes)))])
+        self.conversation_addresses = np.argsort(self.address_conversations, kind="stable")
+        return self
+
+    def rank(self, scores: np.ndarray, limit: int, rows: np.ndarray = None, address_mask: np.ndarray = None) -> list:
+        """
+        Ranks the conversations of the best scoring chunks
+
+        :param scores: chunk scores
+        :param limit: number of distinct conversations to return
+        :param rows: row ids of the scored chunks (defaults to scores[i] belonging to row i)
+        :param address_mask: boolean mask of the addresses allowed to contribute (e.g. from search filters)
+
+        :return: conversation ids ordered by their aggregated score
+        """
+        if not len(scores) or limit <= 0:
+            return []
+
+        # a sum is unbounded by its best chunks, so it is aggregated over every chunk in one pass
+        size = len(scores) if self.reducer == "sum" else min(len(scores), limit * self.window)
+        while True:
+            if size < len(scores):
+                window = np.argpartition(-scores, size - 1)[:size]
+            else:
+                window = np.arange(len(scores))
+
+            conversations, aggregated = self._aggregate(
+                scores[window], window if rows is None else rows[window], address_mask)
+            if size >= len(scores):
+                break
+            if self.reducer != "max" and len(conversations):
+                conversations, aggregated = self._complete(conversations, scores, rows, address_mask)
+            # the mean of a conversation outside the window is at most the lowest score in the window
+            if len(conversations) >= limit and (
+                    self.reducer == "max" or -np.partition(-aggregated, limit - 1)[limit - 1] >= scores[window].min()):
+                break
+            size = min(len(scores), size * 2)
+
+        best = np.argsort(-aggregated, kind="stable")[:limit]
+        return self.conversations[conversations[best]].tolist()
+
+    def _complete(self, conversations: np.ndarray, scores: np.ndarray, rows: np.ndarray = None,
+                  address_mask: np.ndarray = None) -> tuple:
+        # aggregates the conversations over all of their scored chunks, not only those in the window
+        full = np.zeros(len(self.offsets) - 1, dtype=scores.dtype)
+        scored = np.zeros(len(self.offsets) - 1, dtype=bool)
+        rows = slice(len(scores)) if rows is None else rows
+        full[rows], scored[rows] = scores, True
+
+        starts = self.conversation_offsets[conversations]
+        addresses = self.conversation_addresses[self._ranges(starts, self.conversation_offsets[conversations + 1] - starts)]
+        kept = scored[self.address_rows[addresses]]
+        if address_mask is not None:
+            kept &= address_mask[addresses]
+        addresses = addresses[kept]
+        rows = self.address_rows[addresses]
+        return self._reduce(self.address_conversations[addresses], rows, full[rows])
+
+    @staticmethod
+    def _ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+        # concatenation of the ranges [start, start + count)
+        return np.repeat(starts, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+
+    def _aggregate(self, scores: np.ndarray, rows: np.ndarray, address_mask: np.ndarray = None) -> tuple:
+        starts = self.offsets[rows]
+        counts = self.offsets[rows + 1] - starts
+        addresses = self._ranges(starts, counts)
+        conversations, rows, scores = self.address_conversations[addresses], np.repeat(rows, counts), np.repeat(scores, counts)
+        if address_mask is not None:
+            allowed = address_mask[addresses]
+            conversations, rows, scores = conversations[allowed], rows[allowed], scores[allowed]
+        return self._reduce(conversations, rows, scores)
+
+    def _reduce(self, conversations: np.ndarray, rows: np.ndarray, scores: np.ndarray) -> tuple:
+        if not len(conversations):
+            return conversations, scores
+
+        # a chunk repeated inside one conversation contributes once to that conversation
+        pairs = np.unique(conversations * (len(self.offsets) - 1) + rows, return_index=True)[1]
+        conversations, scores = conversations[pairs], scores[pairs]
+
+        order = np.lexsort((-scores, conversations))
+        conversations, scores = conversations[order], scores[order]
+        unique, starts = np.unique(conversations, return_index=True)
+
+        if self.reducer == "max":
+            aggregated = scores[starts]
+        elif self.reducer == "sum":
+            aggregated = np.add.reduceat(scores, starts)
+        else:
+            ranks = np.arange(len(scores)) - np.repeat(starts, np.diff(np.append(starts, len(scores))))
+            kept = ranks < self.top_n
+            aggregated = np.add.reduceat(np.where(kept, scores, 0), starts) / np.add.reduceat(kept, starts)
+
+        return unique, aggregated
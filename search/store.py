@@ -0,0 +1,434 @@
+import glob
+import json
+import os
+import uuid
+
+import numpy as np
+
+from helpers.files import FileTools
+
+
+class SegmentedMatrix:
+    def __init__(self, segments: list, dtype: np.dtype, dimensions: int) -> None:
+        """
+        Initializes a read-only view of the segment matrices as one matrix
+
+        Rows are numbered across the segments in order. Products with a vector or matrix fan out to
+        every segment and their results are concatenated, and row selections gather the rows from
+        the segments holding them, so the search stages can address the store as a single matrix.
+
+        :param segments: memory-mapped matrices of the segments, in row order
+        :param dtype: floating point type of the segments
+        :param dimensions: number of columns of the segments
+
+        :return: None
+        """
+        self.segments = segments
+        self.dtype = np.dtype(dtype)
+        self.offsets = np.cumsum([0] + [len(segment) for segment in segments])
+        self.shape = (int(self.offsets[-1]), dimensions if segments else 0)
+
+    def __repr__(self):
+        return f"SegmentedMatrix(shape={self.shape}, segments={len(self.segments)})"
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        for segment in self.segments:
+            yield from segment
+
+    def __array__(self, dtype=None, copy=None):
+        matrix = self[:]
+        return matrix if dtype is None else matrix.astype(dtype)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(segment.nbytes for segment in self.segments)
+
+    def __matmul__(self, other: np.ndarray) -> np.ndarray:
+        other = np.asarray(other)
+        if not self.segments:
+            return np.empty((0,) + other.shape[1:], dtype=np.result_type(self.dtype, other.dtype))
+        return np.concatenate([segment @ other for segment in self.segments])
+
+    def __getitem__(self, key) -> np.ndarray:
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self[np.arange(start, stop, step)]
+            parts = []
+            for offset, segment in zip(self.offsets, self.segments):
+                low, high = max(start - offset, 0), min(stop - offset, len(segment))
+                if low < high:
+                    parts.append(segment[low:high])
+            if len(parts) == 1:
+                return parts[0]
+            return np.concatenate(parts) if parts else np.empty((0, self.shape[1]), dtype=self.dtype)
+
+        rows = np.asarray(key)
+        if rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        if rows.ndim == 0:
+            segment = int(np.searchsorted(self.offsets, rows, side="right")) - 1
+            return self.segments[segment][rows - self.offsets[segment]]
+
+        matrix = np.empty((len(rows), self.shape[1]), dtype=self.dtype)
+        segment_ids = np.searchsorted(self.offsets, rows, side="right") - 1
+        for segment in np.unique(segment_ids):
+            selected = segment_ids == segment
+            matrix[selected] = self.segments[segment][rows[selected] - self.offsets[segment]]
+        return matrix
+
+
+class EmbeddingStore:
+    version = 2
+
+    def __init__(
+            self,
+            path: str,
+            dtype: str = "float32",
+            dimensions: int = 0,
+            max_segments: int = 8,
+            max_tombstones: float = 0.1
+    ) -> None:
+        """
+        Initializes the on-disk, append-only embedding store
+
+        The store is log-structured: new embeddings are appended as a new immutable segment (a
+        fixed-width matrix file <path>-<n>.bin of pre-normalized embeddings and a <path>-<n>.json
+        file of its chunk hashes), and a small manifest (<path>.json) lists the segments, the
+        version header and the tombstoned rows. An update therefore writes the new rows and the
+        manifest only. Rows are numbered across the segments and stay stable until a compaction:
+        small trailing segments are merged once there are more than `max_segments` (`merge`), and
+        deleted rows are only tombstoned until they exceed `max_tombstones` of the rows, when the
+        segments are rewritten without them (`compact`). Segments are opened with numpy.memmap, so
+        pages are loaded lazily by the OS and shared between every process searching the same store.
+
+        :param path: path of the store without extension
+        :param dtype: floating point type used when writing the embeddings (float32 or float16)
+        :param dimensions: leading dimensions kept from each embedding (0 keeps the shortest embedding whole);
+            text-embedding-3 embeddings shortened this way remain valid embeddings once re-normalized
+        :param max_segments: number of segments above which the trailing segments are merged
+        :param max_tombstones: fraction of tombstoned rows above which the store is compacted
+
+        :return: None
+        """
+        if np.dtype(dtype) not in (np.float32, np.float16):
+            raise ValueError(f"Invalid Embedding Store dtype: {dtype}")
+
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.dimensions = dimensions
+        self.max_segments = max_segments
+        self.max_tombstones = max_tombstones
+        self.matrix_path = f"{path}.bin"
+        self.sidecar_path = f"{path}.json"
+
+        self.header = {}
+        self.segments = []
+        self.matrix = SegmentedMatrix([], self.dtype, 0)
+        self.hashes = []
+        self.tombstones = set()
+        self._rows = {}
+
+    def __repr__(self):
+        return f"EmbeddingStore(path={self.path}, rows={len(self)}, segments={len(self.segments)}, tombstones={len(self.tombstones)})"
+
+    def __len__(self):
+        return len(self.matrix)
+
+    @property
+    def needs_merge(self) -> bool:
+        return len(self.segments) > max(self.max_segments, 1)
+
+    @property
+    def needs_compaction(self) -> bool:
+        return bool(self.tombstones) and len(self.tombstones) > self.max_tombstones * len(self)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.sidecar_path)
+
+    def open(self) -> bool:
+        """
+        Opens the segments of the store as read-only memory maps
+
+        :return: True if a valid store was opened, False otherwise
+        """
+        if not self.exists():
+            return False
+
+        try:
+            with open(self.sidecar_path, "r") as file:
+                header = json.load(file)
+        except json.JSONDecodeError:
+            print(f"- Corrupted Embedding Store Manifest: {self.sidecar_path} -")
+            return False
+
+        if header.get("version") == 1 and os.path.exists(self.matrix_path):
+            header = self._upgrade(header)
+        if header.get("version") != self.version:
+            print(f"- Unsupported Embedding Store Version: {header.get('version')} -")
+            return False
+
+        dtype = np.dtype(header["dtype"])
+        segments, hashes = [], []
+        for segment in header["segments"]:
+            matrix_path, hashes_path = self._segment_paths(segment["id"])
+            shape = (segment["count"], header["dimensions"])
+            if not os.path.exists(matrix_path) or os.path.getsize(matrix_path) < shape[0] * shape[1] * dtype.itemsize:
+                print(f"- Embedding Store Size Mismatch: {matrix_path} -")
+                return False
+            with open(hashes_path, "r") as file:
+                hashes.extend(json.load(file))
+            segments.append(np.memmap(matrix_path, dtype=dtype, mode="r", shape=shape))
+
+        self.segments = header.pop("segments")
+        self.tombstones = set(header.pop("tombstones"))
+        self.header = header
+        self.hashes = hashes
+        self.matrix = SegmentedMatrix(segments, dtype, header["dimensions"])
+        self._rows = {msg_hash: row for row, msg_hash in enumerate(hashes) if row not in self.tombstones}
+
+        return True
+
+    def row(self, msg_hash: str) -> int or None:
+        """
+        Looks up the row id of a chunk hash
+
+        :param msg_hash: hash of the chunk
+
+        :return: row id or None if the chunk is not in the store (or was deleted)
+        """
+        return self._rows.get(msg_hash)
+
+    def write(self, records: list, tombstones: set = None, **header) -> None:
+        """
+        Writes the store as a single segment, replacing any previous content atomically
+
+        :param records: list of (hash, embedding) tuples, in row order
+        :param tombstones: row ids of the records to keep as deleted
+        :param header: additional header fields to store in the manifest (e.g. the embedding model)
+
+        :return: None
+        """
+        records = self._decode(records)
+        dimensions = self._dimensions(records)
+        segments = [self._write_segment(records, dimensions)] if records else []
+
+        self._write_manifest(segments, tombstones or set(), self.dtype, dimensions, header)
+        self._remove_segments(keep=segments)
+        self.open()
+
+    def update(self, records: list, **header) -> range:
+        """
+        Appends the records that are not in the store yet as a new segment
+
+        Existing rows keep their position, so indexes built over the row ids only need to learn
+        about the appended rows. The store is rewritten instead (existing rows first, in their
+        order) when it is empty or its dtype or dimensionality no longer matches.
+
+        :param records: list of (hash, embedding) tuples
+        :param header: additional header fields to store in the manifest
+
+        :return: row ids of the appended records
+        """
+        new_records, seen = [], set()
+        for msg_hash, embedding in records:
+            if msg_hash not in self._rows and msg_hash not in seen and embedding is not None:
+                new_records.append((msg_hash, embedding))
+                seen.add(msg_hash)
+        start = len(self)
+        if not new_records:
+            return range(start, start)
+
+        new_records = self._decode(new_records)
+        dimensions = self.matrix.shape[1]
+        if not start or self.matrix.dtype != self.dtype or self._dimensions(new_records) != dimensions:
+            self.write(list(zip(self.hashes, self.matrix)) + new_records, self.tombstones, **{**self.header, **header})
+            return range(start, len(self))
+
+        segment = self._write_segment(new_records, dimensions)
+        self._write_manifest(self.segments + [segment], self.tombstones, self.dtype, dimensions, {**self.header, **header})
+        self.open()
+
+        return range(start, len(self))
+
+    def delete(self, msg_hashes: list) -> int:
+        """
+        Tombstones the rows of chunks; they are dropped by the next compaction
+
+        :param msg_hashes: hashes of the chunks to delete
+
+        :return: number of deleted rows
+        """
+        rows = {self._rows.pop(msg_hash) for msg_hash in msg_hashes if msg_hash in self._rows}
+        if rows:
+            self.tombstones |= rows
+            self._write_manifest(self.segments, self.tombstones, self.matrix.dtype, self.matrix.shape[1], self.header)
+        return len(rows)
+
+    def merge(self) -> bool:
+        """
+        Merges the trailing segments into one, keeping every row id
+
+        Segments are merged from the end while they hold at least as many rows as the segment before
+        them, so segment sizes shrink geometrically towards the end and every row is rewritten a
+        logarithmic number of times as the store grows.
+
+        :return: True if segments were merged, False otherwise
+        """
+        if len(self.segments) < 2:
+            return False
+
+        counts = [segment["count"] for segment in self.segments]
+        start = len(counts) - 2
+        while start > 0 and sum(counts[start:]) >= counts[start - 1]:
+            start -= 1
+
+        offset = sum(counts[:start])
+        records = list(zip(self.hashes[offset:], self.matrix[offset:]))
+        segments = self.segments[:start] + [self._write_segment(records, self.matrix.shape[1])]
+        del records
+        self._write_manifest(segments, self.tombstones, self.matrix.dtype, self.matrix.shape[1], self.header)
+        self._remove_segments(keep=segments)
+        self.open()
+        return True
+
+    def compact(self) -> bool:
+        """
+        Rewrites the store as a single segment without the tombstoned rows (row ids change)
+
+        :return: True if the store was rewritten, False otherwise
+        """
+        if not self.tombstones and len(self.segments) < 2:
+            return False
+
+        header = {key: value for key, value in self.header.items() if key not in ("revision", "dtype", "dimensions")}
+        header["generation"] = header.get("generation", 0) + 1
+        self.write([
+            (msg_hash, embedding)
+            for row, (msg_hash, embedding) in enumerate(zip(self.hashes, self.matrix))
+            if row not in self.tombstones
+        ], **header)
+        return True
+
+    def truncate(self) -> bool:
+        """
+        Shortens the stored embeddings to the configured leading dimensions, keeping every row id
+
+        :return: True if the store was rewritten, False otherwise
+        """
+        if not self.dimensions or not len(self) or self.matrix.shape[1] <= self.dimensions:
+            return False
+
+        header = {key: value for key, value in self.header.items() if key not in ("revision", "dtype", "dimensions")}
+        self.write(list(zip(self.hashes, self.matrix)), self.tombstones, **header)
+        return True
+
+    def _dimensions(self, records: list) -> int:
+        if not records:
+            return 0
+        shortest = min(len(embedding) for _, embedding in records)
+        return min(self.dimensions, shortest) if self.dimensions else shortest
+
+    @staticmethod
+    def _decode(records: list) -> list:
+        # embeddings arrive as arrays, base64 strings (JSON caches) or legacy float lists
+        return [(msg_hash, FileTools.vector(embedding)) for msg_hash, embedding in records]
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray, dimensions: int) -> np.ndarray:
+        vector = np.asarray(embedding[:dimensions], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _segment_paths(self, segment_id: int) -> tuple:
+        return f"{self.path}-{segment_id:06d}.bin", f"{self.path}-{segment_id:06d}.json"
+
+    def _write_segment(self, records: list, dimensions: int) -> dict:
+        # segment ids only grow, so a segment file is never overwritten while it may be mapped
+        segment_id = max([segment["id"] for segment in self.segments] + [self.header.get("last_segment", 0)]) + 1
+        self.header["last_segment"] = segment_id
+        matrix_path, hashes_path = self._segment_paths(segment_id)
+
+        matrix = np.memmap(f"{matrix_path}.tmp", dtype=self.dtype, mode="w+", shape=(len(records), dimensions))
+        for row, (_, embedding) in enumerate(records):
+            matrix[row] = self._normalize(embedding, dimensions)
+        matrix.flush()
+        del matrix
+        os.replace(f"{matrix_path}.tmp", matrix_path)
+
+        with open(f"{hashes_path}.tmp", "w") as file:
+            json.dump([msg_hash for msg_hash, _ in records], file)
+        os.replace(f"{hashes_path}.tmp", hashes_path)
+
+        return {"id": segment_id, "count": len(records)}
+
+    def _write_manifest(self, segments: list, tombstones: set, dtype: np.dtype, dimensions: int, header: dict) -> None:
+        header = {
+            **header,
+            "version": self.version,
+            "revision": uuid.uuid4().hex,
+            "last_segment": max([segment["id"] for segment in segments] + [self.header.get("last_segment", 0)]),
+            "dtype": np.dtype(dtype).name,
+            "count": sum(segment["count"] for segment in segments),
+            "dimensions": dimensions,
+            "segments": segments,
+            "tombstones": sorted(tombstones),
+        }
+        manifest_tmp = f"{self.sidecar_path}.tmp"
+        with open(manifest_tmp, "w") as file:
+            json.dump(header, file)
+        os.replace(manifest_tmp, self.sidecar_path)
+
+    def _remove_segments(self, keep: list) -> None:
+        # the replaced segments are unmapped first; a file still mapped by another process is left behind
+        self.segments, self.matrix = [], SegmentedMatrix([], self.dtype, 0)
+        kept = {path for segment in keep for path in self._segment_paths(segment["id"])}
+        for path in glob.glob(f"{glob.escape(self.path)}-[0-9]*.*"):
+            if path not in kept and not path.endswith(".tmp"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _upgrade(self, header: dict) -> dict:
+        # the single matrix of a version 1 store becomes the first segment; the chunk addresses it
+        # held are kept by the metadata store
+        dimensions, count = header["dimensions"], header["count"]
+        if count:
+            matrix_path, hashes_path = self._segment_paths(1)
+            with open(hashes_path, "w") as file:
+                json.dump(header["hashes"], file)
+            os.replace(self.matrix_path, matrix_path)
+        elif os.path.exists(self.matrix_path):
+            os.remove(self.matrix_path)
+
+        header = {key: value for key, value in header.items() if key not in ("hashes", "addresses")}
+        segments = [{"id": 1, "count": count}] if count else []
+        self._write_manifest(segments, set(), np.dtype(header["dtype"]), dimensions, header)
+        print(f"- Upgraded Embedding Store to Version {self.version}: {self.sidecar_path} -")
+        with open(self.sidecar_path, "r") as file:
+            return json.load(file)
+
+    def migrate_pickle(self, path: str, **header) -> bool:
+        """
+        One-shot migration of the legacy vector_data.pkl DataFrame into the store
+
+        :param path: path to the pickled DataFrame
+        :param header: additional header fields to store in the manifest
+
+        :return: True if the pickle was found and migrated, False otherwise
+        """
+        df = FileTools.read_df(path, dtype="pkl")
+        if df is None or "embedding" not in df:
+            return False
+
+        self.write([
+            (row["hash"], row["embedding"])
+            for row in df.to_dict("records")
+            if isinstance(row["embedding"], list) and row["embedding"]
+        ], **header)
+
+        return True
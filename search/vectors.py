@@ -0,0 +1,295 @@
+import numpy as np
+
+from search.ranking import TopKAggregator
+
+
+class VectorEngine:
+    block_size = 65536
+    batch_cells = 2 ** 26
+
+    def __init__(
+            self,
+            dtype: str = "float32",
+            ann=None,
+            quantizer=None,
+            aggregator: TopKAggregator = None,
+            lexical=None,
+            metadata=None,
+            fusion_depth: int = 200,
+            fusion_k: int = 60
+    ) -> None:
+        """
+        Initializes the in-memory vector search engine
+
+        :param dtype: floating point type of the embedding matrix
+        :param ann: optional approximate nearest-neighbour index over the matrix rows (e.g. IVFIndex)
+        :param quantizer: optional compressed codes used to shortlist rows before exact re-ranking
+        :param aggregator: top-k stage grouping chunk scores into conversation scores
+        :param lexical: optional BM25Index over the chunk texts for hybrid and lexical-only search
+        :param metadata: optional MetadataFilter over the chunk addresses for filtered searches
+        :param fusion_depth: number of best chunks of each ranking merged by reciprocal rank fusion
+        :param fusion_k: reciprocal rank fusion constant (higher flattens the rank contributions)
+
+        :return: None
+        """
+        self.dtype = np.dtype(dtype)
+        self.ann = ann
+        self.quantizer = quantizer
+        self.aggregator = aggregator or TopKAggregator()
+        self.lexical = lexical
+        self.metadata = metadata
+        self.fusion_depth = fusion_depth
+        self.fusion_k = fusion_k
+        self.matrix = np.empty((0, 0), dtype=self.dtype)
+        self.hashes = np.empty(0, dtype=object)
+        self.addresses = []
+        self._lexical_rows = np.empty(0, dtype=np.int64)
+
+    def __repr__(self):
+        return f"VectorEngine(rows={len(self)}, dimensions={self.dimensions})"
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @property
+    def dimensions(self) -> int:
+        return self.matrix.shape[1]
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        """
+        L2-normalizes a vector or the rows of a matrix so dot products equal cosine similarities
+
+        :param vectors: 1-D vector or 2-D matrix
+
+        :return: normalized copy of the vectors
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def build(self, hashes: list, addresses: list, embeddings: list) -> "VectorEngine":
+        """
+        Builds the contiguous embedding matrix and its parallel hash / address arrays
+
+        :param hashes: chunk hashes
+        :param addresses: chunk addresses, one list of [conversation_id, message_index] per chunk
+        :param embeddings: chunk embeddings, one vector per chunk
+
+        :return: the engine itself
+        """
+        if not len(hashes):
+            self.matrix = np.empty((0, 0), dtype=self.dtype)
+            self.hashes = np.empty(0, dtype=object)
+            self.addresses = []
+            self.aggregator.build(self.addresses)
+            self._lexical_rows = np.empty(0, dtype=np.int64)
+            return self
+
+        self.matrix = np.ascontiguousarray(self.normalize(np.vstack(embeddings)), dtype=self.dtype)
+        self.hashes = np.asarray(hashes, dtype=object)
+        self.addresses = list(addresses)
+        self.aggregator.build(self.addresses)
+        self._lexical_rows = np.empty(0, dtype=np.int64)
+        return self
+
+    def build_from_store(self, store, addresses: dict) -> "VectorEngine":
+        """
+        Builds the engine on top of an opened embedding store without copying its memory-mapped segments
+
+        Scoring fans out to every segment of the store and the per-segment scores are merged by the
+        aggregator. Tombstoned rows get no address, so they never reach the results. Chunks without
+        an embedding yet (e.g. still queued or failed) get rows after the matrix rows: they are only
+        ranked by the lexical search.
+
+        :param store: opened EmbeddingStore holding pre-normalized embeddings
+        :param addresses: chunk addresses by hash, one list of [conversation_id, message_index] per chunk
+
+        :return: the engine itself
+        """
+        self.dtype = store.matrix.dtype
+        self.matrix = store.matrix
+        self.addresses = [
+            [] if row in store.tombstones else addresses.get(msg_hash, [])
+            for row, msg_hash in enumerate(store.hashes)
+        ]
+        unembedded = [msg_hash for msg_hash in addresses if store.row(msg_hash) is None]
+        self.hashes = np.asarray(list(store.hashes) + unembedded, dtype=object)
+        self.addresses += [addresses[msg_hash] for msg_hash in unembedded]
+        self.aggregator.build(self.addresses)
+        self._lexical_rows = np.empty(0, dtype=np.int64)
+        return self
+
+    def scores(self, query: list or np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Scores the chunks against the query with a single matrix-vector product
+
+        :param query: query embedding
+        :param rows: row ids of the chunks to score (defaults to every chunk)
+
+        :return: cosine similarity of each scored chunk to the query
+        """
+        query = self.normalize(query)
+        if rows is not None:
+            return np.asarray(self.matrix[rows], dtype=np.float32) @ query
+        if self.dtype == np.float32:
+            return self.matrix @ query
+
+        scores = np.empty(len(self), dtype=np.float32)
+        for start in range(0, len(self), self.block_size):
+            block = self.matrix[start:start + self.block_size]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+        return scores
+
+    def search(self, query: list or np.ndarray, limit: int, filters: dict = None) -> list:
+        """
+        Finds the conversations holding the chunks most similar to the query
+
+        :param query: query embedding
+        :param limit: number of distinct conversations to return
+        :param filters: metadata filters applied before scoring (see MetadataFilter.mask)
+
+        :return: conversation ids ordered by their aggregated chunk scores
+        """
+        if not len(self):
+            return []
+
+        query = self._queries(query)
+        allowed, address_mask = self._filter(filters, embedded=True)
+        rows = self._candidates(query, allowed)
+        if rows is not None and rows is not allowed:
+            results = self.aggregator.rank(self.scores(query, rows), limit, rows, address_mask)
+            if len(results) >= limit:
+                return results
+
+        return self.aggregator.rank(self.scores(query, allowed), limit, allowed, address_mask)
+
+    def search_lexical(self, text: str, limit: int, filters: dict = None) -> list:
+        """
+        Finds the conversations holding the chunks best matching the query terms, without embeddings
+
+        :param text: query text
+        :param limit: number of distinct conversations to return
+        :param filters: metadata filters applied before ranking (see MetadataFilter.mask)
+
+        :return: conversation ids ordered by their aggregated BM25 scores
+        """
+        if self.lexical is None or not len(self.hashes):
+            return []
+
+        allowed, address_mask = self._filter(filters)
+        rows, scores = self._lexical_scores(text, allowed)
+        return self.aggregator.rank(scores, limit, rows, address_mask)
+
+    def search_hybrid(self, query: list or np.ndarray, text: str, limit: int, filters: dict = None) -> list:
+        """
+        Finds conversations by fusing the vector and BM25 chunk rankings with reciprocal rank fusion
+
+        :param query: query embedding
+        :param text: query text
+        :param limit: number of distinct conversations to return
+        :param filters: metadata filters applied before scoring (see MetadataFilter.mask)
+
+        :return: conversation ids ordered by their aggregated fused scores
+        """
+        if self.lexical is None:
+            return self.search(query, limit, filters)
+        if not len(self):
+            return self.search_lexical(text, limit, filters)
+
+        query = self._queries(query)
+        allowed, address_mask = self._filter(filters)
+        embedded = allowed if allowed is None else allowed[allowed < len(self)]
+        rows = self._candidates(query, embedded)
+        vector_rows = np.arange(len(self)) if rows is None else rows
+        vector_rows = self._top(vector_rows, self.scores(query, rows))
+        lexical_rows = self._top(*self._lexical_scores(text, allowed))
+
+        fused_rows = np.union1d(vector_rows, lexical_rows)
+        fused = np.zeros(len(fused_rows), dtype=np.float32)
+        for ranked in (vector_rows, lexical_rows):
+            fused[np.searchsorted(fused_rows, ranked)] += 1 / (self.fusion_k + np.arange(1, len(ranked) + 1))
+
+        results = self.aggregator.rank(fused, limit, fused_rows, address_mask)
+        if len(results) < limit:
+            results += [r for r in self.search(query, limit, filters) if r not in results][:limit - len(results)]
+        return results
+
+    def search_many(self, queries: list or np.ndarray, limit: int, filters: dict = None) -> list:
+        """
+        Ranks the conversations of many queries with matrix-matrix products
+
+        Queries are scored in batches sized to bound the score matrix to `batch_cells` cells, and
+        always scan the whole (filtered) matrix: one GEMM over every chunk is cheaper per query than
+        gathering per-query ANN or quantization candidates.
+
+        :param queries: query embeddings, one per row
+        :param limit: number of distinct conversations to return per query
+        :param filters: metadata filters applied before scoring (see MetadataFilter.mask)
+
+        :return: one list of conversation ids per query, ordered by their aggregated chunk scores
+        """
+        allowed, address_mask = self._filter(filters, embedded=True)
+        rows = np.arange(len(self)) if allowed is None else allowed
+        if not len(rows) or not len(queries):
+            return [[] for _ in range(len(queries))]
+
+        queries = self._queries(np.vstack(queries))
+        batch = max(1, self.batch_cells // len(rows))
+        results = []
+        for start in range(0, len(queries), batch):
+            block = queries[start:start + batch]
+            scores = np.empty((len(rows), len(block)), dtype=np.float32)
+            for position in range(0, len(rows), self.block_size):
+                selected = rows[position:position + self.block_size]
+                matrix = self.matrix[selected[0]:selected[-1] + 1] if allowed is None else self.matrix[selected]
+                scores[position:position + len(selected)] = np.asarray(matrix, dtype=np.float32) @ block.T
+            results.extend(
+                self.aggregator.rank(scores[:, column], limit, allowed, address_mask)
+                for column in range(len(block)))
+
+        return results
+
+    def _queries(self, queries: list or np.ndarray) -> np.ndarray:
+        # a longer query embedding (e.g. cached before the store was shortened) is truncated the same way
+        queries = np.asarray(queries, dtype=np.float32)
+        return self.normalize(queries[..., :self.dimensions])
+
+    def _filter(self, filters: dict or None, embedded: bool = False) -> tuple:
+        if not filters or self.metadata is None:
+            return None, None
+        allowed, address_mask = self.metadata.mask(filters)
+        # the rows after the matrix rows have no embedding to score
+        return allowed[allowed < len(self)] if embedded else allowed, address_mask
+
+    def _candidates(self, query: np.ndarray, allowed: np.ndarray = None) -> np.ndarray or None:
+        # a selective filter already shrinks the scan enough to score its rows exactly
+        rows = allowed
+        if self.ann is not None and len(self.ann) == len(self) and (allowed is None or len(allowed) * 4 > len(self)):
+            probed = self.ann.candidates(query)
+            rows = probed if allowed is None else np.intersect1d(probed, allowed, assume_unique=True)
+        if self.quantizer is not None and len(self.quantizer) == len(self):
+            shortlist = self.quantizer.shortlist(query, rows)
+            rows = rows if rows is not None and len(shortlist) == len(rows) else shortlist
+        return rows
+
+    def _top(self, rows: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        if len(scores) > self.fusion_depth:
+            selected = np.argpartition(-scores, self.fusion_depth - 1)[:self.fusion_depth]
+            rows, scores = rows[selected], scores[selected]
+        return rows[np.argsort(-scores, kind="stable")]
+
+    def _lexical_scores(self, text: str, allowed: np.ndarray = None) -> tuple:
+        scores = self.lexical.scores(text)
+        if len(self._lexical_rows) != len(scores):
+            row_of = {msg_hash: row for row, msg_hash in enumerate(self.hashes)}
+            self._lexical_rows = np.fromiter(
+                (row_of.get(msg_hash, -1) for msg_hash in self.lexical.documents),
+                dtype=np.int64, count=len(self.lexical.documents))
+
+        # chunks indexed lexically but no longer stored have no row to rank
+        kept = (self._lexical_rows >= 0) & (scores > 0)
+        if allowed is not None:
+            kept &= np.isin(self._lexical_rows, allowed)
+        return self._lexical_rows[kept], scores[kept]
@@ -0,0 +1,41 @@
+import pytest
+
+from search.cache import SearchCache
+
+
+def filled(path, **kwargs):
+    cache = SearchCache(str(path), max_entries=3, **kwargs)
+    cache.load()
+    for key in ("a", "b", "c"):
+        cache.put_results(key, {"results": [key]})
+    return cache
+
+
+def reloaded(path):
+    cache = SearchCache(str(path), max_entries=3)
+    cache.load()
+    return cache
+
+
+def test_close_persists_recency_of_hits(tmp_path):
+    cache = filled(tmp_path)
+    assert cache.get_results("a") == {"results": ["a"]}
+    cache.close()
+
+    restarted = reloaded(tmp_path)
+    restarted.put_results("d", {"results": ["d"]})
+    # "b" is the least recently used entry once the hit on "a" is remembered
+    assert restarted.get_results("b") is None
+    assert restarted.get_results("a") == {"results": ["a"]}
+    assert restarted.get_results("c") == {"results": ["c"]}
+
+
+@pytest.mark.parametrize("index_hits, evicted", [(1, "b"), (2, "a")])
+def test_hits_are_written_periodically(tmp_path, index_hits, evicted):
+    cache = filled(tmp_path, index_hits=index_hits)
+    cache.get_results("a")
+    # without close, only a written index remembers the hit
+
+    restarted = reloaded(tmp_path)
+    restarted.put_results("d", {"results": ["d"]})
+    assert restarted.get_results(evicted) is None
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from search.filters import MetadataFilter
+from search.ranking import TopKAggregator
+
+MODELS = ["gpt-4o", "gpt-4", "gpt-3.5-turbo", ""]
+ROLES = ["user", "assistant", "tool"]
+
+
+def archive(seed, chunks=500, conversations=40):
+    rng = np.random.default_rng(seed)
+    addresses, messages = [], {}
+    for _ in range(chunks):
+        size = 1 if rng.random() < 0.85 else int(rng.integers(2, 4))
+        row = [[f"c{rng.integers(conversations)}", int(rng.integers(20))] for _ in range(size)]
+        for conversation_id, message_index in row:
+            messages.setdefault((conversation_id, message_index), (
+                str(np.datetime64("2024-01-01T00:00:00") + np.timedelta64(int(rng.integers(0, 90 * 86400)), "s")).replace("T", " "),
+                MODELS[rng.integers(len(MODELS))],
+                ROLES[rng.integers(len(ROLES))],
+            ))
+        addresses.append(row)
+    # some addresses have no message metadata and fall back to the epoch
+    messages.pop(next(iter(messages)))
+    return addresses, messages
+
+
+def reference(addresses, messages, filters):
+    # brute-force check of every address against the filters
+    mask = []
+    for row in addresses:
+        for conversation_id, message_index in row:
+            created_at, model, role = messages.get((conversation_id, message_index), ("1970-01-01 00:00:00", "", ""))
+            created_at = np.datetime64(created_at.replace(" ", "T"), "s")
+            mask.append(
+                (not filters.get("after") or created_at >= np.datetime64(filters["after"], "s"))
+                and (not filters.get("before") or created_at < np.datetime64(filters["before"], "s"))
+                and (not filters.get("models") or model in filters["models"])
+                and (not filters.get("roles") or role in filters["roles"])
+                and (not filters.get("include") or conversation_id in filters["include"])
+                and (not filters.get("exclude") or conversation_id not in filters["exclude"])
+            )
+    counts = [len(row) for row in addresses]
+    rows = sorted({row for row, allowed in zip(np.repeat(np.arange(len(addresses)), counts), mask) if allowed})
+    return rows, np.array(mask, dtype=bool)
+
+
+FILTERS = [
+    {},
+    {"after": "2024-02-01"},
+    {"before": "2024-02-01 12:00"},
+    {"after": "2024-01-15", "before": "2024-03-01"},
+    {"models": ["gpt-4o", "gpt-4"]},
+    {"models": ["unknown"]},
+    {"roles": ["user"]},
+    {"include": ["c1", "c2", "c3"]},
+    {"exclude": ["c1", "c2", "c3", "missing"]},
+    {"models": ["gpt-3.5-turbo"], "roles": ["assistant"], "exclude": ["c0"], "after": "2024-01-10"},
+    {"before": "1971-01-01"},
+]
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_mask_matches_brute_force(filters):
+    addresses, messages = archive(len(str(filters)))
+    aggregator = TopKAggregator().build(addresses)
+    metadata = MetadataFilter().build(addresses, aggregator, messages)
+
+    rows, mask = metadata.mask(filters)
+    expected_rows, expected_mask = reference(addresses, messages, filters)
+    assert rows.tolist() == expected_rows
+    assert np.array_equal(mask, expected_mask)
+    # the mask is aligned with the aggregator's addresses
+    assert np.array_equal(metadata.address_conversations, aggregator.address_conversations)
+
+
+def test_parse():
+    assert MetadataFilter.parse("after:2024-01-01 Model:gpt-4o,gpt-4 role:user in:abc not:def not:ghi") == {
+        "after": "2024-01-01",
+        "models": ["gpt-4o", "gpt-4"],
+        "roles": ["user"],
+        "include": ["abc"],
+        "exclude": ["def", "ghi"],
+    }
+    assert MetadataFilter.parse("") == {}
+
+
+@pytest.mark.parametrize("text", ["foo:bar", "model:", "after:yesterday", "nginx"])
+def test_parse_rejects_invalid_filters(text):
+    with pytest.raises(ValueError):
+        MetadataFilter.parse(text)
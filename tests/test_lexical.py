@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+from search.lexical import BM25Index
+from search.ranking import TopKAggregator
+from search.store import EmbeddingStore
+from search.vectors import VectorEngine
+
+TEXTS = {
+    "a": "nginx ssl certificate renewal with certbot",
+    "b": "docker compose nginx reverse proxy",
+    "c": "sqlite index query plan",
+    "d": "error E1234 in numpy-1.26.4 build",
+    "e": "nginx nginx nginx ssl",
+}
+
+
+def bm25(texts, query, k1=1.2, b=0.75):
+    # textbook BM25 over the tokenized texts
+    documents = {msg_hash: BM25Index.tokenize(text) for msg_hash, text in texts.items()}
+    average = np.mean([len(tokens) for tokens in documents.values()])
+    scores = dict.fromkeys(documents, 0.0)
+    for term in set(BM25Index.tokenize(query)):
+        matching = [msg_hash for msg_hash, tokens in documents.items() if term in tokens]
+        idf = np.log(1 + (len(documents) - len(matching) + 0.5) / (len(matching) + 0.5))
+        for msg_hash in matching:
+            tf = documents[msg_hash].count(term)
+            norm = k1 * (1 - b + b * len(documents[msg_hash]) / average)
+            scores[msg_hash] += idf * tf * (k1 + 1) / (tf + norm)
+    return scores
+
+
+def index(tmp_path, texts=TEXTS):
+    lexical = BM25Index(str(tmp_path / "lexical_index"))
+    for msg_hash, text in texts.items():
+        lexical.add(msg_hash, text)
+    return lexical
+
+
+def test_tokenize_keeps_identifiers_and_parts():
+    tokens = BM25Index.tokenize("Error E1234 in numpy-1.26.4")
+    assert tokens[:3] == ["error", "e1234", "in"]
+    assert {"numpy-1.26.4", "numpy", "1", "26", "4"} <= set(tokens)
+
+
+@pytest.mark.parametrize("query", ["nginx ssl", "sqlite query", "numpy-1.26.4", "unknown"])
+def test_scores_match_reference(tmp_path, query):
+    lexical = index(tmp_path)
+    expected = bm25(TEXTS, query)
+    assert np.allclose(lexical.scores(query), [expected[msg_hash] for msg_hash in lexical.documents], atol=1e-5)
+
+
+def test_save_load_round_trip(tmp_path):
+    lexical = index(tmp_path)
+    lexical.save()
+    assert not lexical.changed
+
+    loaded = BM25Index(lexical.path)
+    assert loaded.load()
+    assert loaded.documents == lexical.documents
+    assert np.allclose(loaded.scores("nginx ssl"), lexical.scores("nginx ssl"))
+    assert not loaded.add("a", TEXTS["a"])
+
+
+def test_remove_matches_rebuilt_index(tmp_path):
+    lexical = index(tmp_path)
+    lexical.scores("nginx")
+    assert lexical.remove(["b", "missing", "e"]) == 2
+    assert lexical.changed
+
+    rebuilt = index(tmp_path, {msg_hash: text for msg_hash, text in TEXTS.items() if msg_hash not in ("b", "e")})
+    assert lexical.documents == rebuilt.documents
+    for query in ("nginx ssl", "docker", "sqlite"):
+        assert np.allclose(lexical.scores(query), rebuilt.scores(query))
+
+
+def test_hybrid_fuses_ranks(tmp_path):
+    rng = np.random.default_rng(0)
+    hashes = list(TEXTS)
+    addresses = [[[f"conversation-{msg_hash}", 0]] for msg_hash in hashes]
+    embeddings = rng.normal(size=(len(hashes), 8))
+    engine = VectorEngine(aggregator=TopKAggregator(), lexical=index(tmp_path), fusion_k=60)
+    engine.build(hashes, addresses, embeddings)
+
+    query = rng.normal(size=8)
+    vector_order = np.argsort(-(engine.matrix @ engine.normalize(query)), kind="stable")
+    lexical_scores = bm25(TEXTS, "nginx ssl")
+    lexical_order = [hashes.index(msg_hash) for msg_hash in sorted(hashes, key=lambda h: -lexical_scores[h])
+                     if lexical_scores[msg_hash] > 0]
+    fused = np.zeros(len(hashes))
+    for order in (vector_order, lexical_order):
+        for rank, row in enumerate(order, start=1):
+            fused[row] += 1 / (60 + rank)
+    expected = [addresses[row][0][0] for row in np.argsort(-fused, kind="stable")[:3]]
+
+    assert engine.search_hybrid(query, "nginx ssl", 3) == expected
+
+
+def test_lexical_search_finds_chunks_without_embeddings(tmp_path):
+    store = EmbeddingStore(str(tmp_path / "vector_store"), "float32", 0)
+    store.update([("a", np.ones(4, dtype=np.float32))])
+    addresses = {msg_hash: [[f"conversation-{msg_hash}", 0]] for msg_hash in TEXTS}
+    engine = VectorEngine(aggregator=TopKAggregator(), lexical=index(tmp_path))
+    engine.build_from_store(store, addresses)
+
+    assert len(engine) == 1
+    assert engine.search_lexical("sqlite", 1) == ["conversation-c"]
+    assert engine.search_lexical("nginx", 5)[0] == "conversation-e"
+    assert engine.search(np.ones(4), 5) == ["conversation-a"]
+
+    empty = VectorEngine(aggregator=TopKAggregator(), lexical=index(tmp_path))
+    empty.build_from_store(EmbeddingStore(str(tmp_path / "empty"), "float32", 0), addresses)
+    assert empty.search_lexical("docker", 1) == ["conversation-b"]
+    assert empty.search_hybrid(np.ones(4), "docker", 1) == ["conversation-b"]
@@ -0,0 +1,41 @@
+from helpers.metadata import MetadataStore
+
+
+def conversation(conversation_id, contents):
+    return {
+        "conversation_id": conversation_id,
+        "conversation_title": f"Title {conversation_id}",
+        "created_at": "2024-01-01 00:00:00",
+        "conversation_url": f"https://chat.openai.com/c/{conversation_id}",
+        "total_processed_messages": len(contents),
+        "total_raw_messages": len(contents) + 1,
+        "messages": [{
+            "context": {"role": "user", "content": content},
+            "metadata": {"model": "user", "created_at": "2024-01-01 00:00:00", "conversation_id": conversation_id},
+        } for content in contents],
+    }
+
+
+def test_delete_conversation(tmp_path):
+    metadata = MetadataStore(str(tmp_path / "metadata.db"))
+    for conversation_id in ("a", "b"):
+        metadata.put_conversation(conversation(conversation_id, ["first message", "second message"]))
+        metadata.add_chunk(f"chunk-{conversation_id}", "first message")
+        metadata.add_address(f"chunk-{conversation_id}", conversation_id, 0)
+    metadata.commit()
+    revision = metadata.revision
+
+    metadata.clear_addresses("a")
+    metadata.delete_conversation("a")
+    metadata.ignore("a")
+    metadata.close()
+
+    reopened = MetadataStore(metadata.path)
+    assert reopened.revision == revision + 1
+    assert "a" not in reopened and reopened.conversation("a") is None
+    assert reopened.raw_message_counts() == {"b": 3}
+    assert set(reopened.message_metadata()) == {("b", 0), ("b", 1)}
+    assert reopened.ignored() == {"a"}
+    assert reopened.orphans() == ["chunk-a"]
+    assert [message["context"]["content"] for message in reopened.conversation("b")["messages"]] == [
+        "first message", "second message"]
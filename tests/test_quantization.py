@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+import pytest
+
+from search.quantization import quantizers
+
+
+def embeddings(rows=3000, dimensions=32, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(40, dimensions))
+    matrix = centers[rng.integers(len(centers), size=rows)] + 0.5 * rng.normal(size=(rows, dimensions))
+    return (matrix / np.linalg.norm(matrix, axis=1, keepdims=True)).astype(np.float32)
+
+
+def reference(quantizer, matrix, queries=100, k=10):
+    # leave-one-out recall: the query row is neither an exact neighbour nor a candidate
+    sample = np.sort(np.random.default_rng(quantizer.seed).choice(len(matrix), queries, replace=False))
+    recalls = []
+    for row in sample:
+        scores = matrix @ matrix[row]
+        scores[row] = -np.inf
+        exact = np.argsort(-scores)[:k]
+        candidates = quantizer.shortlist(matrix[row])
+        candidates = candidates[candidates != row]
+        reranked = candidates[np.argsort(-scores[candidates])[:k]]
+        recalls.append(len(np.intersect1d(exact, reranked)) / k)
+    return float(np.mean(recalls))
+
+
+@pytest.mark.parametrize("mode", list(quantizers))
+def test_evaluate_leaves_the_query_row_out(mode):
+    matrix = embeddings()
+    quantizer = quantizers[mode](os.devnull, candidates=32)
+    quantizer.sync(matrix)
+    assert quantizer.stats["recall"] == pytest.approx(reference(quantizer, matrix))
+
+
+def test_evaluate_does_not_count_self_matches():
+    # a shortlist of one row only ever holds the query itself
+    matrix = embeddings()
+    quantizer = quantizers["int8"](os.devnull, candidates=1)
+    quantizer.sync(matrix)
+    assert quantizer.stats["recall"] == 0.0
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from search.ranking import TopKAggregator
+
+
+def reference(addresses, scores, limit, reducer, top_n, rows=None, address_mask=None):
+    # full sort of every scored chunk, grouped per conversation
+    rows = np.arange(len(scores)) if rows is None else rows
+    chunks = {}
+    offsets = np.concatenate([[0], np.cumsum([len(row) for row in addresses])])
+    for row, score in zip(rows, scores):
+        for offset, (conversation_id, _) in enumerate(addresses[row]):
+            if address_mask is None or address_mask[offsets[row] + offset]:
+                chunks.setdefault(conversation_id, {})[row] = score
+
+    aggregated = {}
+    for conversation_id, by_row in chunks.items():
+        ranked = sorted(by_row.values(), reverse=True)
+        if reducer == "max":
+            aggregated[conversation_id] = ranked[0]
+        elif reducer == "sum":
+            aggregated[conversation_id] = sum(ranked)
+        else:
+            aggregated[conversation_id] = sum(ranked[:top_n]) / len(ranked[:top_n])
+    return sorted(aggregated, key=lambda conversation_id: -aggregated[conversation_id])[:limit]
+
+
+def archive(seed, chunks=2000, conversations=300):
+    rng = np.random.default_rng(seed)
+    addresses = []
+    for _ in range(chunks):
+        # most chunks belong to one conversation, some are shared by several
+        size = 1 if rng.random() < 0.9 else int(rng.integers(2, 4))
+        addresses.append([[f"c{rng.integers(conversations)}", int(rng.integers(50))] for _ in range(size)])
+    return rng, addresses
+
+
+@pytest.mark.parametrize("reducer", TopKAggregator.reducers)
+@pytest.mark.parametrize("limit", [1, 5, 20])
+def test_rank_matches_full_sort(reducer, limit):
+    rng, addresses = archive(limit)
+    aggregator = TopKAggregator(reducer=reducer, top_n=3).build(addresses)
+    for _ in range(5):
+        scores = rng.normal(size=len(addresses)).astype(np.float32)
+        assert aggregator.rank(scores, limit) == reference(addresses, scores, limit, reducer, 3)
+
+
+@pytest.mark.parametrize("reducer", TopKAggregator.reducers)
+def test_rank_over_scored_rows_and_mask(reducer):
+    rng, addresses = archive(7)
+    aggregator = TopKAggregator(reducer=reducer, top_n=2).build(addresses)
+    rows = np.sort(rng.choice(len(addresses), size=800, replace=False))
+    scores = rng.random(len(rows)).astype(np.float32)
+    address_mask = rng.random(int(aggregator.offsets[-1])) < 0.7
+
+    assert aggregator.rank(scores, 10, rows, address_mask) == reference(
+        addresses, scores, 10, reducer, 2, rows, address_mask)
+
+
+def test_mean_prefers_consistent_conversation():
+    addresses = [[["spike", 0]], [["spike", 1]], [["spike", 2]], [["steady", 0]], [["steady", 1]], [["steady", 2]]]
+    scores = np.array([0.9, 0.1, 0.1, 0.85, 0.84, 0.83], dtype=np.float32)
+    aggregator = TopKAggregator(reducer="mean", top_n=3, window=1).build(addresses)
+
+    assert aggregator.rank(scores, 1) == ["steady"]
+    assert aggregator.rank(scores, 2) == ["steady", "spike"]
+
+
+def test_rank_is_stable_across_limits():
+    rng, addresses = archive(11)
+    aggregator = TopKAggregator(reducer="mean", top_n=3).build(addresses)
+    scores = rng.normal(size=len(addresses)).astype(np.float32)
+
+    assert aggregator.rank(scores, 20)[:5] == aggregator.rank(scores, 5)
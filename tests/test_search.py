@@ -0,0 +1,96 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from main import ChatGPTSearchEngine
+from search.cache import SearchCache
+from search.lexical import BM25Index
+from search.ranking import TopKAggregator
+from search.vectors import VectorEngine
+
+WORDS = ["nginx", "ssl", "docker", "sqlite", "index", "query", "numpy", "build", "proxy", "cache"]
+QUERIES = ["nginx ssl proxy", "sqlite index", "numpy build cache"]
+
+
+class Embeddings:
+    # stands in for the embeddings client; every query gets a fixed random embedding
+    def __init__(self):
+        self.requests = []
+        self.queued = []
+
+    @staticmethod
+    def embed(context):
+        seed = sum(context.encode("utf-8"))
+        return np.random.default_rng(seed).normal(size=16).astype(np.float32)
+
+    async def get_response(self, context, identifier, **kwargs):
+        self.requests.append(identifier)
+        return {"identifier": identifier, "output": self.embed(context), "status": 200}
+
+    def add_get_response(self, context, identifier, **kwargs):
+        self.requests.append(identifier)
+        self.queued.append((context, identifier))
+
+    async def stream_get_response(self):
+        queued, self.queued = self.queued, []
+        for context, identifier in queued:
+            yield {"identifier": identifier, "output": self.embed(context), "status": 200}
+
+
+def engine(tmp_path, mode):
+    rng = np.random.default_rng(3)
+    hashes = [f"h{i}" for i in range(60)]
+    addresses = [[[f"conv-{rng.integers(20)}", 0]] for _ in hashes]
+    lexical = None
+    if mode != "vector":
+        lexical = BM25Index(str(tmp_path / "lexical_index"))
+        for msg_hash in hashes:
+            lexical.add(msg_hash, " ".join(rng.choice(WORDS, size=4)))
+
+    search_engine = ChatGPTSearchEngine.__new__(ChatGPTSearchEngine)
+    search_engine._configs = {"search_mode": mode}
+    search_engine._embeddings = Embeddings()
+    search_engine._embedding_params = {}
+    search_engine.search_cache = SearchCache(str(tmp_path / "search_cache"))
+    search_engine.index_version = "v1"
+    search_engine.embedding_version = ("model", 0)
+    search_engine.lexical_index = lexical
+    search_engine.vector_engine = VectorEngine(aggregator=TopKAggregator(), lexical=lexical)
+    search_engine.vector_engine.build(hashes, addresses, rng.normal(size=(len(hashes), 16)))
+    return search_engine
+
+
+def search(search_engine, query):
+    return asyncio.run(search_engine.search(query, search_engine.generate_hash(query), 4))["results"]
+
+
+@pytest.mark.parametrize("mode", ["vector", "hybrid"])
+def test_batch_results_do_not_replace_single_search_results(tmp_path, mode):
+    search_engine = engine(tmp_path, mode)
+    expected = {}
+    for query in QUERIES:
+        embedding = Embeddings.embed(query)
+        expected[query] = (search_engine.vector_engine.search(embedding, 4) if mode == "vector"
+                           else search_engine.vector_engine.search_hybrid(embedding, query, 4))
+    if mode == "hybrid":
+        # the fixture only checks the cache if fusion changes the ranking
+        assert any(expected[query] != search_engine.vector_engine.search(Embeddings.embed(query), 4) for query in QUERIES)
+
+    asyncio.run(search_engine.search_many(QUERIES, 4))
+    assert {query: search(search_engine, query) for query in QUERIES} == expected
+
+
+@pytest.mark.parametrize("mode", ["vector", "lexical", "hybrid"])
+def test_search_many_matches_search(tmp_path, mode):
+    many = asyncio.run(engine(tmp_path / "many", mode).search_many(QUERIES, 4))
+    single = engine(tmp_path / "single", mode)
+    assert [entry["results"] for entry in many] == [search(single, query) for query in QUERIES]
+
+
+def test_lexical_mode_does_not_embed(tmp_path):
+    search_engine = engine(tmp_path, "lexical")
+    results = asyncio.run(search_engine.search_many(QUERIES, 4))
+    assert not search_engine._embeddings.requests
+    assert [entry["results"] for entry in results] == [
+        search_engine.vector_engine.search_lexical(query, 4) for query in QUERIES]
@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+from search.store import EmbeddingStore
+
+
+def records(start, stop, dimensions=8):
+    return [(f"h{i}", np.random.default_rng(i).normal(size=dimensions).astype(np.float32)) for i in range(start, stop)]
+
+
+def normalized(embedding, dimensions=None):
+    vector = np.asarray(embedding[:dimensions], dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def reopen(store, **kwargs):
+    reopened = EmbeddingStore(store.path, **kwargs)
+    assert reopened.open()
+    return reopened
+
+
+def assert_rows(store, expected, atol=1e-6):
+    # expected maps every live hash to its original embedding
+    assert {msg_hash for msg_hash in store.hashes if store.row(msg_hash) is not None} == set(expected)
+    for msg_hash, embedding in expected.items():
+        row = store.row(msg_hash)
+        assert store.hashes[row] == msg_hash
+        np.testing.assert_allclose(np.asarray(store.matrix[row], dtype=np.float32), normalized(embedding), atol=atol)
+
+
+@pytest.mark.parametrize("dtype, atol", [("float32", 1e-6), ("float16", 1e-3)])
+def test_round_trip(tmp_path, dtype, atol):
+    store = EmbeddingStore(str(tmp_path / "store"), dtype=dtype)
+    assert not store.open()
+    assert store.update(records(0, 10), model="m") == range(0, 10)
+    assert store.update(records(5, 15)) == range(10, 15)
+
+    reopened = reopen(store, dtype=dtype)
+    assert len(reopened) == 15 and len(reopened.segments) == 2
+    assert reopened.header["model"] == "m"
+    assert reopened.matrix.dtype == np.dtype(dtype)
+    assert_rows(reopened, dict(records(0, 15)), atol)
+    assert np.asarray(reopened.matrix).shape == (15, 8)
+
+
+def test_update_skips_known_and_empty_records(tmp_path):
+    store = EmbeddingStore(str(tmp_path / "store"))
+    store.update(records(0, 4))
+    assert store.update(records(0, 4) + [("h9", None)]) == range(4, 4)
+    assert len(store.segments) == 1
+
+
+def test_delete_tombstones_until_compaction(tmp_path):
+    store = EmbeddingStore(str(tmp_path / "store"), max_tombstones=0.25)
+    store.update(records(0, 10))
+    store.update(records(10, 20))
+    rows = {msg_hash: store.row(msg_hash) for msg_hash in store.hashes}
+
+    assert store.delete(["h3", "h12", "missing"]) == 2
+    assert store.delete(["h3"]) == 0
+    assert store.tombstones == {rows["h3"], rows["h12"]}
+    assert not store.needs_compaction
+
+    reopened = reopen(store)
+    assert len(reopened) == 20
+    assert reopened.tombstones == {rows["h3"], rows["h12"]}
+    assert reopened.row("h3") is None and reopened.row("h12") is None
+    assert {msg_hash: reopened.row(msg_hash) for msg_hash in reopened.hashes if reopened.row(msg_hash) is not None} == {
+        msg_hash: row for msg_hash, row in rows.items() if msg_hash not in ("h3", "h12")
+    }
+
+    reopened.delete([f"h{i}" for i in range(4)])
+    assert reopened.needs_compaction
+    assert reopened.compact()
+    expected = {msg_hash: embedding for msg_hash, embedding in records(0, 20) if msg_hash not in ("h0", "h1", "h2", "h3", "h12")}
+
+    compacted = reopen(store)
+    assert len(compacted) == 15 and len(compacted.segments) == 1
+    assert not compacted.tombstones
+    assert compacted.header["generation"] == 1
+    assert compacted.hashes == [msg_hash for msg_hash, _ in records(0, 20) if msg_hash in expected]
+    assert_rows(compacted, expected)
+
+
+def test_merge_keeps_row_ids(tmp_path):
+    store = EmbeddingStore(str(tmp_path / "store"), max_segments=2)
+    for start in range(0, 16, 4):
+        store.update(records(start, start + 4))
+    store.delete(["h5"])
+    rows = {msg_hash: store.row(msg_hash) for msg_hash in store.hashes}
+    assert store.needs_merge
+
+    assert store.merge()
+    assert len(store.segments) < 4
+    assert sum(segment["count"] for segment in store.segments) == 16
+    assert len(list((tmp_path).glob("store-*.bin"))) == len(store.segments)
+
+    reopened = reopen(store)
+    assert {msg_hash: reopened.row(msg_hash) for msg_hash in reopened.hashes} == rows
+    assert reopened.row("h5") is None and reopened.tombstones == {5}
+    assert_rows(reopened, {msg_hash: embedding for msg_hash, embedding in records(0, 16) if msg_hash != "h5"})
+
+
+def test_dimensions_and_truncate(tmp_path):
+    store = EmbeddingStore(str(tmp_path / "store"))
+    store.update(records(0, 6))
+
+    shortened = EmbeddingStore(store.path, dimensions=4)
+    assert shortened.open()
+    assert shortened.truncate()
+
+    reopened = reopen(store)
+    assert reopened.matrix.shape == (6, 4)
+    for msg_hash, embedding in records(0, 6):
+        np.testing.assert_allclose(reopened.matrix[reopened.row(msg_hash)], normalized(embedding, 4), atol=1e-6)
+
+
+def test_corrupted_manifest(tmp_path):
+    store = EmbeddingStore(str(tmp_path / "store"))
+    store.update(records(0, 3))
+    with open(store.sidecar_path, "w") as file:
+        file.write("{")
+    assert not EmbeddingStore(store.path).open()